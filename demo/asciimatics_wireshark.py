@@ -6,10 +6,9 @@ from asciimatics.exceptions import NextScene, StopApplication
 from scapy.all import sniff, IP, TCP, UDP, Raw, conf, get_if_list, logging as scapy_logging
 from scapy.layers.http import HTTP, HTTPRequest, HTTPResponse
 from threading import Thread, Lock
-import queue
 import time
-import re
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from itertools import islice
 import argparse
 import netifaces
 from asciimatics.event import KeyboardEvent
@@ -18,8 +17,22 @@ import socket
 import threading
 from datetime import datetime
 import logging
+import struct
 import sys
 
+import numpy as np
+
+from capture_backend import RecvBatchPool, FanoutCapture, LossAccounting, read_packet_stats
+from handoff import HandoffBuffer
+from packet_store import PacketStore, FLAG_MATCHED, INDEX_FIELDS
+from flow_table import FlowTable, SORT_KEYS
+from tcp_reassembly import TcpReassembler
+from http_parser import HttpConnection, HTTP_STARTS
+from display_filter import compile_node, index_candidates, parse, SYNTAX_HELP
+from fast_dissect import LINKTYPE_ETHERNET, dissect, format_address
+from batch_dissect import dissect_batch, pcap_batches
+from pcap_file import PcapReader, RotatingPcapWriter, replay
+
 # 添加日志配置
 def setup_logging():
     """配置日志记录"""
@@ -52,168 +65,313 @@ def setup_logging():
     
     return logger
 
+# 数据包记录的内存开销估算 (字节)
+RAW_RECORD_OVERHEAD = 512
+SCAPY_PACKET_OVERHEAD = 4096
+
+def parse_frame_header(frame, linktype=LINKTYPE_ETHERNET):
+    """从原始帧中提取头部摘要，非 IP 帧或不支持的链路类型返回 None
+
+    由 fast_dissect 解析链路层、VLAN/QinQ 标签和 IPv4/IPv6 (含扩展头)。
+    """
+    try:
+        dissection = dissect(frame, linktype)
+    except (struct.error, IndexError, ValueError):
+        return None
+    if not dissection.ip_version:
+        return None
+        
+    header = {
+        'src': format_address(dissection.src, dissection.ip_version),
+        'dst': format_address(dissection.dst, dissection.ip_version),
+        'length': len(frame),
+    }
+    if dissection.proto in (6, 17) and dissection.l4_fields:
+        header['protocol'] = 'TCP' if dissection.proto == 6 else 'UDP'
+        header['sport'], header['dport'] = dissection.sport, dissection.dport
+        if dissection.proto == 6:
+            header['tcp_flags'] = dissection.l4_fields[2]
+    return header
+
+def parse_raw_frame(frame, time_ns, linktype=LINKTYPE_ETHERNET):
+    """把原始帧转换为只含头部摘要和原始字节的数据包记录
+
+    time_ns 为内核接收时间戳 (整数纳秒)，time 为对应的秒数，仅用于显示；
+    linktype 随记录保存，之后的 scapy 解析和 TCP 重组按它解释原始字节。
+    """
+    header = parse_frame_header(frame, linktype)
+    if header is None:
+        return None
+    packet_info = {'time_ns': time_ns, 'time': time_ns / 1e9, 'raw': bytes(frame),
+                   'linktype': linktype}
+    packet_info.update(header)
+    return packet_info
+
+def parse_raw_batch(batch, columns=None):
+    """按批解析原始帧，返回与 parse_raw_frame 相同的数据包记录，非 IP 帧被跳过
+
+    columns 为已经算好的 dissect_batch 结果 (例如 fanout 工作进程回传的)，省略时在此解析。
+    """
+    if columns is None:
+        columns = dissect_batch(batch)
+    sources = columns.src_addresses()
+    destinations = columns.dst_addresses()
+    rows = np.flatnonzero(columns.ip_version).tolist()
+    view = memoryview(batch.data)
+    offsets = batch.offsets.tolist()
+    timestamps = columns.ts_ns.tolist()
+    lengths = columns.length.tolist()
+    protocols = columns.proto.tolist()
+    has_ports = columns.l4.tolist()
+    sports = columns.sport.tolist()
+    dports = columns.dport.tolist()
+    tcp_flags = columns.tcp_flags.tolist()
+    linktype = batch.linktype
+    packets = []
+    for row in rows:
+        time_ns = timestamps[row]
+        offset = offsets[row]
+        length = lengths[row]
+        packet_info = {
+            'time_ns': time_ns,
+            'time': time_ns / 1e9,
+            'raw': bytes(view[offset:offset + length]),
+            'linktype': linktype,
+            'src': sources[row],
+            'dst': destinations[row],
+            'length': length,
+        }
+        proto = protocols[row]
+        if proto in (6, 17) and has_ports[row]:
+            packet_info['protocol'] = 'TCP' if proto == 6 else 'UDP'
+            packet_info['sport'] = sports[row]
+            packet_info['dport'] = dports[row]
+            if proto == 6:
+                packet_info['tcp_flags'] = tcp_flags[row]
+        packets.append(packet_info)
+    return packets
+
+def estimate_packet_size(packet_info):
+    """估算数据包记录占用的内存 (字节)
+
+    原生记录为字典加原始字节；scapy 解析后的对象每层都有大量属性，按固定开销估算。
+    """
+    overhead = SCAPY_PACKET_OVERHEAD if 'raw_packet' in packet_info else RAW_RECORD_OVERHEAD
+    return packet_info.get('length', 0) + overhead
+
+def dissect_packet(packet_info):
+    """按需获取 scapy 解析结果
+
+    scapy 引擎直接保存了解析后的对象；原生引擎只保存原始字节，
+    在第一次查看详情时才按记录的链路类型用 scapy 解析并缓存。
+    """
+    packet = packet_info.get('raw_packet')
+    if packet is None:
+        layer = conf.l2types.get(packet_info.get('linktype', LINKTYPE_ETHERNET), Raw)
+        packet = layer(packet_info['raw'])
+        packet.time = packet_info['time']
+        packet_info['raw_packet'] = packet
+    return packet
+
 class HTTPSession:
-    """HTTP会话管理类"""
-    def __init__(self):
-        self.sessions = {}  # 使用字典存储会话
+    """HTTP会话管理类
+
+    TCP 段先由 TcpReassembler 按序重组，每个连接的两个方向交给 http_parser 的
+    HttpConnection 增量解析，跨多个段的报文头、分块编码和流水线的报文都能正确切分，
+    缺口的处理见 HttpStreamParser.gap。每个连接保留最近的一对请求和响应。
+
+    会话按最近一次更新的顺序保存，最新的在末尾，读取最新的若干个会话不需要排序；
+    格式化后的文本按会话缓存，会话更新时失效。会话数、空闲时间 (按数据包时间)
+    或报文头总字节数超出上限时，从最久没有更新的会话开始淘汰。
+    """
+    def __init__(self, max_sessions=10000, max_age=600.0, max_bytes=16 * 1024 * 1024):
+        self.sessions = OrderedDict()  # 连接 -> 会话，按最近一次更新排序
         self.session_id = 0
-        
-    def add_packet(self, packet):
-        """添加数据包到会话"""
-        if not (TCP in packet and Raw in packet):
-            return
-        
-        payload = packet[Raw].load
-        if not (b'HTTP/' in payload or b'GET ' in payload or b'POST ' in payload):
-            return
-        
-        # 使 IP:Port 对作为会话标识
-        session_key = None
-        try:
-            if b'HTTP/' in payload and b'\r\n\r\n' in payload:
-                # 响应包
-                client = f"{packet[IP].dst}:{packet[TCP].dport}"
-                server = f"{packet[IP].src}:{packet[TCP].sport}"
-                session_key = f"{client}-{server}"
-            elif b'GET ' in payload or b'POST ' in payload:
-                # 请求包
-                client = f"{packet[IP].src}:{packet[TCP].sport}"
-                server = f"{packet[IP].dst}:{packet[TCP].dport}"
-                session_key = f"{client}-{server}"
-        except:
+        self.version = 0  # 会话变化时递增，界面据此判断是否需要刷新
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.bytes = 0  # 所有会话报文头的字节数
+        # 按原因统计的淘汰数
+        self.evicted_count = 0
+        self.evicted_age = 0
+        self.evicted_bytes = 0
+        self._parsers = {}  # 连接 -> HttpConnection，连接中第一块数据不是 HTTP 时为 None
+        self._now = 0.0
+        self.reassembler = TcpReassembler(self._on_data, self._on_gap, self._on_close)
+
+    def add_packet(self, packet_info):
+        """添加数据包记录到会话，原生引擎带原始帧和链路类型，scapy 引擎取 raw_packet"""
+        if packet_info.get('protocol') != 'TCP':
             return
-        
-        if session_key:
-            if session_key not in self.sessions:
-                self.sessions[session_key] = {
-                    'id': self.session_id,
-                    'request': None,
-                    'response': None,
-                    'timestamp': time.time()
-                }
-                self.session_id += 1
-            
-            try:
-                decoded_payload = payload.decode('utf-8', errors='ignore')
-                if b'GET ' in payload or b'POST ' in payload:
-                    self.sessions[session_key]['request'] = decoded_payload
-                else:
-                    self.sessions[session_key]['response'] = decoded_payload
-            except:
-                pass
-        
-    def get_http_streams(self):
-        """重组HTTP流"""
-        # 按时间戳排序并格式化会话
-        sorted_sessions = sorted(
-            self.sessions.items(),
-            key=lambda x: x[1]['timestamp'],
-            reverse=True
-        )
-        return [(session['id'], self._format_session(req, resp))
-                for _, session in sorted_sessions
-                if (req := session['request']) is not None
-                or (resp := session['response']) is not None]
+        self._now = packet_info['time']
+        frame = packet_info.get('raw')
+        if frame is None:
+            # scapy 对象从 IP 层取字节，与链路层类型无关
+            self.reassembler.add_packet(packet_info['raw_packet'])
+        else:
+            self.reassembler.add_frame(frame, packet_info['time_ns'],
+                                       packet_info.get('linktype', LINKTYPE_ETHERNET))
+
+    def _on_data(self, key, direction, data):
+        parser = self._parsers.get(key, False)
+        if parser is False:
+            # 只为以 HTTP 起始行开头的连接创建解析器，其他 TCP 流量直接丢弃
+            parser = None
+            if data.startswith(HTTP_STARTS):
+                parser = HttpConnection(on_head=lambda _, message, key=key: self._record(key, message))
+            self._parsers[key] = parser
+        if parser is not None:
+            parser.feed(direction, data)
+
+    def _record(self, key, message):
+        session = self.sessions.get(key)
+        if session is None:
+            session = self.sessions[key] = {
+                'id': self.session_id,
+                'request': None,
+                'response': None,
+                'timestamp': self._now,
+                'text': None,  # 格式化文本的缓存
+                'bytes': 0
+            }
+            self.session_id += 1
+        else:
+            self.sessions.move_to_end(key)
+        field = 'request' if message.is_request else 'response'
+        head = message.head_text()
+        size = len(head) - len(session[field] or '')
+        session[field] = head
+        session['bytes'] += size
+        self.bytes += size
+        session['text'] = None
+        session['timestamp'] = self._now
+        self.version += 1
+        self._evict()
+
+    def _evict(self):
+        """淘汰超出上限的会话，刚更新的会话在末尾，只有 max_sessions 为 0 时才会被淘汰"""
+        sessions = self.sessions
+        while len(sessions) > self.max_sessions:
+            self._pop_oldest()
+            self.evicted_count += 1
+        while self.bytes > self.max_bytes and len(sessions) > 1:
+            self._pop_oldest()
+            self.evicted_bytes += 1
+        deadline = self._now - self.max_age
+        while sessions and next(iter(sessions.values()))['timestamp'] < deadline:
+            self._pop_oldest()
+            self.evicted_age += 1
+
+    def _pop_oldest(self):
+        _, session = self.sessions.popitem(last=False)
+        self.bytes -= session['bytes']
+
+    def _on_gap(self, key, direction, missing):
+        parser = self._parsers.get(key)
+        if parser is not None:
+            parser.gap(direction, missing)
+
+    def _on_close(self, key):
+        parser = self._parsers.pop(key, None)
+        if parser is not None:
+            parser.close()
+
+    def get_http_streams(self, limit=None):
+        """最新的 limit 个会话 [(编号, 格式化文本)]，从新到旧"""
+        streams = []
+        for session in islice(reversed(self.sessions.values()), limit):
+            text = session['text']
+            if text is None:
+                text = session['text'] = self._format_session(session['request'], session['response'])
+            streams.append((session['id'], text))
+        return streams
         
     def _format_session(self, request, response):
-        """格式化会话"""
+        """格式化会话，请求和响应只保存了报文头"""
         formatted = []
         if request:
-            formatted.extend([
-                "=== Request ===",
-                request.split('\r\n\r\n')[0],  # 只显示头部
-                ""
-            ])
+            formatted.extend(["=== Request ===", request, ""])
         if response:
-            formatted.extend([
-                "=== Response ===",
-                response.split('\r\n\r\n')[0],  # 只显示头部
-                ""
-            ])
+            formatted.extend(["=== Response ===", response, ""])
         return '\n'.join(formatted)
 
+    def summary(self):
+        """会话数和淘汰统计，用于状态栏"""
+        text = f"HTTP: {len(self.sessions)} 个流"
+        if self.evicted_count or self.evicted_age or self.evicted_bytes:
+            text += (f" (淘汰: 数量 {self.evicted_count}, 超时 {self.evicted_age}, "
+                     f"字节 {self.evicted_bytes})")
+        return text
+
 class PacketFilter:
-    """数据包过滤器"""
+    """数据包过滤器
+
+    表达式在设置时由 display_filter 解析并编译为闭包，匹配时直接调用。
+    """
     def __init__(self):
         self.logger = logging.getLogger('wireshark_tui.filter')
         self.filter_expr = None
-        
-        # 定义支持的过滤器格式
-        self.filter_patterns = {
-            'ip.src': (r'ip\.src\s*=*\s*(\d+\.\d+\.\d+\.\d+)', 
-                      lambda p, m: IP in p and p[IP].src == m.group(1)),
-            'ip.dst': (r'ip\.dst\s*=*\s*(\d+\.\d+\.\d+\.\d+)', 
-                      lambda p, m: IP in p and p[IP].dst == m.group(1)),
-            'tcp.port': (r'tcp\.port\s*=*\s*(\d+)', 
-                        lambda p, m: TCP in p and (p[TCP].sport == int(m.group(1)) or 
-                                                 p[TCP].dport == int(m.group(1)))),
-            'udp.port': (r'udp\.port\s*=*\s*(\d+)', 
-                        lambda p, m: UDP in p and (p[UDP].sport == int(m.group(1)) or 
-                                                 p[UDP].dport == int(m.group(1)))),
-            'http': (r'http', 
-                    lambda p, _: TCP in p and Raw in p and 
-                    (b'HTTP/' in p[Raw].load or b'GET ' in p[Raw].load or 
-                     b'POST ' in p[Raw].load)),
-            'tcp': (r'tcp', lambda p, _: TCP in p),
-            'udp': (r'udp', lambda p, _: UDP in p)
-        }
+        self.node = None  # 语法树，用于从索引求历史匹配
+        self._matcher = None
 
     def set_filter(self, expr):
-        """设置过滤器表达式"""
+        """设置过滤器表达式，语法错误时抛出 ValueError"""
         self.logger.debug(f"设置过滤器: {expr}")
-        if not expr:
+        if not expr or not expr.strip():
             self.filter_expr = None
+            self.node = None
+            self._matcher = None
             return True
-            
-        # 规范化表达式
-        expr = expr.strip().lower()
-        
-        # 验证过滤器格式
-        valid = False
-        for pattern, _ in self.filter_patterns.values():
-            if re.match(pattern, expr):
-                valid = True
-                break
-                
-        if not valid:
-            raise ValueError(
-                "不支持的过滤器语法\n"
-                "支持的格式:\n"
-                "- ip.src=x.x.x.x\n"
-                "- ip.dst=x.x.x.x\n"
-                "- tcp.port=xxx\n"
-                "- udp.port=xxx\n"
-                "- http\n"
-                "- tcp\n"
-                "- udp"
-            )
-            
+
+        expr = expr.strip()
+        try:
+            node = parse(expr)
+            matcher = compile_node(node)
+        except ValueError as e:
+            raise ValueError(f"{e}\n{SYNTAX_HELP}") from None
+
         self.filter_expr = expr
+        self.node = node
+        self._matcher = matcher
         return True
 
-    def match(self, packet):
-        """匹配数据包"""
-        if not self.filter_expr:
+    def match(self, packet_info):
+        """匹配数据包记录"""
+        matcher = self._matcher
+        if matcher is None:
             return True
-            
+
         try:
-            # 遍历所有过滤器模式
-            for pattern, matcher in self.filter_patterns.values():
-                match = re.match(pattern, self.filter_expr)
-                if match:
-                    return matcher(packet, match)
-            return False
-            
+            return matcher(packet_info)
         except Exception as e:
             self.logger.debug(f"过滤匹配错误: {e}")
             return False
 
 class PacketCapture:
-    def __init__(self):
+    ENGINES = ('scapy', 'raw')
+
+    def __init__(self, engine='scapy', workers=1, writer=None, buffer_policy='drop-oldest',
+                 buffer_capacity=10000, buffer_bytes=64 * 1024 * 1024):
         self.logger = logging.getLogger('wireshark_tui.capture')
-        self.packets = queue.Queue()  # 所有数据包
-        self.filtered_packets = queue.Queue()  # 过滤后的数据包
-        self.http_streams = []  # HTTP流量
+        self.engine = engine
+        self.workers = workers
+        self.writer = writer
+        if self.writer:
+            self.writer.start()
+        self.fanout = None
+        self.reader = None
+        self._sock = None
+        # 原始帧的链路类型: 实时捕获为以太网，读取文件时为第一个接口的链路类型，
+        # 文件中的记录按各自接口的链路类型解析
+        self.linktype = LINKTYPE_ETHERNET
+        # 与界面线程之间的有界交接缓冲区，界面跟不上时按策略丢弃
+        self.packets = HandoffBuffer(buffer_capacity, buffer_bytes, buffer_policy)  # 所有数据包
+        self.filtered_packets = HandoffBuffer(buffer_capacity, buffer_bytes, buffer_policy)  # 过滤后的数据包
+        # 内核丢包累计，由 get_loss_summary 汇总
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+        self.loss = LossAccounting()
         self._http_requests = {}  # 临时存储HTTP请求
         self.filter = None
         self.interface = None
@@ -283,55 +441,12 @@ class PacketCapture:
             self.logger.debug(f"设置过滤器: {filter_expr}")
             if self.packet_filter.set_filter(filter_expr):
                 # 清空过滤队列
-                while not self.filtered_packets.empty():
-                    self.filtered_packets.get()
+                self.filtered_packets.clear()
                 return True
         except Exception as e:
             self.logger.error(f"设置过滤器失败: {e}")
             raise ValueError(str(e))
             
-    def _match_filter(self, packet):
-        """检查数据包是否匹配过滤器"""
-        self.logger.debug(f"开始过滤数据包: {packet.summary()}")
-        if not self.filter:
-            self.logger.debug("无过滤器，直接通过")
-            return True
-        
-        try:
-            # 使用内存中的过滤而不是临时文件
-            if 'ip.src' in self.filter:
-                src = re.search(r'ip.src\s*==\s*(\S+)', self.filter).group(1)
-                if IP not in packet or packet[IP].src != src:
-                    return False
-                
-            if 'ip.dst' in self.filter:
-                dst = re.search(r'ip.dst\s*==\s*(\S+)', self.filter).group(1)
-                if IP not in packet or packet[IP].dst != dst:
-                    return False
-                
-            if 'tcp.port' in self.filter:
-                port = int(re.search(r'tcp.port\s*==\s*(\d+)', self.filter).group(1))
-                if TCP not in packet or (packet[TCP].sport != port and packet[TCP].dport != port):
-                    return False
-                
-            if 'udp.port' in self.filter:
-                port = int(re.search(r'udp.port\s*==\s*(\d+)', self.filter).group(1))
-                if UDP not in packet or (packet[UDP].sport != port and packet[UDP].dport != port):
-                    return False
-                
-            if 'http' in self.filter.lower():
-                if not (TCP in packet and Raw in packet and 
-                       (b'HTTP/' in packet[Raw].load or 
-                        b'GET ' in packet[Raw].load or 
-                        b'POST ' in packet[Raw].load)):
-                    return False
-                
-            return True
-        
-        except Exception as e:
-            self.logger.debug(f"过滤匹配错误: {e}")
-            return False
-
     def start_capture(self, interface=None):
         """启动数据包捕获"""
         self.interface = interface
@@ -343,10 +458,17 @@ class PacketCapture:
         
         self._running = True
         self._stop_sniffer.clear()
-        self.capture_thread = threading.Thread(
-            target=self._capture_packets,
-            args=(self.packet_callback,)
-        )
+        self.linktype = LINKTYPE_ETHERNET
+        if self.workers > 1:
+            # fanout 工作进程只回传原始字节和头部摘要，相当于原生引擎
+            self.capture_thread = threading.Thread(target=self._capture_fanout)
+        elif self.engine == 'raw':
+            self.capture_thread = threading.Thread(target=self._capture_raw)
+        else:
+            self.capture_thread = threading.Thread(
+                target=self._capture_packets,
+                args=(self.packet_callback,)
+            )
         self.capture_thread.daemon = True
         self.capture_thread.start()
 
@@ -405,6 +527,159 @@ class PacketCapture:
         except Exception as e:
             self.logger.debug(f"Capture error: {e}")
 
+    def _capture_raw(self):
+        """原生引擎: 从 AF_PACKET 套接字批量读取原始帧，不经过 scapy 解析"""
+        try:
+            self.logger.debug("开始原生捕获数据包")
+            self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**25)
+            if self.interface:
+                self._sock.bind((self.interface, 0))
+            pool = RecvBatchPool(self._sock)
+            
+            while not self._stop_sniffer.is_set():
+                for time_ns, frame in pool.read_batch(timeout=0.1):
+                    self._handle_raw_frame(frame, time_ns)
+                    
+        except Exception as e:
+            self.logger.error(f"原生捕获错误: {e}")
+        finally:
+            if self._sock:
+                self._sock.close()
+                self._sock = None
+
+    def _handle_raw_frame(self, frame, time_ns, linktype=None):
+        """处理原生引擎捕获的帧，只保留原始字节和头部摘要
+
+        linktype 为空时使用捕获的链路类型，读取 pcapng 时按记录给出。
+        """
+        if not self._running:
+            return
+            
+        if linktype is None:
+            linktype = self.linktype
+        try:
+            if self.writer:
+                self.writer.write(frame, time_ns, linktype)
+            packet_info = parse_raw_frame(frame, time_ns, linktype)
+            if packet_info is not None:
+                self._enqueue_packet(packet_info)
+        except Exception as e:
+            self.logger.error(f"数据包处理错误: {e}")
+
+    def start_file(self, path, fast=False):
+        """从 pcap/pcapng 文件读取数据包，经过与实时捕获相同的处理流程"""
+        self.reader = PcapReader(path)
+        self.linktype = self.reader.linktype
+        self._running = True
+        self._stop_sniffer.clear()
+        self.capture_thread = threading.Thread(target=self._capture_file, args=(fast,))
+        self.capture_thread.daemon = True
+        self.capture_thread.start()
+
+    def _capture_file(self, fast):
+        """读取捕获文件中的记录，不按时间间隔回放时整批解析"""
+        try:
+            self.logger.debug(f"开始读取捕获文件: {self.reader.path}")
+            if fast:
+                self._capture_file_batches()
+            else:
+                for timestamp_ns, frame, linktype in replay(self.reader, fast):
+                    if self._stop_sniffer.is_set():
+                        break
+                    self._handle_raw_frame(frame, timestamp_ns, linktype)
+            self.logger.info(f"捕获文件读取结束: {self.reader.records} 条记录, "
+                             f"{self.reader.rate():.0f} 记录/秒")
+        except Exception as e:
+            self.logger.error(f"读取捕获文件错误: {e}")
+
+    def _capture_file_batches(self, batch_size=8192):
+        """按批向量化解析捕获文件"""
+        for batch in pcap_batches(self.reader, batch_size):
+            if self._stop_sniffer.is_set():
+                break
+            if self.writer:
+                for row in range(len(batch)):
+                    self.writer.write(batch.frame(row), int(batch.timestamps[row]), batch.linktype)
+            for packet_info in parse_raw_batch(batch):
+                self._enqueue_packet(packet_info)
+
+    def get_file_summary(self):
+        """离线读取进度与写盘摘要"""
+        summaries = []
+        if self.reader:
+            summaries.append(f"文件: {self.reader.records} 条记录, {self.reader.rate():.0f} 记录/秒")
+        if self.writer:
+            stats = self.writer.get_stats()
+            summaries.append(f"写入: {stats['written']} 帧, 积压 {stats['backlog']}, 丢弃 {stats['dropped']}, "
+                             f"失败 {stats['failed']}")
+        return " | ".join(summaries)
+
+    def _capture_fanout(self):
+        """多进程 fanout 捕获: 合并各工作进程回传的帧批次，解析结果由工作进程算好"""
+        try:
+            self.logger.debug(f"启动 {self.workers} 个 fanout 工作进程")
+            self.fanout = FanoutCapture(self.interface, self.workers)
+            self.fanout.start()
+            while not self._stop_sniffer.is_set():
+                for batch, columns in self.fanout.poll(timeout=0.1):
+                    if not self._running:
+                        break
+                    if self.writer:
+                        for row in range(len(batch)):
+                            self.writer.write(batch.frame(row), int(batch.timestamps[row]),
+                                              batch.linktype)
+                    for packet_info in parse_raw_batch(batch, columns):
+                        self._enqueue_packet(packet_info)
+        except Exception as e:
+            self.logger.error(f"fanout 捕获错误: {e}")
+        finally:
+            if self.fanout:
+                self.fanout.stop()
+
+    def get_loss_summary(self):
+        """汇总各阶段丢包: 内核、fanout 回传、显示队列、过滤队列、写盘
+
+        scapy 引擎的套接字由 AsyncSniffer 内部持有，无法读取内核统计。
+        """
+        if self.fanout:
+            stats = self.fanout.get_stats()
+            self.loss.update('kernel', stats['frames'] + stats['kernel_drops'], stats['kernel_drops'])
+            self.loss.update('workers', stats['frames'], stats['queue_drops'])
+        elif self._sock:
+            try:
+                packets, drops = read_packet_stats(self._sock)
+                self.kernel_packets += packets
+                self.kernel_drops += drops
+                self.loss.update('kernel', self.kernel_packets, self.kernel_drops)
+            except OSError:
+                pass
+        for stage, buffer in (('queue', self.packets), ('filtered', self.filtered_packets)):
+            if buffer.offered:
+                self.loss.update(stage, buffer.offered, buffer.dropped + buffer.evicted)
+        if self.writer:
+            stats = self.writer.get_stats()
+            lost = stats['dropped'] + stats['failed']
+            self.loss.update('writer', stats['written'] + stats['backlog'] + lost, lost)
+        return "丢包 " + self.loss.format(", ")
+
+    def get_buffer_summary(self):
+        """交接缓冲区占用摘要"""
+        stats = self.packets.get_stats()
+        return (f"缓冲({stats['policy']}) {stats['occupancy']}/{stats['capacity']} "
+                f"{stats['bytes'] / (1024 * 1024):.1f}/{stats['max_bytes'] / (1024 * 1024):.0f}MB "
+                f"峰值 {stats['high_watermark']} 溢出 {stats['dropped'] + stats['evicted']}")
+
+    def get_worker_summary(self):
+        """各 fanout 工作进程的吞吐与丢包摘要"""
+        if not self.fanout:
+            return ""
+        return " | ".join(
+            f"W{w['worker']}: {w.get('pps', 0):.0f}pps 丢包{w['drops'] + w['queue_drops']} "
+            f"流{w['flow_count']}"
+            for w in self.fanout.get_stats()['workers']
+        )
+
     def stop_capture(self):
         """停止捕获并清理资源"""
         self._running = False
@@ -424,19 +699,16 @@ class PacketCapture:
                 self.capture_thread = None
                 # 清理临时文件
                 self._cleanup_temp_files()
+                
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+        if self.writer:
+            self.writer.stop()
 
         # 清理数据包队列
-        while not self.packets.empty():
-            try:
-                self.packets.get_nowait()
-            except queue.Empty:
-                break
-                
-        while not self.filtered_packets.empty():
-            try:
-                self.filtered_packets.get_nowait()
-            except queue.Empty:
-                break
+        self.packets.clear()
+        self.filtered_packets.clear()
     def _cleanup_temp_files(self):
         """清理临时文件"""
         import os
@@ -467,11 +739,21 @@ class PacketCapture:
             return
             
         try:
+            # scapy 的 packet.time 来自内核接收时间戳
+            time_ns = int(packet.time * 1_000_000_000)
+            # 抓包接口不一定是以太网，链路类型取 scapy 第一层对应的类型
+            linktype = conf.l2types.layer2num.get(type(packet), LINKTYPE_ETHERNET)
+            if self.writer:
+                self.writer.write(packet.original or bytes(packet), time_ns, linktype)
+                
             # 提取基本信息
             packet_info = {
-                'time': time.time(),  # 使用当前时间
+                'time_ns': time_ns,
+                'time': time_ns / 1e9,
                 'src': packet[IP].src if IP in packet else '',
                 'dst': packet[IP].dst if IP in packet else '',
+                'length': len(packet),
+                'linktype': linktype,
                 'raw_packet': packet  # 保存原始数据包
             }
             
@@ -480,81 +762,35 @@ class PacketCapture:
                 packet_info['protocol'] = 'TCP'
                 packet_info['sport'] = packet[TCP].sport
                 packet_info['dport'] = packet[TCP].dport
+                packet_info['tcp_flags'] = int(packet[TCP].flags)
             elif UDP in packet:
                 packet_info['protocol'] = 'UDP'
                 packet_info['sport'] = packet[UDP].sport
                 packet_info['dport'] = packet[UDP].dport
                 
-            # 添加到主队列
-            try:
-                self.packets.put_nowait(packet_info)
-            except queue.Full:
-                try:
-                    self.packets.get_nowait()
-                    self.packets.put_nowait(packet_info)
-                except queue.Empty:
-                    pass
+            self._enqueue_packet(packet_info)
+                            
+        except Exception as e:
+            self.logger.error(f"数据包处理错误: {e}")
+
+    def _enqueue_packet(self, packet_info):
+        """将数据包放入主队列，并按过滤器放入过滤队列"""
+        try:
+            # 溢出由缓冲区按策略处理并计数
+            size = estimate_packet_size(packet_info)
+            self.packets.put(packet_info, size)
                     
             # 应用过滤器
             if self.packet_filter.filter_expr:
                 if self._match_filter(packet_info):
-                    try:
-                        self.filtered_packets.put_nowait(packet_info)
-                    except queue.Full:
-                        try:
-                            self.filtered_packets.get_nowait()
-                            self.filtered_packets.put_nowait(packet_info)
-                        except queue.Empty:
-                            pass
+                    self.filtered_packets.put(packet_info, size)
                             
         except Exception as e:
-            self.logger.error(f"数据包处理错误: {e}")
+            self.logger.error(f"数据包入队错误: {e}")
             
     def _match_filter(self, packet_info):
         """匹配过滤器"""
-        try:
-            if not self.packet_filter.filter_expr:
-                return True
-                
-            filter_expr = self.packet_filter.filter_expr.lower()
-            
-            # TCP 端口过滤
-            if 'tcp.port' in filter_expr:
-                if packet_info.get('protocol') != 'TCP':
-                    return False
-                port = int(re.search(r'tcp\.port\s*==\s*(\d+)', filter_expr).group(1))
-                return (packet_info.get('sport') == port or 
-                       packet_info.get('dport') == port)
-                       
-            # UDP 端口过滤
-            if 'udp.port' in filter_expr:
-                if packet_info.get('protocol') != 'UDP':
-                    return False
-                port = int(re.search(r'udp\.port\s*==\s*(\d+)', filter_expr).group(1))
-                return (packet_info.get('sport') == port or 
-                       packet_info.get('dport') == port)
-                       
-            # IP 源地址过滤
-            if 'ip.src' in filter_expr:
-                ip = re.search(r'ip\.src\s*==\s*([0-9.]+)', filter_expr).group(1)
-                return packet_info.get('src') == ip
-                
-            # IP 目标地址过滤
-            if 'ip.dst' in filter_expr:
-                ip = re.search(r'ip\.dst\s*==\s*([0-9.]+)', filter_expr).group(1)
-                return packet_info.get('dst') == ip
-                
-            # 协议过滤
-            if filter_expr == 'tcp':
-                return packet_info.get('protocol') == 'TCP'
-            if filter_expr == 'udp':
-                return packet_info.get('protocol') == 'UDP'
-                
-            return False
-            
-        except Exception as e:
-            self.logger.error(f"过滤匹配错误: {e}")
-            return False
+        return self.packet_filter.match(packet_info)
 
 class HTTPStream:
     """表示一个完整的 HTTP 请求-响应对"""
@@ -934,16 +1170,76 @@ class HTTPStreamViewer(Frame):
     def _back(self):
         raise NextScene("Main")
 
+class FlowView(BaseFrame):
+    """流表视图: 按所选方式排序显示最活跃的流，定期刷新"""
+    MAX_ROWS = 500
+    REFRESH_FRAMES = 20
+
+    def __init__(self, screen, flows, on_close):
+        super().__init__(screen, screen.height, screen.width, "Flows")
+        self._flows = flows
+        self._on_close = on_close
+        self._sort_names = list(SORT_KEYS)
+        self._sort = 0
+        self._last_refresh = 0
+
+        layout = Layout([1], fill_frame=True)
+        self.add_layout(layout)
+        self.summary_label = Label("")
+        layout.add_widget(self.summary_label)
+        layout.add_widget(Label("协议   发起方 <-> 响应方 状态 包(出/入) 字节(出/入) 持续时间"))
+        self.flow_listbox = ListBox(height=screen.height - 7, options=[])
+        layout.add_widget(self.flow_listbox)
+
+        button_layout = Layout([1, 1])
+        self.add_layout(button_layout)
+        self.sort_button = Button("", self._next_sort)
+        button_layout.add_widget(self.sort_button, 0)
+        button_layout.add_widget(Button("Close", self._close), 1)
+
+        self.fix()
+        self._refresh()
+
+    def _next_sort(self):
+        self._sort = (self._sort + 1) % len(self._sort_names)
+        self._refresh()
+
+    def _refresh(self):
+        sort = self._sort_names[self._sort]
+        self.sort_button.text = f"Sort: {sort}"
+        self.summary_label.text = self._flows.summary()
+        self.flow_listbox.options = [
+            (str(flow), i) for i, flow in enumerate(self._flows.top(self.MAX_ROWS, sort))
+        ]
+
+    def update(self, frame_no):
+        if frame_no - self._last_refresh >= self.REFRESH_FRAMES:
+            self._last_refresh = frame_no
+            self._refresh()
+        super().update(frame_no)
+
+    def _close(self):
+        self._on_close(self)
+
 class WiresharkTUI(Frame):
-    def __init__(self, screen, packet_capture):
+    HTTP_ROWS = 500  # HTTP 列表显示的最新会话数
+
+    def __init__(self, screen, packet_capture, history=100000, history_bytes=64 * 1024 * 1024,
+                 indexes=(), max_flows=1_000_000):
         self.logger = logging.getLogger('wireshark_tui.ui')
         self.logger.debug("初始化 WiresharkTUI")
         super().__init__(screen, screen.height, screen.width, title="Terminal Wireshark")
         self.packet_capture = packet_capture
         self.logger.debug("WiresharkTUI 初始化完成")
         self._last_frame = 0
-        self._packets = []  # 所有数据包
-        self._filtered_packets = []  # 过滤后的数据包
+        # 数据包历史，匹配过滤器的数据包带 FLAG_MATCHED 标志
+        self._packets = PacketStore(history, history_bytes, indexes)
+        # 连接跟踪，随数据包入库增量更新
+        self._flows = FlowTable(max_flows)
+        # HTTP 会话由重组后的 TCP 流解析
+        self._http = HTTPSession()
+        self._http_version = 0
+        self._http_streams = []
         self._filter_logs = []  # 过滤日志
         self._running = True
         
@@ -1001,11 +1297,12 @@ class WiresharkTUI(Frame):
         layout2.add_widget(self.details_view, 1)
         
         # 按钮布局
-        layout3 = Layout([1, 1, 1])
+        layout3 = Layout([1, 1, 1, 1])
         self.add_layout(layout3)
         layout3.add_widget(Button("Apply Filter", self._apply_filter), 0)
         layout3.add_widget(Button("Clear", self._clear_filter), 1)
-        layout3.add_widget(Button("Help", self._show_help), 2)
+        layout3.add_widget(Button("Flows", self._show_flows), 2)
+        layout3.add_widget(Button("Help", self._show_help), 3)
         
         # 状态栏
         status_layout = Layout([1])
@@ -1043,13 +1340,16 @@ class WiresharkTUI(Frame):
                 [
                     "使用说明:",
                     "",
-                    "1. 过滤器法:",
-                    "   - ip.src==1.1.1.1  (源IP)",
-                    "   - ip.dst==1.1.1.1  (目标IP)",
-                    "   - tcp.port==80     (TCP端口)",
-                    "   - udp.port==53     (UDP端口)",
-                    "   - http             (HTTP流量)",
-                    "   - tcp              (TCP流量)",
+                    "1. 过滤器语法:",
+                    "   - ip.src==1.1.1.1           (源IP)",
+                    "   - ip.addr==10.0.0.0/8       (任一方向, CIDR)",
+                    "   - tcp.port==80              (TCP端口)",
+                    "   - udp.port in {53 5353}     (端口集合)",
+                    "   - tcp.dstport in {8000..8080} (端口范围)",
+                    "   - frame.len > 1000          (帧长度)",
+                    "   - frame contains \"GET\"     (原始字节)",
+                    "   - http / tcp / udp / ipv6   (协议)",
+                    "   - 用 and/or/not 和括号组合",
                     "",
                     "2. 快捷键:",
                     "   - ↑/↓: 选择数据包",
@@ -1061,7 +1361,8 @@ class WiresharkTUI(Frame):
                     "   - 上方为数据包列表",
                     "   - 中间为HTTP流列表",
                     "   - 下方左侧为操作日志",
-                    "   - 下方右侧为详细信息"
+                    "   - 下方右侧为详细信息",
+                    "   - Flows 按钮打开连接列表 (Sort 切换排序)"
                 ],
                 ["确定"],
                 on_close=self._on_help_close
@@ -1072,68 +1373,12 @@ class WiresharkTUI(Frame):
         """处理帮助对话框关闭事件"""
         pass
 
-    def _update_lists(self):
-        """更新各个列表"""
-        if not self._running:
-            return
+    def _show_flows(self):
+        """打开流表视图"""
+        self.scene.add_effect(FlowView(self._screen, self._flows, self._on_flows_close))
 
-        try:
-            self.logger.debug("开始更新列表")
-            # 更新捕获的数据包列表
-            packets_updated = False
-            while not self.packet_capture.packets.empty():
-                try:
-                    packet = self.packet_capture.packets.get_nowait()
-                    self._packets.insert(0, packet)
-                    packets_updated = True
-                    self.logger.debug(f"添加新数据包: {packet}")
-                except queue.Empty:
-                    break
-
-            # 更新过滤后的数据包列表
-            while not self.packet_capture.filtered_packets.empty():
-                try:
-                    packet = self.packet_capture.filtered_packets.get_nowait()
-                    self._filtered_packets.insert(0, packet)
-                    self._add_filter_log(
-                        f"匹配数据包: {packet['src']}:{packet.get('sport','')} -> {packet['dst']}:{packet.get('dport','')}"
-                    )
-                except queue.Empty:
-                    break
-            self.logger.debug(f"当前数据包总数: {len(self._packets)}")
-            self.logger.debug(f"过滤后数据包数: {len(self._filtered_packets)}")
-            self.logger.debug(f"HTTP流数量: {len(self.packet_capture.http_streams)}")
-
-            # 限制表大小
-            max_packets = 100000
-            if len(self._packets) > max_packets:
-                self._packets = self._packets[:max_packets]
-            if len(self._filtered_packets) > max_packets:
-                self._filtered_packets = self._filtered_packets[:max_packets]
-
-            # 更新数据包列表显示
-            if packets_updated:
-                self.packet_listbox.options = [
-                    (f"#{len(self._packets)-i-1} {packet['src']}:{packet.get('sport','')} -> {packet['dst']}:{packet.get('dport','')}", i)
-                    for i, packet in enumerate(self._packets)
-                ]
-
-            # 更新HTTP流列表
-            self.http_listbox.options = [
-                (f"Stream #{i}: {stream.request['method']} {stream.request['path']} -> {stream.response['status_code']}", i)
-                for i, stream in enumerate(self.packet_capture.http_streams)
-            ]
-
-            # 更新状态栏
-            self.status_label.text = (
-                f"已捕获: {len(self._packets)} 个数据包, "
-                f"过滤: {len(self._filtered_packets)} 个匹配, "
-                f"HTTP: {len(self.packet_capture.http_streams)} 个流"
-            )
-
-        except Exception as e:
-            self.logger.debug(f"更新列表错误: {e}", exc_info=True)
-            self._add_filter_log(f"更新错误: {str(e)}")
+    def _on_flows_close(self, view):
+        self.scene.remove_effect(view)
 
     def _apply_filter(self):
         """应用过滤器"""
@@ -1143,7 +1388,7 @@ class WiresharkTUI(Frame):
             self.packet_capture.set_filter(filter_expr)
             self.filter_status.text = f"当前过滤器: {filter_expr}" if filter_expr else "无过滤器"
             self._add_filter_log(f"应用过滤器: {filter_expr}")
-            self._filtered_packets = []
+            self._match_history()
             self._running = True
             self.logger.debug("过滤器应用成功")
         except ValueError as e:
@@ -1159,21 +1404,58 @@ class WiresharkTUI(Frame):
             self.filter_status.text = "过滤器无效"
             self._add_filter_log(f"过滤器错误: {str(e)}")
 
+    def _match_history(self):
+        """按新的过滤器重新标记历史数据包
+
+        能由索引回答的条件直接取倒排表，其余条件扫描全部历史。
+        """
+        store = self._packets
+        # 还在交接缓冲区中的数据包先入库，一起参与匹配
+        pending = self.packet_capture.packets.drain()
+        if pending:
+            self._store_packets(pending)
+            self._update_packet_list()
+        store.clear_flag(FLAG_MATCHED)
+        packet_filter = self.packet_capture.packet_filter
+        if packet_filter.node is None:
+            return
+
+        start = time.perf_counter()
+        plan = index_candidates(packet_filter.node, store) if store.indexes else None
+        seqs, exact = plan if plan is not None else (store.seqs(), False)
+        if not exact:
+            seqs = [seq for seq in seqs.tolist() if packet_filter.match(store.get(seq))]
+        store.set_flags(seqs, FLAG_MATCHED)
+        elapsed = (time.perf_counter() - start) * 1000
+        self._add_filter_log(
+            f"历史匹配: {len(seqs)} 个 ({'索引' if plan is not None else '扫描'}, {elapsed:.1f} ms)")
+        if store.indexes:
+            usage = ", ".join(f"{field} {size / 1e6:.1f}MB"
+                              for field, size in store.index_memory().items())
+            self._add_filter_log(f"索引占用: {usage}")
+        self._update_filtered_list()
+
     def _clear_filter(self):
         """清除过滤器"""
         self.filter_text.value = ""
         self.packet_capture.set_filter(None)
         self.filter_status.text = "已清除过滤器"
         self._add_filter_log("清除过滤器")
-        self._filtered_packets = []
+        self._packets.clear_flag(FLAG_MATCHED)
         self._running = True
 
     def _on_packet_select(self):
         """处理数据包选择"""
         if self.packet_listbox.value is not None:
             try:
-                packet = self._packets[self.packet_listbox.value]
+                packet = self._packets.get(self.packet_listbox.value)
+                if packet is None:
+                    self.status_label.text = f"数据包 #{self.packet_listbox.value} 已被淘汰"
+                    return
                 details = self._format_packet_details(packet)
+                flow = self._packets.flow_packets(self.packet_listbox.value)
+                if flow is not None:
+                    details += f"\n\n同一流: {len(flow)} 个数据包 (#{flow[0]} ~ #{flow[-1]})"
                 self.details_view.value = details
                 self.status_label.text = f"已选择数据包 #{self.packet_listbox.value}"
             except Exception as e:
@@ -1212,37 +1494,30 @@ class WiresharkTUI(Frame):
     def _show_http_details(self):
         """显示 HTTP 流详情"""
         if self.http_listbox.value is not None:
-            stream = self.packet_capture.http_streams[self.http_listbox.value]
-            details = []
-            details.append("=== HTTP 请求 ===")
-            details.append(f"时间: {datetime.fromtimestamp(stream.request['time'])}")
-            details.append(f"来源: {stream.request['src']}:{stream.request['sport']}")
-            details.append(f"方法: {stream.request['method']}")
-            details.append(f"路径: {stream.request['path']}")
-            details.append("\n请求头:")
-            for header, value in stream.request['headers'].items():
-                details.append(f"  {header}: {value}")
-            if stream.request['body']:
-                details.append("\n请求体:")
-                details.append(stream.request['body'])
-            
-            details.append("\n=== HTTP 响应 ===")
-            details.append(f"状态码: {stream.response['status_code']}")
-            details.append("\n响应头:")
-            for header, value in stream.response['headers'].items():
-                details.append(f"  {header}: {value}")
-            if stream.response['body']:
-                details.append("\n响应体:")
-                details.append(stream.response['body'])
-            
-            self.details_view.value = "\n".join(details)
+            for session_id, content in self._http_streams:
+                if session_id == self.http_listbox.value:
+                    self.details_view.value = content
+                    break
+
+    def _update_http_list(self):
+        """HTTP 会话有变化时刷新列表，列表项的值为会话编号"""
+        if self._http.version == self._http_version:
+            return
+        self._http_version = self._http.version
+        self._http_streams = self._http.get_http_streams(self.HTTP_ROWS)
+        self.http_listbox.options = [
+            (f"#{session_id} {content.splitlines()[1] if content else ''}", session_id)
+            for session_id, content in self._http_streams
+        ]
 
     def _show_log_details(self):
         """显示过滤日志详情"""
         if self.log_listbox.value is not None:
             try:
-                packet = self._filtered_packets[self.log_listbox.value]
-                details = self._format_packet_details(packet)
+                matched = self._packets.latest(self.log_listbox.value + 1, FLAG_MATCHED)
+                if self.log_listbox.value >= len(matched):
+                    return
+                details = self._format_packet_details(self._packets.get(matched[-1]))
                 self.details_view.value = details
             except Exception as e:
                 self.details_view.value = f"显示详情时出错: {str(e)}"
@@ -1254,62 +1529,75 @@ class WiresharkTUI(Frame):
 
         try:
             # 更新捕获的数据包列表
-            packets_updated = False
-            while not self.packet_capture.packets.empty():
-                try:
-                    packet = self.packet_capture.packets.get_nowait()
-                    self._packets.insert(0, packet)
-                    packets_updated = True
-                except queue.Empty:
-                    break
+            packets = self.packet_capture.packets.drain()
+            packets_updated = bool(packets)
+            self._store_packets(packets)
 
-            # 更新过滤后的数据包列表
-            filtered_updated = False
-            while not self.packet_capture.filtered_packets.empty():
-                try:
-                    packet = self.packet_capture.filtered_packets.get_nowait()
-                    self._filtered_packets.insert(0, packet)
-                    filtered_updated = True
-                except queue.Empty:
-                    break
+            # 匹配的数据包与上面是同一个记录，只打标志
+            filtered = self.packet_capture.filtered_packets.drain()
+            filtered_updated = bool(filtered)
+            self._store_packets(filtered)
+            for packet in filtered:
+                self._packets.set_flag(packet['seq'], FLAG_MATCHED)
 
             # 如果有更新，则刷新显示
             if packets_updated:
                 self._update_packet_list()
             if filtered_updated:
                 self._update_filtered_list()
+            self._update_http_list()
 
             # 更新状态栏
-            self.status_label.text = (
+            status = (
                 f"已捕获: {len(self._packets)} 个数据包, "
-                f"过滤: {len(self._filtered_packets)} 个匹配, "
-                f"HTTP: {len(self.packet_capture.http_streams)} 个流"
+                f"过滤: {self._packets.count(FLAG_MATCHED)} 个匹配, "
+                f"{self._http.summary()}, "
+                f"连接: {len(self._flows)} 个"
             )
+            for summary in (self.packet_capture.get_worker_summary(),
+                            self.packet_capture.get_file_summary(),
+                            self.packet_capture.get_buffer_summary(),
+                            self.packet_capture.get_loss_summary()):
+                if summary:
+                    status += f" | {summary}"
+            self.status_label.text = status
 
         except Exception as e:
             self.logger.debug(f"更新列表错误: {e}")
             self._add_filter_log(f"更新错误: {str(e)}")
 
+    def _store_packets(self, packets):
+        """把还没有序号的记录追加到数据包历史，序号写回记录，并更新流表和 HTTP 会话"""
+        new_packets = [packet for packet in packets if 'seq' not in packet]
+        for packet, seq in zip(new_packets, self._packets.extend_info(new_packets)):
+            packet['seq'] = seq
+        update_flow = self._flows.update_info
+        add_http = self._http.add_packet
+        for packet in new_packets:
+            update_flow(packet)
+            add_http(packet)
+
     def _update_packet_list(self):
-        """更新数据包列表显示"""
+        """更新数据包列表显示，列表项的值为数据包序号"""
+        store = self._packets
         self.packet_listbox.options = [
-            (f"#{len(self._packets)-i-1} {packet['src']}:{packet.get('sport','')} -> "
-             f"{packet['dst']}:{packet.get('dport','')}", i)
-            for i, packet in enumerate(self._packets[:1000])  # 限制显示最新的1000个
+            (f"#{seq} {store.summary(seq)}", seq)
+            for seq in store.latest(1000)  # 限制显示最新的1000个
         ]
 
     def _update_filtered_list(self):
         """更新过滤后的数据包列表"""
         if self.filter_text.value:
+            store = self._packets
             self.packet_listbox.options = [
-                (f"#{len(self._filtered_packets)-i-1} {packet['src']}:{packet.get('sport','')} -> "
-                 f"{packet['dst']}:{packet.get('dport','')}", i)
-                for i, packet in enumerate(self._filtered_packets[:1000])
+                (f"#{seq} {store.summary(seq)}", seq)
+                for seq in store.latest(1000, FLAG_MATCHED)
             ]
 
-    def _format_packet_details(self, packet):
+    def _format_packet_details(self, packet_info):
         """格式化数据包详情"""
         try:
+            packet = dissect_packet(packet_info)
             details = []
             details.append("=== 数据包详情 ===")
             details.append(f"时间: {datetime.fromtimestamp(packet.time).strftime('%Y-%m-%d %H:%M:%S.%f')}")
@@ -1383,28 +1671,83 @@ def parse_args():
     parser.add_argument('-i', '--interface',
                        help='Network interface to capture',
                        default=None)
+    parser.add_argument('-e', '--engine',
+                       choices=PacketCapture.ENGINES,
+                       help='Capture engine: scapy (full dissection) or raw (raw bytes, lazy dissection)',
+                       default='scapy')
+    parser.add_argument('-w', '--workers', type=int,
+                       help='Number of PACKET_FANOUT worker processes (implies the raw engine when > 1)',
+                       default=1)
+    parser.add_argument('-r', '--read', metavar='FILE',
+                       help='Read packets from a pcap/pcapng file instead of capturing live',
+                       default=None)
+    parser.add_argument('--fast', action='store_true',
+                       help='Read the file as fast as possible instead of at capture speed')
+    parser.add_argument('--write', metavar='PREFIX',
+                       help='Write captured frames to rotating pcap files (e.g. captures/eth0)',
+                       default=None)
+    parser.add_argument('--rotate-size', type=int, default=100,
+                       help='Rotate pcap files after this many MB')
+    parser.add_argument('--rotate-seconds', type=float, default=0,
+                       help='Rotate pcap files after this many seconds (0 disables)')
+    parser.add_argument('--max-total', type=int, default=0,
+                       help='Delete the oldest pcap files beyond this total size in MB (0 disables)')
+    parser.add_argument('--buffer-policy', choices=HandoffBuffer.POLICIES, default='drop-oldest',
+                       help='What to drop when the UI falls behind the capture thread')
+    parser.add_argument('--buffer-size', type=int, default=10000,
+                       help='Maximum number of packets waiting for the UI')
+    parser.add_argument('--buffer-mb', type=int, default=64,
+                       help='Memory budget in MB for packets waiting for the UI')
+    parser.add_argument('--history', type=int, default=100000,
+                       help='Number of packets kept in the packet list history')
+    parser.add_argument('--history-mb', type=int, default=64,
+                       help='Memory in MB for raw frame bytes kept in the history')
+    parser.add_argument('--index', nargs='*', choices=INDEX_FIELDS, default=[],
+                       help='Secondary indexes kept over the history for filter lookups')
+    parser.add_argument('--max-flows', type=int, default=1_000_000,
+                       help='Maximum number of tracked connections; idle ones expire earlier')
     return parser.parse_args()
 
-def main(screen):
+def main(screen, args):
     logger = logging.getLogger('wireshark_tui.main')
     logger.debug("程序启动")
     
     try:
-        logger.debug("选择网络接口")
-        interface = select_interface(screen)
-        if not interface:
-            logger.warning("未选择网络接口，程序退出")
-            return
-
-        logger.debug(f"选择的网络接口: {interface}")
-        
-        logger.debug("初始化数据包捕获")
-        capture = PacketCapture()
-        capture.start_capture(interface)
+        writer = None
+        if args.write:
+            writer = RotatingPcapWriter(
+                args.write,
+                max_file_bytes=args.rotate_size * 1024 * 1024,
+                rotate_seconds=args.rotate_seconds,
+                max_total_bytes=args.max_total * 1024 * 1024,
+            )
+        capture = PacketCapture(engine=args.engine, workers=args.workers, writer=writer,
+                                buffer_policy=args.buffer_policy,
+                                buffer_capacity=args.buffer_size,
+                                buffer_bytes=args.buffer_mb * 1024 * 1024)
+        if args.filter:
+            capture.set_filter(args.filter)
+            
+        if args.read:
+            logger.debug(f"读取捕获文件: {args.read}")
+            capture.start_file(args.read, args.fast)
+        else:
+            logger.debug("选择网络接口")
+            interface = args.interface or select_interface(screen)
+            if not interface:
+                logger.warning("未选择网络接口，程序退出")
+                return
+
+            logger.debug(f"选择的网络接口: {interface}")
+            
+            logger.debug("初始化数据包捕获")
+            capture.start_capture(interface)
         
         logger.debug("创建主界面")
         scenes = []
-        main_view = WiresharkTUI(screen, capture)
+        main_view = WiresharkTUI(screen, capture, history=args.history,
+                                 history_bytes=args.history_mb * 1024 * 1024,
+                                 indexes=args.index, max_flows=args.max_flows)
         scenes.append(Scene([main_view], -1))
         
         logger.debug("启动界面循环")
@@ -1429,10 +1772,12 @@ if __name__ == "__main__":
     conf.promisc = False  # 关闭混杂模式
     conf.monitor = False  # 关闭监控模式
     
+    args = parse_args()
+    
     # 设置日志记录
     logger = setup_logging()
     try:
-        Screen.wrapper(main)
+        Screen.wrapper(main, arguments=[args])
         logger.debug("程序正常退出")
     except KeyboardInterrupt:
         logger.info("程序被用户终止")
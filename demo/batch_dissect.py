@@ -0,0 +1,404 @@
+"""整批帧的向量化解析
+
+把一批帧首尾相接地放进一块连续缓冲区 (FrameBatch)，用每帧的偏移数组和
+NumPy 一次性取出时间戳、长度、ethertype、IP 版本、协议、源/目标地址和端口，
+结果按列保存在 FrameColumns 中。
+
+向量化路径覆盖最常见的布局: 以太网 (最多一层 VLAN 标签) 或原始 IP，
+IPv4 (任意 IHL) 和不带扩展头的 IPv6，以及 TCP/UDP/SCTP/ICMP/ICMPv6。
+QinQ、IPv6 扩展头、截断的帧等不规则的帧逐个交给 fast_dissect.dissect 解析，
+两条路径的结果一致。
+
+地址按 fast_dissect 的整数表示拆成高/低 64 位两列，IPv4 地址只占低 64 位。
+
+直接运行本文件会校验与逐帧解析的一致性，并对比 pcap 导入速度。
+"""
+import itertools
+import struct
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from fast_dissect import (LINKTYPE_ETHERNET, LINKTYPE_RAW, UNKNOWN, ETHERTYPE_IPV4, ETHERTYPE_IPV6,
+                          VLAN_ETHERTYPES, dissect, format_address)
+
+_VLAN_TYPES = np.array(sorted(VLAN_ETHERTYPES), dtype=np.uint16)
+_IPV6_EXT_TYPES = np.array([0, 43, 44, 51, 60], dtype=np.uint8)
+_BYTE_OFFSETS = np.arange(8)
+
+# 传输层: 协议号 -> (头部至少需要的字节数, 是否携带端口, 固定头部长度)
+# 与 fast_dissect 的结构保持一致，TCP 头部长度由数据偏移决定，记为 0
+_L4_LAYOUT = {
+    6: (14, True, 0),
+    17: (6, True, 8),
+    132: (4, True, 12),
+    1: (2, False, 8),
+    58: (2, False, 8),
+}
+
+
+class FrameBatch:
+    """连续存放的一批帧
+
+    data 为容纳所有帧的字节数组，offsets/lengths 为每帧在其中的起点和长度，
+    timestamps 为每帧的纳秒时间戳。data 可以直接是 pcap 文件的映射区域。
+    """
+    __slots__ = ('data', 'offsets', 'lengths', 'timestamps', 'linktype')
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, lengths: np.ndarray,
+                 timestamps: np.ndarray, linktype: int = LINKTYPE_ETHERNET):
+        self.data = data
+        self.offsets = offsets
+        self.lengths = lengths
+        self.timestamps = timestamps
+        self.linktype = linktype
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[int, bytes]],
+                     linktype: int = LINKTYPE_ETHERNET) -> 'FrameBatch':
+        """由 (纳秒时间戳, 帧) 记录构造，帧可以是 bytes 或 memoryview"""
+        timestamps = []
+        frames = []
+        for timestamp_ns, frame in records:
+            timestamps.append(timestamp_ns)
+            frames.append(frame)
+        count = len(frames)
+        lengths = np.fromiter(map(len, frames), dtype=np.int64, count=count)
+        offsets = np.zeros(count, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        data = np.frombuffer(b''.join(frames), dtype=np.uint8)
+        return cls(data, offsets, lengths, np.array(timestamps, dtype=np.int64), linktype)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def frame(self, index: int) -> memoryview:
+        """第 index 个帧，指向批次缓冲区"""
+        start = int(self.offsets[index])
+        return memoryview(self.data)[start:start + int(self.lengths[index])]
+
+
+def iter_batches(records: Iterable[Tuple[int, bytes]], batch_size: int = 8192,
+                 linktype: int = LINKTYPE_ETHERNET) -> Iterator[FrameBatch]:
+    """把记录流按 batch_size 分批"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, batch_size))
+        if not chunk:
+            return
+        yield FrameBatch.from_records(chunk, linktype)
+
+
+def pcap_batches(reader, batch_size: int = 65536) -> Iterator[FrameBatch]:
+    """按批读取 PcapReader，帧不拷贝，直接引用文件的映射区域
+
+    记录头是链式的，只能逐条遍历，这里只取出位置，解析全部在批内完成。
+    pcapng 的不同接口可以有不同的链路类型，批次在链路类型变化处切开，
+    每个批次内只有一种链路类型。
+    """
+    data = np.frombuffer(reader.buffer, dtype=np.uint8)
+    index = reader.index()
+    while True:
+        # 每条记录的 (时间戳, 偏移, 长度, 链路类型) 直接展开进一个 int64 数组
+        chunk = np.fromiter(itertools.chain.from_iterable(itertools.islice(index, batch_size)),
+                            dtype=np.int64).reshape(-1, 4)
+        if not len(chunk):
+            return
+        linktypes = chunk[:, 3]
+        bounds = [0, *(np.flatnonzero(linktypes[1:] != linktypes[:-1]) + 1).tolist(), len(chunk)]
+        for start, end in zip(bounds, bounds[1:]):
+            part = chunk[start:end]
+            yield FrameBatch(data, part[:, 1], part[:, 2], part[:, 0], int(part[0, 3]))
+
+
+class FrameColumns:
+    """一批帧的解析结果，每个字段一列
+
+    非 IP 帧的 ip_version 为 0、地址为 0；没有端口的协议端口为 0；
+    l4 表示传输层头部已解析 (后续分片和截断的头部为 False)；tcp_flags 为 TCP 标志位；
+    vlan 为最外层 VLAN ID，没有标签时为 0；scalar_rows 为走逐帧路径的帧数。
+    """
+    __slots__ = ('ts_ns', 'length', 'ethertype', 'vlan', 'ip_version', 'proto',
+                 'src_hi', 'src_lo', 'dst_hi', 'dst_lo', 'sport', 'dport',
+                 'tcp_flags', 'payload_offset', 'fragment', 'l4', 'scalar_rows')
+
+    def __init__(self, count: int):
+        self.ts_ns = np.zeros(count, dtype=np.int64)
+        self.length = np.zeros(count, dtype=np.uint32)
+        self.ethertype = np.zeros(count, dtype=np.uint16)
+        self.vlan = np.zeros(count, dtype=np.uint16)
+        self.ip_version = np.zeros(count, dtype=np.uint8)
+        self.proto = np.zeros(count, dtype=np.uint8)
+        self.src_hi = np.zeros(count, dtype=np.uint64)
+        self.src_lo = np.zeros(count, dtype=np.uint64)
+        self.dst_hi = np.zeros(count, dtype=np.uint64)
+        self.dst_lo = np.zeros(count, dtype=np.uint64)
+        self.sport = np.zeros(count, dtype=np.uint16)
+        self.dport = np.zeros(count, dtype=np.uint16)
+        self.tcp_flags = np.zeros(count, dtype=np.uint8)
+        self.payload_offset = np.zeros(count, dtype=np.uint16)
+        self.fragment = np.zeros(count, dtype=bool)
+        self.l4 = np.zeros(count, dtype=bool)
+        self.scalar_rows = 0
+
+    def __len__(self) -> int:
+        return len(self.ts_ns)
+
+    def src_addresses(self) -> List[str]:
+        """源地址的文本形式"""
+        return format_addresses(self.ip_version, self.src_hi, self.src_lo)
+
+    def dst_addresses(self) -> List[str]:
+        """目标地址的文本形式"""
+        return format_addresses(self.ip_version, self.dst_hi, self.dst_lo)
+
+
+def format_addresses(version: np.ndarray, hi: np.ndarray, lo: np.ndarray) -> List[str]:
+    """把地址列转换为文本，每个不同的地址只格式化一次，非 IP 帧为空字符串"""
+    result = np.full(len(version), "", dtype=object)
+    for ip_version in (4, 6):
+        rows = np.flatnonzero(version == ip_version)
+        if not rows.size:
+            continue
+        if ip_version == 4:
+            # IPv4 地址只在低 64 位，一维去重比按行去重快得多
+            unique, inverse = np.unique(lo[rows], return_inverse=True)
+            addresses = unique.tolist()
+        else:
+            keys = np.stack((hi[rows], lo[rows]), axis=1)
+            unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+            addresses = [(high << 64) | low for high, low in unique.tolist()]
+        texts = np.array([format_address(address, ip_version) for address in addresses], dtype=object)
+        result[rows] = texts[inverse.ravel()]
+    return result.tolist()
+
+
+# 读取越过帧尾的位置会被截到缓冲区末尾，这些行随后都会按长度检查
+# 交给逐帧路径或被忽略，因此帧之间和缓冲区末尾都不需要补零
+def _u8(data: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    return data.take(pos, mode='clip')
+
+
+def _u16(data: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    return (_u8(data, pos).astype(np.uint16) << 8) | _u8(data, pos + 1)
+
+
+def _u32(data: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    return ((_u8(data, pos).astype(np.uint32) << 24) | (_u8(data, pos + 1).astype(np.uint32) << 16)
+            | (_u8(data, pos + 2).astype(np.uint32) << 8) | _u8(data, pos + 3))
+
+
+def _u64(data: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    octets = _u8(data, pos[:, None] + _BYTE_OFFSETS)
+    return octets.view('>u8').ravel().astype(np.uint64)
+
+
+def dissect_batch(batch: FrameBatch) -> FrameColumns:
+    """解析一批帧，返回按列保存的结果"""
+    count = len(batch)
+    columns = FrameColumns(count)
+    columns.ts_ns[:] = batch.timestamps
+    columns.length[:] = batch.lengths
+    if not count:
+        return columns
+
+    data = batch.data
+    offsets = batch.offsets
+    lengths = batch.lengths
+
+    # 链路层: 确定每帧的 ethertype 和 IP 头的位置
+    if batch.linktype == LINKTYPE_ETHERNET:
+        irregular = lengths < 14
+        ethertype = _u16(data, offsets + 12)
+        l3 = offsets + 14
+        tagged = np.isin(ethertype, _VLAN_TYPES)
+        if tagged.any():
+            inner = _u16(data, offsets + 16)
+            # QinQ 交给逐帧路径
+            irregular |= tagged & (np.isin(inner, _VLAN_TYPES) | (lengths < 18))
+            columns.vlan[:] = np.where(tagged, _u16(data, offsets + 14) & 0x0FFF, 0)
+            ethertype = np.where(tagged, inner, ethertype)
+            l3 = l3 + 4 * tagged
+    elif batch.linktype == LINKTYPE_RAW:
+        irregular = lengths < 1
+        ethertype = np.where(_u8(data, offsets) >> 4 == 6, ETHERTYPE_IPV6, ETHERTYPE_IPV4).astype(np.uint16)
+        l3 = offsets.copy()
+    else:
+        irregular = np.ones(count, dtype=bool)
+        ethertype = np.zeros(count, dtype=np.uint16)
+        l3 = offsets.copy()
+    columns.ethertype[:] = ethertype
+
+    # 网络层
+    l4 = np.zeros(count, dtype=np.int64)
+    later_fragment = np.zeros(count, dtype=bool)
+    header_end = l3 - offsets
+
+    rows = np.flatnonzero((ethertype == ETHERTYPE_IPV4) & ~irregular)
+    if rows.size:
+        pos = l3[rows]
+        ihl = (_u8(data, pos) & 0xF).astype(np.int64) * 4
+        irregular[rows] |= (lengths[rows] < header_end[rows] + 20) | (ihl < 20)
+        frag = _u16(data, pos + 6)
+        columns.ip_version[rows] = 4
+        columns.proto[rows] = _u8(data, pos + 9)
+        columns.src_lo[rows] = _u32(data, pos + 12)
+        columns.dst_lo[rows] = _u32(data, pos + 16)
+        columns.fragment[rows] = (frag & 0x3FFF) != 0
+        later_fragment[rows] = (frag & 0x1FFF) != 0
+        l4[rows] = pos + ihl
+
+    rows = np.flatnonzero((ethertype == ETHERTYPE_IPV6) & ~irregular)
+    if rows.size:
+        pos = l3[rows]
+        proto = _u8(data, pos + 6)
+        # 扩展头链交给逐帧路径
+        irregular[rows] |= (lengths[rows] < header_end[rows] + 40) | np.isin(proto, _IPV6_EXT_TYPES)
+        columns.ip_version[rows] = 6
+        columns.proto[rows] = proto
+        columns.src_hi[rows] = _u64(data, pos + 8)
+        columns.src_lo[rows] = _u64(data, pos + 16)
+        columns.dst_hi[rows] = _u64(data, pos + 24)
+        columns.dst_lo[rows] = _u64(data, pos + 32)
+        l4[rows] = pos + 40
+
+    # 传输层: 按协议号分组，每组一次取出端口并计算载荷偏移
+    ip_rows = columns.ip_version != 0
+    columns.payload_offset[ip_rows] = (l4 - offsets)[ip_rows]
+    for proto, (needed, has_ports, header_length) in _L4_LAYOUT.items():
+        rows = np.flatnonzero(ip_rows & ~irregular & ~later_fragment & (columns.proto == proto))
+        if not rows.size:
+            continue
+        pos = l4[rows]
+        truncated = lengths[rows] < pos - offsets[rows] + needed
+        irregular[rows] |= truncated
+        rows = rows[~truncated]
+        pos = pos[~truncated]
+        columns.l4[rows] = True
+        if has_ports:
+            columns.sport[rows] = _u16(data, pos)
+            columns.dport[rows] = _u16(data, pos + 2)
+        if proto == 6:
+            header_length = (_u8(data, pos + 12) >> 4).astype(np.int64) * 4
+            columns.tcp_flags[rows] = _u8(data, pos + 13)
+        columns.payload_offset[rows] = pos - offsets[rows] + header_length
+
+    # 不规则的帧逐个解析
+    scalar_rows = np.flatnonzero(irregular)
+    columns.scalar_rows = len(scalar_rows)
+    for row in scalar_rows.tolist():
+        _fill_scalar(columns, row, batch)
+    return columns
+
+
+def _fill_scalar(columns: FrameColumns, row: int, batch: FrameBatch):
+    try:
+        result = dissect(batch.frame(row), batch.linktype)
+    except (struct.error, IndexError, ValueError):
+        result = UNKNOWN
+    columns.ethertype[row] = result.ethertype
+    columns.vlan[row] = result.vlans[0] if result.vlans else 0
+    columns.ip_version[row] = result.ip_version
+    columns.proto[row] = result.proto
+    src = result.src or 0
+    dst = result.dst or 0
+    columns.src_hi[row], columns.src_lo[row] = src >> 64, src & 0xFFFFFFFFFFFFFFFF
+    columns.dst_hi[row], columns.dst_lo[row] = dst >> 64, dst & 0xFFFFFFFFFFFFFFFF
+    columns.sport[row] = result.sport
+    columns.dport[row] = result.dport
+    columns.tcp_flags[row] = result.l4_fields[2] if result.proto == 6 and result.l4_fields else 0
+    columns.payload_offset[row] = result.payload_offset if result.ip_version else 0
+    columns.fragment[row] = result.fragment
+    columns.l4[row] = bool(result.l4_fields)
+
+
+def _scalar_row(frame, linktype: int):
+    """逐帧解析的结果，按 FrameColumns 的字段排列，用于校验"""
+    try:
+        result = dissect(frame, linktype)
+    except (struct.error, IndexError, ValueError):
+        result = UNKNOWN
+    return (result.ethertype, result.vlans[0] if result.vlans else 0, result.ip_version,
+            result.proto, result.src or 0, result.dst or 0, result.sport, result.dport,
+            result.l4_fields[2] if result.proto == 6 and result.l4_fields else 0,
+            result.payload_offset if result.ip_version else 0, result.fragment,
+            bool(result.l4_fields))
+
+
+def _column_row(columns: FrameColumns, row: int):
+    return (int(columns.ethertype[row]), int(columns.vlan[row]), int(columns.ip_version[row]),
+            int(columns.proto[row]),
+            (int(columns.src_hi[row]) << 64) | int(columns.src_lo[row]),
+            (int(columns.dst_hi[row]) << 64) | int(columns.dst_lo[row]),
+            int(columns.sport[row]), int(columns.dport[row]), int(columns.tcp_flags[row]),
+            int(columns.payload_offset[row]), bool(columns.fragment[row]), bool(columns.l4[row]))
+
+
+def selfcheck_and_benchmark(count: int = 200_000) -> bool:
+    """校验向量化结果与逐帧解析一致，并对比从 pcap 导入的速度"""
+    import os
+    import tempfile
+    from fast_dissect import _build_corpus
+    from pcap_file import PcapReader, RotatingPcapWriter
+    from traffic_replay import SyntheticTraffic, parse_mix
+
+    # 混合语料加上各种截断
+    corpus = _build_corpus(64)
+    corpus += [frame[:cut] for frame in corpus[:14] for cut in (0, 10, 13, 15, 20, 33, 40, 54, 60)]
+    corpus += SyntheticTraffic(parse_mix('tcp=60,udp=30,icmp=10'), pool_size=2000).frames
+    batch = FrameBatch.from_records(enumerate(corpus))
+    columns = dissect_batch(batch)
+    failures = 0
+    for row, frame in enumerate(corpus):
+        expected = _scalar_row(frame, LINKTYPE_ETHERNET)
+        if _column_row(columns, row) != expected:
+            failures += 1
+            print(f"不一致: 期望={expected} 结果={_column_row(columns, row)} 帧={frame.hex()}")
+    raw_frames = [frame[14:] for frame in corpus if frame[12:14] in (b'\x08\x00', b'\x86\xdd')]
+    raw_columns = dissect_batch(FrameBatch.from_records(enumerate(raw_frames), LINKTYPE_RAW))
+    for row, frame in enumerate(raw_frames):
+        if _column_row(raw_columns, row) != _scalar_row(frame, LINKTYPE_RAW):
+            failures += 1
+            print(f"不一致 (原始 IP): 帧={frame.hex()}")
+    print(f"校验: {len(corpus) + len(raw_frames)} 帧, 逐帧路径 {columns.scalar_rows} 帧, "
+          f"不一致 {failures}")
+
+    # 导入速度: 写一个临时 pcap，分别逐帧和按批解析出五元组
+    traffic = SyntheticTraffic(parse_mix('tcp=60,udp=30,icmp=10'), pool_size=4096)
+    with tempfile.TemporaryDirectory() as directory:
+        writer = RotatingPcapWriter(os.path.join(directory, 'bench'), queue_size=count + 1)
+        for i, frame in zip(range(count), iter(traffic)):
+            writer.write(frame, i)
+        writer.start()
+        writer.stop()
+        path = writer._file_path
+
+        reader = PcapReader(path)
+        start = time.perf_counter()
+        tuples = []
+        for timestamp_ns, frame, linktype in reader:
+            result = dissect(frame, linktype)
+            tuples.append((timestamp_ns, result.src, result.dst, result.proto,
+                           result.sport, result.dport))
+        scalar_time = time.perf_counter() - start
+        reader.close()
+
+        reader = PcapReader(path)
+        start = time.perf_counter()
+        batches = list(pcap_batches(reader))
+        index_time = time.perf_counter() - start
+        rows = sum(len(dissect_batch(frames)) for frames in batches)
+        batch_time = time.perf_counter() - start
+        del batches
+        reader.close()
+
+    dissect_time = batch_time - index_time
+    print(f"pcap 导入 {count} 帧: 逐帧 {count / scalar_time:,.0f} 帧/秒, "
+          f"按批 {rows / batch_time:,.0f} 帧/秒 ({scalar_time / batch_time:.1f} 倍)")
+    print(f"其中按批解析 {rows / dissect_time:,.0f} 帧/秒，遍历记录头 {rows / index_time:,.0f} 帧/秒")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if selfcheck_and_benchmark() else 1)
@@ -0,0 +1,303 @@
+"""显示过滤器到经典 BPF 的编译器
+
+把 textual_wireshark 的过滤语法 (tcp/udp/http/ip=x.x.x.x/port=N，以 / 分隔，
+各条件为与关系) 编译为经典 BPF 字节码，通过 SO_ATTACH_FILTER 挂到原始套接字上，
+让不匹配的流量留在内核中。
+
+BPF 无法表达的部分 (HTTP 载荷识别、TCP 与 HTTP 的区分、非 IPv4 帧、分片)
+会被放宽为超集，由用户态过滤器完成最终判断。
+
+直接运行本文件会执行编译器自检: 用合成帧比较 BPF 解释执行结果与
+用户态过滤器的结果。
+"""
+import ctypes
+import socket
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+# 指令编码 (linux/filter.h)
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_LD_H_IND = 0x48
+BPF_LDX_B_MSH = 0xb1
+BPF_JEQ_K = 0x15
+BPF_JSET_K = 0x45
+BPF_RET_K = 0x06
+
+ETH_HLEN = 14
+ETHERTYPE_IPV4 = 0x0800
+SNAPLEN = 0x40000
+
+HTTP_PORTS = (80, 8080)
+PROTO_NUMBERS = {'tcp': 6, 'udp': 17}
+
+# 跳转目标标签
+ACCEPT = 'accept'
+REJECT = 'reject'
+NEXT = 'next'
+
+
+class BpfProgram(NamedTuple):
+    """编译结果
+
+    instructions: (code, jt, jf, k) 列表
+    exact: 对未分片的 IPv4 帧，内核判定是否与用户态完全一致
+    """
+    instructions: List[Tuple[int, int, int, int]]
+    exact: bool
+
+
+class _Assembler:
+    """带符号标签的简单汇编器"""
+    def __init__(self):
+        self.code = []  # (op, jt, jf, k)，jt/jf 为标签
+        self.labels = {}
+        self._label_id = 0
+
+    def new_label(self) -> str:
+        self._label_id += 1
+        return f"L{self._label_id}"
+
+    def mark(self, label: str):
+        self.labels[label] = len(self.code)
+
+    def emit(self, op: int, k: int = 0, jt: str = NEXT, jf: str = NEXT):
+        self.code.append((op, jt, jf, k))
+
+    def assemble(self) -> List[Tuple[int, int, int, int]]:
+        instructions = []
+        for pc, (op, jt, jf, k) in enumerate(self.code):
+            instructions.append((op, self._offset(pc, jt), self._offset(pc, jf), k))
+        return instructions
+
+    def _offset(self, pc: int, label: str) -> int:
+        if label == NEXT:
+            return 0
+        offset = self.labels[label] - pc - 1
+        if not 0 <= offset <= 255:
+            raise ValueError("BPF 跳转距离超出范围")
+        return offset
+
+
+def _parse_ipv4(value: str) -> Optional[int]:
+    try:
+        return struct.unpack('!I', socket.inet_pton(socket.AF_INET, value))[0]
+    except OSError:
+        return None
+
+
+def _emit_ports(asm: _Assembler, ports, protos):
+    """端口条件: 源端口或目的端口属于 ports，非首分片交给用户态"""
+    ok = asm.new_label()
+    l4 = asm.new_label()
+    asm.emit(BPF_LD_B_ABS, ETH_HLEN + 9)
+    for i, proto in enumerate(protos):
+        last = i == len(protos) - 1
+        asm.emit(BPF_JEQ_K, proto, jt=l4, jf=REJECT if last else NEXT)
+    asm.mark(l4)
+    asm.emit(BPF_LD_H_ABS, ETH_HLEN + 6)
+    asm.emit(BPF_JSET_K, 0x1fff, jt=ACCEPT)
+    asm.emit(BPF_LDX_B_MSH, ETH_HLEN)
+    for field_offset in (ETH_HLEN, ETH_HLEN + 2):
+        asm.emit(BPF_LD_H_IND, field_offset)
+        for port in ports:
+            asm.emit(BPF_JEQ_K, port, jt=ok)
+    asm.emit(BPF_RET_K, 0)
+    asm.mark(ok)
+
+
+def compile_filter(filter_text: str) -> Optional[BpfProgram]:
+    """编译过滤表达式
+
+    返回 None 表示没有需要在内核中执行的条件，或者表达式无法编译，
+    此时应卸载内核过滤器，完全依赖用户态过滤。
+    """
+    parts = [part for part in filter_text.lower().split('/') if part]
+    if not parts:
+        return None
+
+    asm = _Assembler()
+    exact = True
+    has_predicate = False
+
+    # 非 IPv4 帧 (ARP、IPv6、VLAN 等) 交给用户态判断
+    asm.emit(BPF_LD_H_ABS, 12)
+    asm.emit(BPF_JEQ_K, ETHERTYPE_IPV4, jf=ACCEPT)
+
+    for part in parts:
+        if '=' in part:
+            key, value = part.split('=', 1)
+            if key == 'ip':
+                address = _parse_ipv4(value)
+                if address is None:
+                    return None
+                ok = asm.new_label()
+                asm.emit(BPF_LD_W_ABS, ETH_HLEN + 12)
+                asm.emit(BPF_JEQ_K, address, jt=ok)
+                asm.emit(BPF_LD_W_ABS, ETH_HLEN + 16)
+                asm.emit(BPF_JEQ_K, address, jt=ok, jf=REJECT)
+                asm.mark(ok)
+                has_predicate = True
+            elif key == 'port':
+                try:
+                    port = int(value)
+                except ValueError:
+                    return None
+                # ICMP 等协议的端口按 0 处理，BPF 中无法等价表达
+                if not 0 < port <= 0xffff:
+                    return None
+                _emit_ports(asm, (port,), (6, 17))
+                has_predicate = True
+        elif part in PROTO_NUMBERS:
+            asm.emit(BPF_LD_B_ABS, ETH_HLEN + 9)
+            asm.emit(BPF_JEQ_K, PROTO_NUMBERS[part], jf=REJECT)
+            # 用户态会把 HTTP 流量从 tcp 中区分出来
+            if part == 'tcp':
+                exact = False
+            has_predicate = True
+        elif part == 'http':
+            _emit_ports(asm, HTTP_PORTS, (6,))
+            exact = False
+            has_predicate = True
+
+    if not has_predicate:
+        return None
+
+    asm.mark(ACCEPT)
+    asm.emit(BPF_RET_K, SNAPLEN)
+    asm.mark(REJECT)
+    asm.emit(BPF_RET_K, 0)
+    return BpfProgram(asm.assemble(), exact)
+
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_uint16), ('jt', ctypes.c_uint8),
+                ('jf', ctypes.c_uint8), ('k', ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_uint16), ('filter', ctypes.POINTER(_SockFilter))]
+
+
+def attach_filter(sock: socket.socket, program: BpfProgram):
+    """挂载 BPF 程序，已存在的过滤器会被原子替换"""
+    filters = (_SockFilter * len(program.instructions))(*program.instructions)
+    fprog = _SockFprog(len(program.instructions), filters)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+
+
+def detach_filter(sock: socket.socket):
+    """卸载 BPF 程序，未挂载时忽略"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+    except OSError:
+        pass
+
+
+def run_filter(program: BpfProgram, frame: bytes) -> int:
+    """在用户态解释执行 BPF 程序，返回接受的字节数 (0 表示丢弃)"""
+    a = x = 0
+    pc = 0
+    instructions = program.instructions
+    try:
+        while True:
+            code, jt, jf, k = instructions[pc]
+            pc += 1
+            if code == BPF_LD_W_ABS:
+                a = struct.unpack_from('!I', frame, k)[0]
+            elif code == BPF_LD_H_ABS:
+                a = struct.unpack_from('!H', frame, k)[0]
+            elif code == BPF_LD_B_ABS:
+                a = frame[k]
+            elif code == BPF_LD_H_IND:
+                a = struct.unpack_from('!H', frame, x + k)[0]
+            elif code == BPF_LDX_B_MSH:
+                x = (frame[k] & 0xf) * 4
+            elif code == BPF_JEQ_K:
+                pc += jt if a == k else jf
+            elif code == BPF_JSET_K:
+                pc += jt if a & k else jf
+            elif code == BPF_RET_K:
+                return k
+            else:
+                raise ValueError(f"不支持的 BPF 指令: {code:#x}")
+    except (struct.error, IndexError):
+        # 与内核一致: 越界读取直接丢弃
+        return 0
+
+
+def _build_frame(proto: int, src: str, dst: str, sport: int = 0, dport: int = 0,
+                 payload: bytes = b'', ip_options: bytes = b'',
+                 ethertype: int = ETHERTYPE_IPV4) -> bytes:
+    """构造用于自检的以太网帧"""
+    eth = b'\x00\x11\x22\x33\x44\x55' + b'\x66\x77\x88\x99\xaa\xbb' + struct.pack('!H', ethertype)
+    if proto == 6:
+        l4 = struct.pack('!HHLLBBHHH', sport, dport, 1, 0, 5 << 4, 0x18, 65535, 0, 0)
+    elif proto == 17:
+        l4 = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0)
+    else:
+        l4 = struct.pack('!BBHI', 8, 0, 0, 0)
+    ihl = 5 + len(ip_options) // 4
+    total = ihl * 4 + len(l4) + len(payload)
+    ip = struct.pack('!BBHHHBBH4s4s', (4 << 4) | ihl, 0, total, 0, 0, 64, proto, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst)) + ip_options
+    return eth + ip + l4 + payload
+
+
+def selfcheck() -> bool:
+    """比较 BPF 结果与 textual_wireshark 用户态过滤器的结果"""
+    from textual_wireshark import Packet, packet_matches_filter
+
+    frames = []
+    addresses = ('10.0.0.1', '10.0.0.2', '192.168.1.1')
+    for proto in (6, 17, 1):
+        for src in addresses:
+            for dst in addresses:
+                for sport, dport in ((12345, 80), (8080, 40000), (5353, 53), (443, 51000)):
+                    for payload in (b'', b'GET /index.html HTTP/1.1\r\nHost: a\r\n\r\n',
+                                    b'HTTP/1.1 200 OK\r\n\r\n'):
+                        for options in (b'', b'\x01\x01\x01\x01'):
+                            frames.append(_build_frame(proto, src, dst, sport, dport,
+                                                       payload, options))
+    ipv6_frame = _build_frame(6, '10.0.0.1', '10.0.0.2', 1, 80, ethertype=0x86dd)
+
+    filters = ['tcp', 'udp', 'http', 'ip=10.0.0.1', 'ip=192.168.1.1', 'port=80',
+               'port=53', 'tcp/port=443', 'udp/ip=10.0.0.2', 'http/ip=10.0.0.1',
+               'ip=10.0.0.1/port=8080', 'tcp/udp', 'icmp', 'ip=10.0', 'port=0']
+
+    failures = 0
+    for filter_text in filters:
+        program = compile_filter(filter_text)
+        for frame in frames:
+            # 用户态解析器与 BPF 一样从以太网头开始解析
+            expected = packet_matches_filter(Packet(frame, 0), filter_text)
+            # 带 VLAN 标签的帧由 BPF 放行给用户态，解析结果应与未加标签时相同
+            tagged = frame[:12] + b'\x81\x00\x00\x64' + frame[12:]
+            if packet_matches_filter(Packet(tagged, 0), filter_text) != expected:
+                failures += 1
+                print(f"不一致: 过滤器={filter_text} VLAN 帧解析结果不同 帧={tagged.hex()}")
+            if program is None:
+                continue
+            if not run_filter(program, tagged):
+                failures += 1
+                print(f"不一致: 过滤器={filter_text} 丢弃了 VLAN 帧")
+            accepted = run_filter(program, frame) > 0
+            if (expected and not accepted) or (program.exact and accepted != expected):
+                failures += 1
+                print(f"不一致: 过滤器={filter_text} 期望={expected} BPF={accepted} 帧={frame.hex()}")
+        if program is not None and not run_filter(program, ipv6_frame):
+            failures += 1
+            print(f"不一致: 过滤器={filter_text} 丢弃了非 IPv4 帧")
+        status = "未编译" if program is None else f"{len(program.instructions)} 条指令, exact={program.exact}"
+        print(f"{filter_text:<24} {status}")
+
+    print(f"帧数: {len(frames)}, 过滤器数: {len(filters)}, 不一致: {failures}")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if selfcheck() else 1)
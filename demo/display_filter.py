@@ -0,0 +1,586 @@
+"""显示过滤器: 解析为语法树并编译为闭包
+
+asciimatics_wireshark 的过滤表达式在设置时解析一次，编译成一棵闭包树，
+之后每个数据包只做几次字典读取和比较，不再对过滤字符串反复执行正则。
+
+语法 (关键字不区分大小写):
+
+    expr    := or
+    or      := and (('or' | '||') and)*
+    and     := not (('and' | '&&') not)*
+    not     := ('not' | '!') not | primary
+    primary := '(' expr ')'
+             | field
+             | field op value
+             | field 'in' '{' value (',' | ' ') ... '}'
+             | field 'contains' "string"
+    op      := '==' | '=' | '!=' | '<' | '>' | '<=' | '>='
+               | 'eq' | 'ne' | 'lt' | 'gt' | 'le' | 'ge'
+
+字段:
+    tcp / udp / ip / ipv6 / http     协议存在
+    ip.src / ip.dst / ip.addr        地址，值可以是 CIDR (10.0.0.0/8、fe80::/10)
+    tcp.port / tcp.srcport / tcp.dstport / udp.*port
+                                     端口，in 集合中可以写范围 8000..8080
+    frame.len                        帧长度
+    frame / http contains "..."      原始字节包含字符串
+
+ip.addr、tcp.port 这类双向字段在任意一侧满足时为真，!= 为 == 的否定。
+
+历史数据包的重新过滤可以先由 index_candidates 从 PacketStore 的二级索引取出
+候选序号: 地址和端口的等值条件直接查倒排表，and 取交集，or 取并集，
+索引回答不了的条件再用编译后的闭包逐个确认。
+
+直接运行本文件会与原来的正则匹配器对比每秒匹配次数。
+"""
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from fast_dissect import format_address, parse_address
+
+Matcher = Callable[[Dict[str, Any]], bool]
+
+HTTP_MARKERS = (b'HTTP/', b'GET ', b'POST ')
+
+
+class Compare(NamedTuple):
+    field: str
+    op: str
+    value: Any
+
+
+class Contains(NamedTuple):
+    field: str
+    value: bytes
+
+
+class Exists(NamedTuple):
+    field: str
+
+
+class Not(NamedTuple):
+    item: Any
+
+
+class And(NamedTuple):
+    items: Tuple[Any, ...]
+
+
+class Or(NamedTuple):
+    items: Tuple[Any, ...]
+
+
+Node = Union[Compare, Contains, Exists, Not, And, Or]
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<op>==|!=|<=|>=|&&|\|\||[=<>!(){},])
+      | (?P<word>[A-Za-z0-9_.:/\-]+)
+    )''', re.VERBOSE)
+
+_OPERATORS = {
+    '==': '==', '=': '==', 'eq': '==',
+    '!=': '!=', 'ne': '!=',
+    '<': '<', 'lt': '<',
+    '>': '>', 'gt': '>',
+    '<=': '<=', 'le': '<=',
+    '>=': '>=', 'ge': '>=',
+}
+
+# 字段: (类型, 协议约束, 记录中的键)
+_FIELDS = {
+    'ip.src': ('address', None, ('src',)),
+    'ip.dst': ('address', None, ('dst',)),
+    'ip.addr': ('address', None, ('src', 'dst')),
+    'tcp.port': ('port', 'TCP', ('sport', 'dport')),
+    'tcp.srcport': ('port', 'TCP', ('sport',)),
+    'tcp.dstport': ('port', 'TCP', ('dport',)),
+    'udp.port': ('port', 'UDP', ('sport', 'dport')),
+    'udp.srcport': ('port', 'UDP', ('sport',)),
+    'udp.dstport': ('port', 'UDP', ('dport',)),
+    'frame.len': ('int', None, ('length',)),
+}
+
+_PROTOCOLS = ('tcp', 'udp', 'ip', 'ipv6', 'http', 'frame')
+
+SYNTAX_HELP = (
+    "支持的格式:\n"
+    "- ip.src == 10.0.0.1 / ip.addr == 10.0.0.0/8\n"
+    "- tcp.port == 80 / udp.port in {53 5353} / tcp.dstport in {8000..8080}\n"
+    "- frame.len > 1000\n"
+    "- frame contains \"GET\"\n"
+    "- tcp / udp / ip / ipv6 / http\n"
+    "- 用 and / or / not 和括号组合"
+)
+
+
+def tokenize(text: str) -> List[Tuple[str, str]]:
+    """切分为 (类型, 文本) 列表"""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise ValueError(f"无法识别的字符: {text[position:].strip()[:20]}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器"""
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][1]
+        return None
+
+    def peek_keyword(self) -> Optional[str]:
+        token = self.peek()
+        return token.lower() if token is not None else None
+
+    def take(self) -> Tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise ValueError("表达式不完整")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, text: str):
+        kind, token = self.take()
+        if token != text:
+            raise ValueError(f"缺少 '{text}'，遇到 '{token}'")
+
+    def parse(self) -> Node:
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"多余的内容: {self.peek()}")
+        return node
+
+    def parse_or(self) -> Node:
+        items = [self.parse_and()]
+        while self.peek_keyword() in ('or', '||'):
+            self.take()
+            items.append(self.parse_and())
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def parse_and(self) -> Node:
+        items = [self.parse_not()]
+        while self.peek_keyword() in ('and', '&&'):
+            self.take()
+            items.append(self.parse_not())
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def parse_not(self) -> Node:
+        if self.peek_keyword() in ('not', '!'):
+            self.take()
+            return Not(self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self) -> Node:
+        kind, token = self.take()
+        if token == '(':
+            node = self.parse_or()
+            self.expect(')')
+            return node
+        if kind != 'word':
+            raise ValueError(f"需要字段名，遇到 '{token}'")
+        field = token.lower()
+        if field not in _FIELDS and field not in _PROTOCOLS:
+            raise ValueError(f"未知字段: {token}")
+
+        keyword = self.peek_keyword()
+        if keyword == 'contains':
+            self.take()
+            if field not in ('frame', 'http'):
+                raise ValueError(f"{field} 不支持 contains")
+            kind, value = self.take()
+            if kind != 'string':
+                raise ValueError("contains 需要带引号的字符串")
+            return Contains(field, _unquote(value))
+        if keyword == 'in':
+            if field not in _FIELDS:
+                raise ValueError(f"{field} 不支持 in")
+            self.take()
+            return Compare(field, 'in', self.parse_set(field))
+        if keyword in _OPERATORS:
+            self.take()
+            kind, value = self.take()
+            if kind != 'word':
+                raise ValueError(f"需要比较值，遇到 '{value}'")
+            return Compare(field, _OPERATORS[keyword], self.parse_value(field, value))
+        if field not in _PROTOCOLS:
+            raise ValueError(f"{field} 需要比较运算符")
+        return Exists(field)
+
+    def parse_set(self, field: str):
+        self.expect('{')
+        values = []
+        while self.peek() != '}':
+            kind, token = self.take()
+            if token == ',':
+                continue
+            if kind != 'word':
+                raise ValueError(f"集合中不能出现 '{token}'")
+            if _FIELDS[field][0] == 'address':
+                values.append(self.parse_value(field, token))
+            elif '..' in token:
+                low, _, high = token.partition('..')
+                low, high = self.parse_value(field, low), self.parse_value(field, high)
+                if low > high:
+                    raise ValueError(f"范围起点大于终点: {token}")
+                values.append((low, high))
+            else:
+                value = self.parse_value(field, token)
+                values.append((value, value))
+        self.expect('}')
+        if not values:
+            raise ValueError("集合不能为空")
+        return tuple(values)
+
+    def parse_value(self, field: str, token: str):
+        field_type = _FIELDS.get(field, (None,))[0]
+        if field_type == 'address':
+            return _parse_network(token)
+        if field_type in ('port', 'int'):
+            try:
+                value = int(token, 0)
+            except ValueError:
+                raise ValueError(f"{field} 需要整数: {token}") from None
+            if field_type == 'port' and not 0 <= value <= 65535:
+                raise ValueError(f"端口超出范围: {token}")
+            return value
+        raise ValueError(f"{field} 不能比较")
+
+
+def _unquote(token: str) -> bytes:
+    return re.sub(r'\\(.)', r'\1', token[1:-1]).encode('utf-8')
+
+
+def _parse_network(token: str) -> Tuple[int, int, int]:
+    """地址或 CIDR 转换为 (版本, 网络号, 前缀长度)"""
+    address, _, prefix = token.partition('/')
+    try:
+        version, value = parse_address(address)
+    except OSError:
+        raise ValueError(f"无效的地址: {token}") from None
+    bits = 32 if version == 4 else 128
+    length = bits
+    if prefix:
+        if not prefix.isdigit() or int(prefix) > bits:
+            raise ValueError(f"无效的前缀长度: {token}")
+        length = int(prefix)
+    mask = ((1 << length) - 1) << (bits - length)
+    return version, value & mask, length
+
+
+def parse(text: str) -> Node:
+    """解析过滤表达式，语法错误时抛出 ValueError"""
+    if not text or not text.strip():
+        raise ValueError("过滤表达式为空")
+    return _Parser(text).parse()
+
+
+# 编译
+
+def _payload(packet_info: Dict[str, Any]) -> bytes:
+    raw = packet_info.get('raw')
+    if raw is None:
+        packet = packet_info.get('raw_packet')
+        raw = (packet.original or bytes(packet)) if packet is not None else b''
+    return raw
+
+
+def _is_http(packet_info: Dict[str, Any]) -> bool:
+    if packet_info.get('protocol') != 'TCP':
+        return False
+    payload = _payload(packet_info)
+    return any(marker in payload for marker in HTTP_MARKERS)
+
+
+def _compile_exists(field: str) -> Matcher:
+    if field == 'tcp':
+        return lambda p: p.get('protocol') == 'TCP'
+    if field == 'udp':
+        return lambda p: p.get('protocol') == 'UDP'
+    if field == 'ip':
+        return lambda p: '.' in p.get('src', '')
+    if field == 'ipv6':
+        return lambda p: ':' in p.get('src', '')
+    if field == 'http':
+        return _is_http
+    return lambda p: True
+
+
+def _compile_contains(node: Contains) -> Matcher:
+    needle = node.value
+    if node.field == 'http':
+        return lambda p: _is_http(p) and needle in _payload(p)
+    return lambda p: needle in _payload(p)
+
+
+def _address_test(op: str, value) -> Callable[[str], bool]:
+    """单个文本地址的判断"""
+    if op == 'in':
+        tests = [_address_test('==', network) for network in value]
+        return lambda text: any(test(text) for test in tests)
+    version, network, length = value
+    if length == (32 if version == 4 else 128):
+        # 精确匹配直接比较规范化后的文本
+        expected = format_address(network, version)
+        return lambda text: text == expected
+    bits = 32 if version == 4 else 128
+    shift = bits - length
+    cache: Dict[str, Tuple[int, int]] = {}
+
+    def in_network(text: str) -> bool:
+        key = cache.get(text)
+        if key is None:
+            if len(cache) >= 65536:
+                cache.clear()
+            try:
+                key = parse_address(text)
+            except OSError:
+                key = (0, 0)
+            cache[text] = key
+        return key[0] == version and key[1] >> shift == network >> shift
+    return in_network
+
+
+def _number_test(op: str, value) -> Callable[[int], bool]:
+    if op == 'in':
+        exact = frozenset(low for low, high in value if low == high)
+        ranges = tuple((low, high) for low, high in value if low != high)
+        if not ranges:
+            return exact.__contains__
+        return lambda number: number in exact or any(low <= number <= high
+                                                     for low, high in ranges)
+    if op in ('==', '!='):
+        return lambda number: number == value
+    if op == '<':
+        return lambda number: number < value
+    if op == '>':
+        return lambda number: number > value
+    if op == '<=':
+        return lambda number: number <= value
+    return lambda number: number >= value
+
+
+def _compile_compare(node: Compare) -> Matcher:
+    field_type, protocol, keys = _FIELDS[node.field]
+    if field_type == 'address':
+        if node.op not in ('==', '!=', 'in'):
+            raise ValueError(f"{node.field} 只支持 ==、!= 和 in")
+        test = _address_test(node.op, node.value)
+        default = ''
+    else:
+        test = _number_test(node.op, node.value)
+        default = -1
+
+    # 最常见的形式单独展开，省去一层函数调用
+    if field_type == 'port' and node.op == '==' and len(keys) == 2:
+        port = node.value
+        return (lambda p: p.get('protocol') == protocol
+                and (p.get('sport') == port or p.get('dport') == port))
+
+    if len(keys) == 2:
+        first, second = keys
+        matcher = lambda p: test(p.get(first, default)) or test(p.get(second, default))
+    else:
+        key = keys[0]
+        matcher = lambda p: test(p.get(key, default))
+    if node.op == '!=':
+        # != 是 == 的否定，但协议约束仍然成立: tcp.port != 80 不匹配 UDP
+        matcher = (lambda inner: lambda p: not inner(p))(matcher)
+    if protocol:
+        return (lambda inner: lambda p: p.get('protocol') == protocol and inner(p))(matcher)
+    return matcher
+
+
+def _chain(matchers: List[Matcher], conjunction: bool) -> Matcher:
+    """把多个子条件连成二叉闭包链，短路求值"""
+    result = matchers[-1]
+    for matcher in reversed(matchers[:-1]):
+        if conjunction:
+            result = (lambda left, right: lambda p: left(p) and right(p))(matcher, result)
+        else:
+            result = (lambda left, right: lambda p: left(p) or right(p))(matcher, result)
+    return result
+
+
+def compile_node(node: Node) -> Matcher:
+    if isinstance(node, And):
+        return _chain([compile_node(item) for item in node.items], True)
+    if isinstance(node, Or):
+        return _chain([compile_node(item) for item in node.items], False)
+    if isinstance(node, Not):
+        inner = compile_node(node.item)
+        return lambda p: not inner(p)
+    if isinstance(node, Exists):
+        return _compile_exists(node.field)
+    if isinstance(node, Contains):
+        return _compile_contains(node)
+    return _compile_compare(node)
+
+
+def compile_filter(text: str) -> Matcher:
+    """解析并编译过滤表达式，返回 packet_info -> bool 的函数"""
+    return compile_node(parse(text))
+
+
+# 由索引回答的端口字段: (协议号, 是否精确)
+_INDEXED_PORTS = {
+    'tcp.port': (6, True), 'udp.port': (17, True),
+    'tcp.srcport': (6, False), 'tcp.dstport': (6, False),
+    'udp.srcport': (17, False), 'udp.dstport': (17, False),
+}
+
+
+def _union(arrays: List[np.ndarray]) -> np.ndarray:
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.concatenate(arrays))
+
+
+def _index_compare(node: Compare, store) -> Optional[Tuple[np.ndarray, bool]]:
+    if node.op not in ('==', 'in'):
+        return None
+    values = node.value if node.op == 'in' else ((node.value, node.value),)
+    field_type = _FIELDS[node.field][0]
+
+    if field_type == 'address':
+        fields = {'ip.src': ('src',), 'ip.dst': ('dst',), 'ip.addr': ('src', 'dst')}[node.field]
+        if node.op == '==':
+            values = (node.value,)
+        arrays = []
+        for version, network, length in values:
+            if length != (32 if version == 4 else 128):
+                # CIDR 无法用等值索引回答
+                return None
+            for field in fields:
+                seqs = store.lookup_address(field, version, network)
+                if seqs is None:
+                    return None
+                arrays.append(seqs)
+        return _union(arrays), True
+
+    if field_type == 'port' and node.field in _INDEXED_PORTS:
+        proto, exact = _INDEXED_PORTS[node.field]
+        arrays = []
+        for low, high in values:
+            if low != high:
+                return None
+            seqs = store.lookup_port(proto, low)
+            if seqs is None:
+                return None
+            arrays.append(seqs)
+        return _union(arrays), exact
+    return None
+
+
+def index_candidates(node: Node, store) -> Optional[Tuple[np.ndarray, bool]]:
+    """用 store 的索引求候选序号
+
+    返回 (升序的序号数组, 是否精确)；精确时结果就是匹配集合，否则还需逐个确认。
+    索引无法缩小范围时返回 None。
+    """
+    if isinstance(node, Compare):
+        return _index_compare(node, store)
+    if isinstance(node, And):
+        # 能回答的子条件取交集，其余子条件留给逐个确认
+        answers = [index_candidates(item, store) for item in node.items]
+        known = [answer for answer in answers if answer is not None]
+        if not known:
+            return None
+        seqs = known[0][0]
+        for other, _ in known[1:]:
+            seqs = np.intersect1d(seqs, other, assume_unique=True)
+        return seqs, len(known) == len(answers) and all(exact for _, exact in known)
+    if isinstance(node, Or):
+        answers = [index_candidates(item, store) for item in node.items]
+        if any(answer is None for answer in answers):
+            return None
+        return _union([seqs for seqs, _ in answers]), all(exact for _, exact in answers)
+    return None
+
+
+def _legacy_match(filter_expr: str, packet_info: Dict[str, Any]) -> bool:
+    """原来的 PacketCapture._match_filter，每个数据包都对过滤字符串执行正则"""
+    filter_expr = filter_expr.lower()
+    if 'tcp.port' in filter_expr:
+        if packet_info.get('protocol') != 'TCP':
+            return False
+        port = int(re.search(r'tcp\.port\s*==\s*(\d+)', filter_expr).group(1))
+        return packet_info.get('sport') == port or packet_info.get('dport') == port
+    if 'udp.port' in filter_expr:
+        if packet_info.get('protocol') != 'UDP':
+            return False
+        port = int(re.search(r'udp\.port\s*==\s*(\d+)', filter_expr).group(1))
+        return packet_info.get('sport') == port or packet_info.get('dport') == port
+    if 'ip.src' in filter_expr:
+        ip = re.search(r'ip\.src\s*==\s*([0-9.]+)', filter_expr).group(1)
+        return packet_info.get('src') == ip
+    if 'ip.dst' in filter_expr:
+        ip = re.search(r'ip\.dst\s*==\s*([0-9.]+)', filter_expr).group(1)
+        return packet_info.get('dst') == ip
+    if filter_expr == 'tcp':
+        return packet_info.get('protocol') == 'TCP'
+    if filter_expr == 'udp':
+        return packet_info.get('protocol') == 'UDP'
+    return False
+
+
+def selfcheck_and_benchmark(count: int = 200000):
+    """与原匹配器核对结果并对比每秒匹配次数"""
+    import time
+    from traffic_replay import SyntheticTraffic, parse_mix
+    from asciimatics_wireshark import parse_raw_frame
+
+    frames = SyntheticTraffic(parse_mix('tcp=60,udp=30,icmp=10')).frames
+    records = [parse_raw_frame(frame, i) for i, frame in enumerate(frames)]
+    records = [record for record in records if record is not None]
+    sample = records[0]
+
+    # 原匹配器能表达的过滤器: 结果必须一致
+    legacy_filters = ['tcp', 'udp', 'tcp.port == 443', 'udp.port == 53',
+                      f"ip.src == {sample['src']}", f"ip.dst == {sample['dst']}"]
+    mismatches = 0
+    for text in legacy_filters:
+        matcher = compile_filter(text)
+        mismatches += sum(matcher(record) != _legacy_match(text, record) for record in records)
+    print(f"与原匹配器核对: {len(legacy_filters)} 个过滤器, {len(records)} 个数据包, "
+          f"{mismatches} 处不一致")
+
+    compound = ['tcp.port == 443 or udp.port in {53 5353}',
+                'ip.addr == 10.0.0.0/8 and not tcp.dstport in {1..1023}',
+                '(tcp or udp) and frame.len > 100 and ip.dst != 192.168.1.1']
+    repeat = max(1, count // len(records))
+    print(f"{'过滤器':<56}{'原匹配器':>12}{'编译后':>12}  (次/秒)")
+    for text in legacy_filters + compound:
+        matcher = compile_filter(text)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for record in records:
+                matcher(record)
+        compiled_rate = repeat * len(records) / (time.perf_counter() - start)
+        legacy = '-'
+        if text in legacy_filters:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for record in records:
+                    _legacy_match(text, record)
+            legacy = f"{repeat * len(records) / (time.perf_counter() - start):,.0f}"
+        print(f"{text:<56}{legacy:>12}{compiled_rate:>12,.0f}")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    selfcheck_and_benchmark()
@@ -0,0 +1,465 @@
+"""连接跟踪流表
+
+按五元组 (协议、两端的地址和端口) 把数据包归入双向的流，增量维护每个方向的
+数据包数和字节数、首次/最后出现时间和 TCP 连接状态。流的正方向为发起方:
+看到的第一个数据包的源端，第一个数据包是 SYN+ACK 时为其目标端。
+
+空闲的流由时间轮淘汰: 时间按 tick 分槽，每个流挂在其超时时刻所在的槽上，
+时间前进时只检查到期的槽。收到数据包时流不移动 (只更新最后出现时间)，
+到期检查发现仍然活跃时再挂到新的超时槽，所以每个数据包的开销是 O(1)，
+大量短连接各自只在超时后被检查一次。超时时长按状态区分，已关闭的 TCP 连接
+很快被淘汰；流的数量另有上限，超出时提前淘汰最早到期的流。
+
+时间取自数据包的时间戳，读取文件时按抓包时的时间淘汰。
+
+直接运行本文件会校验状态跟踪和淘汰，并用大量短连接测试吞吐和内存。
+"""
+import heapq
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fast_dissect import PROTOCOL_NAMES, format_address, parse_address
+
+# TCP 标志位
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# TCP 连接状态
+SYN_SENT = 'SYN_SENT'
+SYN_RECV = 'SYN_RECV'
+ESTABLISHED = 'ESTABLISHED'
+FIN_WAIT = 'FIN_WAIT'  # 一方已发送 FIN
+CLOSED = 'CLOSED'  # 双方都已发送 FIN 或出现 RST
+# 其他协议的状态
+UNREPLIED = 'UNREPLIED'  # 只看到了正方向
+REPLIED = 'REPLIED'
+
+# 各状态的空闲超时 (秒)
+DEFAULT_TIMEOUTS = {
+    SYN_SENT: 30,
+    SYN_RECV: 30,
+    ESTABLISHED: 300,
+    FIN_WAIT: 30,
+    CLOSED: 5,
+    UNREPLIED: 30,
+    REPLIED: 120,
+}
+
+_PROTOCOL_NUMBERS = {name: number for number, name in PROTOCOL_NAMES.items()}
+
+
+class Flow:
+    """一个双向流，out 为正方向 (发起方到响应方)，in 为反方向"""
+    __slots__ = ('proto', 'version', 'src', 'sport', 'dst', 'dport', 'first_ns', 'last_ns',
+                 'packets_out', 'bytes_out', 'packets_in', 'bytes_in', 'state', 'fins', 'slot')
+
+    def __init__(self, proto: int, version: int, src: int, sport: int, dst: int, dport: int,
+                 ts_ns: int, state: str):
+        self.proto = proto
+        self.version = version
+        self.src = src
+        self.sport = sport
+        self.dst = dst
+        self.dport = dport
+        self.first_ns = self.last_ns = ts_ns
+        self.packets_out = self.bytes_out = self.packets_in = self.bytes_in = 0
+        self.state = state
+        self.fins = 0  # 已发送 FIN 的方向: 1 正方向, 2 反方向
+        self.slot = 0  # 所在时间轮槽的绝对 tick
+
+    @property
+    def packets(self) -> int:
+        return self.packets_out + self.packets_in
+
+    @property
+    def bytes(self) -> int:
+        return self.bytes_out + self.bytes_in
+
+    @property
+    def duration(self) -> float:
+        return (self.last_ns - self.first_ns) / 1e9
+
+    @property
+    def protocol(self) -> str:
+        return PROTOCOL_NAMES.get(self.proto, str(self.proto) if self.proto else "IP")
+
+    def endpoint(self, address: int, port: int) -> str:
+        text = format_address(address, self.version)
+        if not port:
+            return text
+        return f"[{text}]:{port}" if self.version == 6 else f"{text}:{port}"
+
+    def __str__(self) -> str:
+        return (f"{self.protocol:<6} {self.endpoint(self.src, self.sport)} <-> "
+                f"{self.endpoint(self.dst, self.dport)} {self.state} "
+                f"{self.packets_out}/{self.packets_in}包 {self.bytes_out}/{self.bytes_in}字节 "
+                f"{self.duration:.1f}s")
+
+
+# 流视图的排序方式: 名称 -> 排序键，均按从大到小排列
+SORT_KEYS: Dict[str, Callable[[Flow], Any]] = {
+    'bytes': lambda flow: flow.bytes_out + flow.bytes_in,
+    'packets': lambda flow: flow.packets_out + flow.packets_in,
+    'last': lambda flow: flow.last_ns,
+    'duration': lambda flow: flow.last_ns - flow.first_ns,
+}
+
+
+class FlowTable:
+    """五元组流表，空闲的流由时间轮淘汰
+
+    tick 为时间轮的精度 (秒)，wheel_size 个槽覆盖的时长应不小于最长的超时，
+    更长的超时会在一圈后重新检查。只在一个线程中使用。
+    """
+    def __init__(self, max_flows: int = 1_000_000, tick: float = 1.0, wheel_size: int = 512,
+                 timeouts: Optional[Dict[str, float]] = None):
+        if max_flows < 1 or wheel_size < 2:
+            raise ValueError("max_flows 和 wheel_size 必须为正数")
+        self.max_flows = max_flows
+        self.tick_ns = int(tick * 1e9)
+        self.timeouts = {state: int(seconds * 1e9)
+                         for state, seconds in {**DEFAULT_TIMEOUTS, **(timeouts or {})}.items()}
+        self.flows: Dict[Tuple[int, ...], Flow] = {}
+        self._wheel: List[Dict[Tuple[int, ...], Flow]] = [{} for _ in range(wheel_size)]
+        self._tick: Optional[int] = None  # 当前 tick，第一个数据包到达时确定
+        # 上一次 top 的结果 (排序方式, 数量, 键 -> 流) 和此后更新过且仍在表中的流，见 top；
+        # 后者以流对象本身为键 (按身份哈希)，比重新计算五元组的哈希便宜
+        self._top: Optional[Tuple[str, int, Dict[Tuple[int, ...], Flow]]] = None
+        self._touched: Dict[Flow, Tuple[int, ...]] = {}
+        self.created = 0
+        self.expired = 0  # 空闲超时淘汰
+        self.evicted = 0  # 超出上限提前淘汰
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+    def clear(self):
+        self.flows.clear()
+        for slot in self._wheel:
+            slot.clear()
+        self._tick = None
+        self._top = None
+        self._touched = {}
+
+    def update(self, version: int, proto: int, src: int, sport: int, dst: int, dport: int,
+               length: int, ts_ns: int, tcp_flags: int = 0) -> Flow:
+        """记录一个数据包，返回其所属的流"""
+        tick = ts_ns // self.tick_ns
+        if self._tick is None:
+            self._tick = tick
+        elif tick > self._tick:
+            self._advance(tick)
+
+        if (src, sport) <= (dst, dport):
+            key = (proto, version, src, sport, dst, dport)
+        else:
+            key = (proto, version, dst, dport, src, sport)
+        flow = self.flows.get(key)
+        if flow is None:
+            if len(self.flows) >= self.max_flows:
+                self._evict_earliest()
+            flow = self._create(key, version, proto, src, sport, dst, dport, ts_ns, tcp_flags)
+            forward = flow.src == src and flow.sport == sport
+        else:
+            forward = flow.src == src and flow.sport == sport
+            state = flow.state
+            if proto == 6:
+                state = self._tcp_transition(flow, forward, tcp_flags)
+            elif not forward:
+                state = REPLIED
+            if ts_ns > flow.last_ns:
+                flow.last_ns = ts_ns
+            if state is not flow.state:
+                flow.state = state
+                # 超时变短时提前到新的槽，变长时由到期检查顺延
+                if self._deadline_tick(flow) < flow.slot:
+                    del self._wheel[flow.slot % len(self._wheel)][key]
+                    self._schedule(key, flow)
+        if forward:
+            flow.packets_out += 1
+            flow.bytes_out += length
+        else:
+            flow.packets_in += 1
+            flow.bytes_in += length
+        self._touched[flow] = key
+        return flow
+
+    def update_info(self, packet_info: Dict[str, Any]) -> Optional[Flow]:
+        """由界面的数据包记录 (文本地址) 更新，非 IP 数据包返回 None"""
+        try:
+            version, src = parse_address(packet_info.get('src', ''))
+            dst_version, dst = parse_address(packet_info.get('dst', ''))
+        except OSError:
+            return None
+        if not version or version != dst_version:
+            return None
+        return self.update(version, _PROTOCOL_NUMBERS.get(packet_info.get('protocol'), 0),
+                           src, packet_info.get('sport', 0), dst, packet_info.get('dport', 0),
+                           packet_info.get('length', 0), packet_info['time_ns'],
+                           packet_info.get('tcp_flags', 0))
+
+    def update_columns(self, columns):
+        """由 batch_dissect.FrameColumns 整批更新，非 IP 帧被跳过"""
+        rows = (columns.ip_version != 0).nonzero()[0]
+        if not rows.size:
+            return
+        sources = ((columns.src_hi[rows].astype(object) << 64) | columns.src_lo[rows]).tolist()
+        destinations = ((columns.dst_hi[rows].astype(object) << 64) | columns.dst_lo[rows]).tolist()
+        update = self.update
+        for fields in zip(columns.ip_version[rows].tolist(), columns.proto[rows].tolist(),
+                          sources, columns.sport[rows].tolist(),
+                          destinations, columns.dport[rows].tolist(),
+                          columns.length[rows].tolist(), columns.ts_ns[rows].tolist(),
+                          columns.tcp_flags[rows].tolist()):
+            update(*fields)
+
+    def _create(self, key, version: int, proto: int, src: int, sport: int, dst: int, dport: int,
+                ts_ns: int, tcp_flags: int) -> Flow:
+        if proto != 6:
+            flow = Flow(proto, version, src, sport, dst, dport, ts_ns, UNREPLIED)
+        elif tcp_flags & (TCP_SYN | TCP_ACK) == TCP_SYN | TCP_ACK:
+            # 先看到的是响应方的 SYN+ACK
+            flow = Flow(proto, version, dst, dport, src, sport, ts_ns, SYN_RECV)
+        elif tcp_flags & TCP_SYN:
+            flow = Flow(proto, version, src, sport, dst, dport, ts_ns, SYN_SENT)
+        else:
+            # 中途开始的连接
+            flow = Flow(proto, version, src, sport, dst, dport, ts_ns, ESTABLISHED)
+            if tcp_flags & (TCP_FIN | TCP_RST):
+                flow.state = self._tcp_transition(flow, True, tcp_flags)
+        self.flows[key] = flow
+        self.created += 1
+        self._schedule(key, flow)
+        return flow
+
+    @staticmethod
+    def _tcp_transition(flow: Flow, forward: bool, flags: int) -> str:
+        state = flow.state
+        if flags & TCP_RST:
+            return CLOSED
+        if flags & TCP_FIN:
+            flow.fins |= 1 if forward else 2
+            return CLOSED if flow.fins == 3 else FIN_WAIT
+        if flags & TCP_SYN:
+            if not flags & TCP_ACK:
+                if state == CLOSED:
+                    # 端口复用，开始新的连接
+                    flow.fins = 0
+                    return SYN_SENT
+                return state
+            return SYN_RECV if state == SYN_SENT else state
+        if state == SYN_RECV and forward and flags & TCP_ACK:
+            return ESTABLISHED
+        return state
+
+    def _deadline_tick(self, flow: Flow) -> int:
+        """流在哪个 tick 开始时超时 (向上取整)"""
+        return -(-(flow.last_ns + self.timeouts[flow.state]) // self.tick_ns)
+
+    def _schedule(self, key, flow: Flow):
+        """把流挂到超时所在的槽上，超出一圈的挂在最远的槽，到时再顺延"""
+        current = self._tick
+        slot = min(max(self._deadline_tick(flow), current + 1), current + len(self._wheel) - 1)
+        flow.slot = slot
+        self._wheel[slot % len(self._wheel)][key] = flow
+
+    def _advance(self, tick: int):
+        """时间前进到 tick，检查经过的槽；跨度超过一圈时每个槽只检查一次"""
+        previous = self._tick
+        self._tick = tick
+        size = len(self._wheel)
+        now_ns = tick * self.tick_ns
+        for current in range(previous + 1, previous + 1 + min(tick - previous, size)):
+            index = current % size
+            slot = self._wheel[index]
+            if not slot:
+                continue
+            self._wheel[index] = {}
+            for key, flow in slot.items():
+                if flow.slot > tick:
+                    # 本轮顺延时挂上来的
+                    self._wheel[index][key] = flow
+                elif flow.last_ns + self.timeouts[flow.state] > now_ns:
+                    self._schedule(key, flow)
+                else:
+                    del self.flows[key]
+                    self._touched.pop(flow, None)
+                    self.expired += 1
+
+    def _evict_earliest(self):
+        """流表已满，淘汰最早到期的一个流"""
+        size = len(self._wheel)
+        for current in range(self._tick + 1, self._tick + size):
+            slot = self._wheel[current % size]
+            if slot:
+                key = next(iter(slot))
+                flow = slot.pop(key)
+                del self.flows[key]
+                self._touched.pop(flow, None)
+                self.evicted += 1
+                return
+
+    def top(self, count: int, sort: str = 'bytes') -> List[Flow]:
+        """按 sort 排序的前 count 个流
+
+        所有排序键都只在流被更新时增大，没被更新的流不会超过上一次的前 count 个，
+        因此只需在上一次的结果和此后更新过的流中选取。排序方式或数量变化、
+        或上一次的结果中有流已被淘汰时，才遍历整个流表。
+        """
+        key = SORT_KEYS[sort]
+        touched, self._touched = self._touched, {}
+        flows = self.flows
+        previous = self._top
+        if (previous is not None and previous[0] == sort and previous[1] == count
+                and all(flows.get(k) is flow for k, flow in previous[2].items())):
+            # 被淘汰的流已从 touched 中移除
+            candidates = dict(previous[2])
+            candidates.update((k, flow) for flow, k in touched.items())
+        else:
+            candidates = flows
+        best = heapq.nlargest(count, candidates.items(), key=lambda item: key(item[1]))
+        self._top = (sort, count, dict(best))
+        return [flow for _, flow in best]
+
+    def memory_bytes(self) -> int:
+        """流表占用的内存估算: 字典、时间轮，以及按一个样本估算的流对象和键"""
+        total = sys.getsizeof(self.flows) + sum(sys.getsizeof(slot) for slot in self._wheel)
+        if self.flows:
+            key, flow = next(iter(self.flows.items()))
+            per_flow = (sys.getsizeof(flow) + sys.getsizeof(key) + sys.getsizeof(flow.src)
+                        + sys.getsizeof(flow.dst) + sys.getsizeof(flow.first_ns)
+                        + sys.getsizeof(flow.last_ns))
+            total += per_flow * len(self.flows)
+        return total
+
+    def summary(self) -> str:
+        return (f"流: {len(self.flows)} 个活跃, 共 {self.created} 个, "
+                f"超时 {self.expired}, 超限淘汰 {self.evicted}, "
+                f"约 {self.memory_bytes() / 1e6:.1f}MB")
+
+
+def selfcheck() -> bool:
+    """校验 TCP 状态跟踪、方向计数和空闲淘汰"""
+    second = 1_000_000_000
+    table = FlowTable()
+    client, server = parse_address('10.0.0.1')[1], parse_address('10.0.0.2')[1]
+    handshake = [(client, 40000, server, 80, TCP_SYN), (server, 80, client, 40000, TCP_SYN | TCP_ACK),
+                 (client, 40000, server, 80, TCP_ACK)]
+    for i, (src, sport, dst, dport, flags) in enumerate(handshake):
+        flow = table.update(4, 6, src, sport, dst, dport, 60, i * 1000, flags)
+    checks = [
+        ('三次握手', flow.state == ESTABLISHED),
+        ('方向计数', (flow.packets_out, flow.packets_in, flow.bytes_out) == (2, 1, 120)),
+        ('发起方', (flow.src, flow.sport) == (client, 40000)),
+    ]
+    table.update(4, 6, client, 40000, server, 80, 60, 2 * second, TCP_FIN | TCP_ACK)
+    checks.append(('单方 FIN', flow.state == FIN_WAIT))
+    table.update(4, 6, server, 80, client, 40000, 60, 2 * second, TCP_FIN | TCP_ACK)
+    checks.append(('双方 FIN', flow.state == CLOSED))
+
+    # SYN+ACK 先到时以其目标端为发起方
+    late = table.update(4, 6, server, 443, client, 50000, 60, 2 * second, TCP_SYN | TCP_ACK)
+    checks.append(('SYN+ACK 方向', (late.src, late.sport, late.packets_in) == (client, 50000, 1)))
+    udp = table.update(4, 17, client, 5353, server, 53, 80, 2 * second)
+    table.update(4, 17, server, 53, client, 5353, 120, 2 * second)
+    checks.append(('UDP 应答', udp.state == REPLIED and udp.bytes_in == 120))
+
+    # 已关闭的 TCP 连接 5 秒后淘汰，其余还在
+    table.update(4, 17, client, 1, server, 2, 60, 8 * second)
+    checks.append(('关闭后淘汰', len(table) == 3 and table.expired == 1))
+    # SYN_RECV 30 秒、UDP 120 秒
+    table.update(4, 17, client, 1, server, 2, 60, 33 * second)
+    checks.append(('握手超时', len(table) == 2))
+    table.update(4, 17, client, 1, server, 2, 60, 130 * second)
+    # 8 秒创建的 UDP 流在 63 秒超时，130 秒的数据包重新建流
+    checks.append(('应答超时', len(table) == 1 and table.expired == 4))
+    # 跨越多圈也只淘汰已超时的流
+    table.update(4, 17, client, 3, server, 4, 60, 10_000 * second)
+    checks.append(('跨圈', len(table) == 1 and table.expired == 5))
+
+    small = FlowTable(max_flows=10)
+    for port in range(25):
+        small.update(4, 17, client, port, server, 53, 60, port * 1000)
+    checks.append(('上限', len(small) == 10 and small.evicted == 15))
+
+    # 增量的 top 与遍历整个流表的结果一致，包括流被淘汰、排序方式变化的情况
+    rng = random.Random(1)
+    churn = FlowTable(max_flows=300)
+    consistent = True
+    for round_ in range(200):
+        for _ in range(rng.randrange(0, 50)):
+            port = rng.randrange(400)
+            churn.update(4, 17, client, port, server, 53, rng.randrange(60, 1500),
+                         round_ * second + rng.randrange(second))
+        sort = 'bytes' if round_ < 100 else rng.choice(list(SORT_KEYS))
+        expected = [SORT_KEYS[sort](flow)
+                    for flow in heapq.nlargest(20, churn.flows.values(), key=SORT_KEYS[sort])]
+        consistent &= [SORT_KEYS[sort](flow) for flow in churn.top(20, sort)] == expected
+    checks.append(('增量排序', consistent))
+
+    failed = [name for name, ok in checks if not ok]
+    print(f"流表自检: {len(checks) - len(failed)}/{len(checks)} 通过" +
+          (f", 失败: {', '.join(failed)}" if failed else ""))
+    return not failed
+
+
+def benchmark(connections: int = 200_000, rate: int = 20_000):
+    """大量短连接: 每个连接握手、一次请求响应、四次挥手，共 8 个数据包
+
+    连接按 rate 个/秒到达，活跃流的数量应稳定在 rate 乘以关闭后超时附近，
+    不随连接总数增长。
+    """
+    gap_ns = 1_000_000_000 // rate
+    client_base = parse_address('10.0.0.0')[1]
+    server = parse_address('192.168.1.1')[1]
+    exchange = ((True, TCP_SYN, 74), (False, TCP_SYN | TCP_ACK, 74), (True, TCP_ACK, 66),
+                (True, TCP_ACK, 400), (False, TCP_ACK, 1500), (True, TCP_FIN | TCP_ACK, 66),
+                (False, TCP_FIN | TCP_ACK, 66), (True, TCP_ACK, 66))
+    table = FlowTable()
+    peak = 0
+    packets = 0
+    start = time.perf_counter()
+    for i in range(connections):
+        client = client_base + (i >> 14)
+        port = 1024 + (i & 0x3FFF)
+        ts_ns = i * gap_ns
+        for step, (forward, flags, length) in enumerate(exchange):
+            if forward:
+                table.update(4, 6, client, port, server, 80, length, ts_ns + step * 1000, flags)
+            else:
+                table.update(4, 6, server, 80, client, port, length, ts_ns + step * 1000, flags)
+        packets += len(exchange)
+        if not i % 1024 and len(table) > peak:
+            peak = len(table)
+    elapsed = time.perf_counter() - start
+    print(f"短连接: {connections} 个 ({packets} 包), {rate} 个/秒")
+    print(f"更新: {elapsed / packets * 1e9:.0f} ns/包")
+    print(f"活跃流峰值: {peak}, 结束时 {table.summary()}")
+    start = time.perf_counter()
+    table.top(50, 'bytes')
+    print(f"排序前 50 个: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # 界面每秒刷新: 大流表中每秒只有一部分流有新数据包，增量 top 只看这部分
+    large = FlowTable()
+    for i in range(500_000):
+        large.update(4, 17, client_base + i, 5000, server, 53, 100, 0)
+    start = time.perf_counter()
+    large.top(200, 'bytes')
+    full = time.perf_counter() - start
+    for i in range(0, 500_000, 100):
+        large.update(4, 17, client_base + i, 5000, server, 53, 100, 1000)
+    start = time.perf_counter()
+    large.top(200, 'bytes')
+    incremental = time.perf_counter() - start
+    print(f"{len(large)} 个流排序前 200 个: 全表 {full * 1000:.1f} ms, "
+          f"更新 5000 个流后增量 {incremental * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    ok = selfcheck()
+    benchmark()
+    raise SystemExit(0 if ok else 1)
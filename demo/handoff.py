@@ -0,0 +1,336 @@
+"""抓包线程与界面线程之间的交接缓冲区
+
+SpscRing 是单生产者/单消费者的无锁环形缓冲区: 槽位预先分配，生产者
+(抓包线程) 逐个放入，消费者 (界面定时器) 每次用 drain 批量取出，
+每个数据包不再经过 queue.Queue 的锁和条件变量。
+
+HandoffBuffer 在 SpscRing 之上同时限制条目数和内存字节数，超出时按策略处理:
+
+- drop-newest: 丢弃新到达的条目，保留已缓冲的数据
+- drop-oldest: 淘汰最旧的条目，界面总是看到最新的流量
+- sample: 溢出期间每 sample_every 个新条目保留一个 (淘汰最旧的腾出空间)，
+  其余丢弃，突发期间仍能看到均匀分布的样本
+
+两者都保留了 queue.Queue 的非阻塞接口 (put_nowait/get_nowait/empty)。
+直接运行本文件会执行与 queue.Queue 的对比基准测试。
+"""
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class SpscRing:
+    """单生产者/单消费者环形缓冲区
+
+    _tail 和 _floor 只由生产者写，_head 只由消费者写，依赖 GIL 保证单个属性
+    和列表元素读写的原子性，因此不需要锁。序号单调递增，槽位为序号按 2 的幂取模。
+
+    生产者可以用 evict_oldest 淘汰尚未被消费的最旧条目: 先推进 _floor 再清空槽位，
+    消费者拷贝完成后重新读取 _floor，丢弃拷贝期间被淘汰的条目。
+    已被消费的槽位不主动清空 (清空会与生产者竞争)，其中的引用在槽位被复用时释放，
+    最多保留一圈槽位的旧引用。
+    """
+    def __init__(self, capacity: int = 16384):
+        self.capacity = capacity
+        size = 1 << max(capacity - 1, 0).bit_length()
+        self._mask = size - 1
+        self._size = size
+        self._slots: List[Any] = [None] * size
+        self._sizes: List[int] = [0] * size
+        self._head = 0  # 消费者: 下一个要读取的序号
+        self._tail = 0  # 生产者: 下一个要写入的序号
+        self._floor = 0  # 生产者: 小于该序号的条目已被淘汰
+        # 字节计数分别由生产者和消费者维护，相减得到近似占用
+        self._bytes_in = 0
+        self._bytes_evicted = 0
+        self._bytes_out = 0
+
+    def _start(self) -> int:
+        head = self._head
+        floor = self._floor
+        return head if head > floor else floor
+
+    def __len__(self) -> int:
+        return self._tail - self._start()
+
+    qsize = __len__
+
+    @property
+    def bytes(self) -> int:
+        """缓冲中条目的近似字节数"""
+        return self._bytes_in - self._bytes_evicted - self._bytes_out
+
+    def empty(self) -> bool:
+        return self._tail == self._start()
+
+    def full(self) -> bool:
+        return self._tail - self._start() >= self.capacity
+
+    # 生产者接口
+
+    def put(self, item: Any, size: int = 0) -> bool:
+        """放入一个条目，已满时返回 False"""
+        tail = self._tail
+        if tail - self._start() >= self.capacity:
+            return False
+        index = tail & self._mask
+        self._slots[index] = item
+        self._sizes[index] = size
+        self._bytes_in += size
+        # 最后发布序号，消费者看到新的 _tail 时槽位已经写好
+        self._tail = tail + 1
+        return True
+
+    def put_nowait(self, item: Any, size: int = 0):
+        """与 queue.Queue 兼容: 已满时抛出 queue.Full"""
+        if not self.put(item, size):
+            raise queue.Full
+
+    def evict_oldest(self) -> bool:
+        """淘汰最旧的未消费条目，缓冲为空时返回 False"""
+        start = self._start()
+        if start >= self._tail:
+            return False
+        index = start & self._mask
+        self._floor = start + 1
+        self._bytes_evicted += self._sizes[index]
+        self._slots[index] = None
+        return True
+
+    # 消费者接口
+
+    def drain(self, max_n: Optional[int] = None) -> List[Any]:
+        """一次取出最多 max_n 个条目"""
+        tail = self._tail
+        start = self._start()
+        count = tail - start
+        if max_n is not None and count > max_n:
+            count = max_n
+        if count <= 0:
+            return []
+
+        first = start & self._mask
+        last = first + count
+        if last <= self._size:
+            items = self._slots[first:last]
+            sizes = self._sizes[first:last]
+        else:
+            last -= self._size
+            items = self._slots[first:] + self._slots[:last]
+            sizes = self._sizes[first:] + self._sizes[:last]
+
+        # 拷贝期间被生产者淘汰的条目不能返回
+        floor = self._floor
+        if floor > start:
+            skip = min(floor - start, count)
+            items = items[skip:]
+            sizes = sizes[skip:]
+
+        self._bytes_out += sum(sizes)
+        self._head = start + count
+        return items
+
+    def get_nowait(self) -> Any:
+        """与 queue.Queue 兼容: 为空时抛出 queue.Empty"""
+        while not self.empty():
+            items = self.drain(1)
+            if items:
+                return items[0]
+        raise queue.Empty
+
+    get = get_nowait
+
+    def clear(self):
+        self.drain()
+
+
+class HandoffBuffer:
+    """有界、按策略溢出的交接缓冲区
+
+    put 只在抓包线程调用，drain/get_nowait 只在界面线程调用。
+    """
+    POLICIES = ('drop-newest', 'drop-oldest', 'sample')
+
+    def __init__(self, capacity: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 policy: str = 'drop-oldest', sample_every: int = 10):
+        if policy not in self.POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self._ring = SpscRing(capacity)
+        # 统计信息 (均由生产者维护)
+        self.offered = 0
+        self.accepted = 0
+        self.dropped = 0  # 被拒绝的新条目
+        self.evicted = 0  # 被淘汰的旧条目
+        self.high_watermark = 0
+        self._overflow_seq = 0
+
+    @property
+    def bytes(self) -> int:
+        return self._ring.bytes
+
+    def _fits(self, size: int) -> bool:
+        return not self._ring.full() and self._ring.bytes + size <= self.max_bytes
+
+    def put(self, item: Any, size: int = 0) -> bool:
+        """放入一个条目，size 为其估算的内存占用，返回是否被接收"""
+        self.offered += 1
+        if self._fits(size):
+            self._overflow_seq = 0
+        else:
+            if self.policy == 'drop-newest' or size > self.max_bytes:
+                self.dropped += 1
+                return False
+            if self.policy == 'sample':
+                self._overflow_seq += 1
+                if self._overflow_seq % self.sample_every:
+                    self.dropped += 1
+                    return False
+            while not self._fits(size) and self._ring.evict_oldest():
+                self.evicted += 1
+        self._ring.put(item, size)
+        self.accepted += 1
+        occupancy = len(self._ring)
+        if occupancy > self.high_watermark:
+            self.high_watermark = occupancy
+        return True
+
+    def put_nowait(self, item: Any, size: int = 0):
+        """与 queue.Queue 兼容: 未被接收时抛出 queue.Full"""
+        if not self.put(item, size):
+            raise queue.Full
+
+    def drain(self, max_n: Optional[int] = None) -> List[Any]:
+        """一次取出最多 max_n 个条目"""
+        return self._ring.drain(max_n)
+
+    def get_nowait(self) -> Any:
+        return self._ring.get_nowait()
+
+    get = get_nowait
+
+    def clear(self):
+        self._ring.clear()
+
+    def empty(self) -> bool:
+        return self._ring.empty()
+
+    def qsize(self) -> int:
+        return len(self._ring)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """占用与溢出统计"""
+        return {
+            'policy': self.policy,
+            'occupancy': len(self._ring),
+            'capacity': self.capacity,
+            'bytes': self._ring.bytes,
+            'max_bytes': self.max_bytes,
+            'high_watermark': self.high_watermark,
+            'offered': self.offered,
+            'accepted': self.accepted,
+            'dropped': self.dropped,
+            'evicted': self.evicted,
+        }
+
+
+def _bench_queue(total: int, pps: float, tick: float, capacity: int) -> Dict[str, float]:
+    """原有用法: put_nowait 入队，界面定时 while not empty(): get_nowait()"""
+    q: queue.Queue = queue.Queue(maxsize=capacity)
+
+    def produce(item) -> bool:
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def consume() -> int:
+        count = 0
+        while not q.empty():
+            try:
+                q.get_nowait()
+                count += 1
+            except queue.Empty:
+                break
+        return count
+
+    return _run_bench(produce, consume, q.empty, total, pps, tick)
+
+
+def _bench_ring(total: int, pps: float, tick: float, capacity: int) -> Dict[str, float]:
+    """SpscRing: put 入队，界面定时 drain"""
+    ring = SpscRing(capacity)
+    return _run_bench(ring.put, lambda: len(ring.drain()), ring.empty, total, pps, tick)
+
+
+def _run_bench(produce, consume, empty, total, pps, tick) -> Dict[str, float]:
+    """生产者按 1000 个一批控制速率，消费者每 tick 秒取空一次
+
+    分别统计两端花在入队和出队上的时间 (不含等待)，以及被拒绝 (缓冲已满) 的条目数。
+    """
+    done = threading.Event()
+    received = 0
+    consume_time = 0.0
+
+    def consumer():
+        nonlocal received, consume_time
+        while not done.is_set() or not empty():
+            time.sleep(tick)
+            t0 = time.perf_counter()
+            received += consume()
+            consume_time += time.perf_counter() - t0
+
+    thread = threading.Thread(target=consumer)
+    thread.start()
+    produce_time = 0.0
+    dropped = 0
+    start = time.perf_counter()
+    for base in range(0, total, 1000):
+        if pps:
+            delay = start + base / pps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        for i in range(base, min(base + 1000, total)):
+            if not produce(i):
+                dropped += 1
+        produce_time += time.perf_counter() - t0
+    done.set()
+    thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'rate': total / elapsed,
+        'produce_ns': produce_time / total * 1e9,
+        'consume_ns': consume_time / max(received, 1) * 1e9,
+        'received': received,
+        'dropped': dropped,
+    }
+
+
+def benchmark(total: int = 1_000_000, tick: float = 0.01, capacity: int = 10000):
+    """对比 queue.Queue 与 SpscRing 在全速和 100k/200k 包/秒下的开销
+
+    容量为 capacity 时全速生产会让缓冲区溢出，而被拒绝的入队远比成功的便宜，
+    两者丢弃的比例不同时入队耗时没有可比性。因此全速一行把两者的容量都设为
+    全部条目数，保证处理完全相同的工作量；限速的行使用界面实际的容量，
+    每行都列出送达和丢弃的数量。
+    """
+    print(f"{'方式':<12}{'目标速率':>10}{'容量':>10}{'实际速率':>12}{'入队ns/包':>10}{'出队ns/包':>10}"
+          f"  送达/丢弃/总数")
+    for pps in (0, 100_000, 200_000):
+        n = total if pps == 0 else int(pps * 2)
+        size = n if pps == 0 else capacity
+        for name, bench in (('queue.Queue', _bench_queue), ('SpscRing', _bench_ring)):
+            result = bench(n, pps, tick, size)
+            target = '尽快' if pps == 0 else f"{pps:,}"
+            print(f"{name:<12}{target:>10}{size:>10,}{result['rate']:>12,.0f}{result['produce_ns']:>10.0f}"
+                  f"{result['consume_ns']:>10.0f}  {result['received']}/{result['dropped']}/{n}")
+
+
+if __name__ == "__main__":
+    benchmark()
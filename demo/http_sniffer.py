@@ -5,13 +5,20 @@ from textual.binding import Binding
 from textual.reactive import reactive
 from textual import events, work
 
-from scapy.all import sniff, Raw
-from scapy.layers.http import HTTP, HTTPRequest, HTTPResponse
-from collections import defaultdict
+from scapy.all import sniff
+from collections import deque
 import re
 import operator
 import threading
 import asyncio
+import argparse
+import random
+import time
+
+from handoff import SpscRing
+from tcp_reassembly import TcpReassembler
+from http_parser import HttpConnection, HTTP_STARTS
+from fast_dissect import format_address
 
 class FilterDSL:
     """HTTP 流量过滤器 DSL 解析器"""
@@ -110,15 +117,15 @@ class FilterDSL:
         
         try:
             result = self.compiled_filter(session_data)
-            # 将日志输出传递给主应用
+            # 将日志输出传递给主应用 (在抓包线程中调用，经事件环交给界面)
             if hasattr(self, 'app'):
-                self.app.log_message(f"过滤表达式: {self.filter_expr}")
-                self.app.log_message(f"匹配数据: {session_data}")
-                self.app.log_message(f"匹配结果: {result}")
+                self.app.queue_log(f"过滤表达式: {self.filter_expr}")
+                self.app.queue_log(f"匹配数据: {session_data}")
+                self.app.queue_log(f"匹配结果: {result}")
             return result
         except Exception as e:
             if hasattr(self, 'app'):
-                self.app.log_message(f"过滤匹配错误: {str(e)}", "error")
+                self.app.queue_log(f"过滤匹配错误: {str(e)}", "error")
             return False
 
 class FilterPanel(Container):
@@ -159,49 +166,105 @@ class FilterPanel(Container):
         self.app.notify("过滤器已清除", severity="information")
 
 class HttpSession:
-    """HTTP 会话数据模型"""
-    def __init__(self, app):
-        self.sessions = defaultdict(dict)
+    """HTTP 会话数据模型
+
+    会话键由 TCP 连接 (客户端 -> 服务器) 和全局递增的请求序号组成，四元组被复用时
+    也不会覆盖之前的会话。HTTP/1.x 的响应按请求的顺序返回 (流水线也是如此)，
+    每个连接保留一个尚未响应的请求队列，响应总是与队首的请求配对，不需要在会话中查找。
+    最多保留 max_sessions 个会话，超出时淘汰最早的并通知界面移除对应的行。
+    """
+    MAX_SESSIONS = 10000
+
+    def __init__(self, app, max_sessions=MAX_SESSIONS):
+        self.sessions = {}
+        self.max_sessions = max_sessions
         self.filter = FilterDSL()
         self.filter.app = app
         self.app = app
-        
-    def add_request(self, session_key, request_data):
-        self.sessions[session_key]['request'] = request_data
-        match_result = self.filter.match(self.sessions[session_key])
-        print(f"请求过滤结果: {match_result}, 会话: {session_key}")  # 添加调试日志
-        return match_result
-        
-    def add_response(self, session_key, response_data):
-        if session_key in self.sessions:
-            self.sessions[session_key]['response'] = response_data
-            match_result = self.filter.match(self.sessions[session_key])
-            print(f"响应过滤结果: {match_result}, 会话: {session_key}")  # 添加调试日志
-            if match_result:
-                return self.sessions[session_key]
-        return None
+        # 连接 -> 尚未响应的会话键队列
+        self._pending = {}
+        self.requests = 0
+        self.paired = 0
+        self.unmatched = 0  # 没有对应请求的响应 (请求在抓包开始前发出)
+        self.unanswered = 0  # 连接关闭时仍未响应的请求
+        self.evicted = 0
+
+    def add_request(self, connection, name, request_data):
+        """添加连接上的一个请求，返回 (会话键, 是否匹配过滤器)"""
+        queue = self._pending.get(connection)
+        if queue is None:
+            queue = self._pending[connection] = deque()
+        self.requests += 1
+        session_key = f"{name} #{self.requests}"
+        session = self.sessions[session_key] = {'request': request_data}
+        queue.append(session_key)
+        while len(self.sessions) > self.max_sessions:
+            # 字典按插入顺序排列，第一个即最早的会话
+            oldest = next(iter(self.sessions))
+            del self.sessions[oldest]
+            self.evicted += 1
+            self.app.remove_session(oldest)
+        return session_key, self.filter.match(session)
+
+    def add_response(self, connection, response_data):
+        """与连接上最早的未响应请求配对，返回 (会话键, 会话)
+
+        没有对应的请求时会话键为 None，会话不匹配过滤器时会话为 None。
+        """
+        queue = self._pending.get(connection)
+        if not queue:
+            self.unmatched += 1
+            return None, None
+        session_key = queue.popleft()
+        self.paired += 1
+        session = self.sessions.get(session_key)
+        if session is None:
+            # 请求所在的会话已被淘汰
+            return session_key, None
+        session['response'] = response_data
+        return session_key, session if self.filter.match(session) else None
+
+    def close(self, connection):
+        """连接关闭，丢弃未响应的请求队列"""
+        queue = self._pending.pop(connection, None)
+        if queue is not None:
+            self.unanswered += len(queue)
 
 class SessionTable(DataTable):
-    """HTTP 会话列表"""
+    """HTTP 会话列表，行键为会话键"""
+    COLUMNS = (("会话ID", "id"), ("方法", "method"), ("主机", "host"), ("路径", "path"),
+               ("状态码", "status"))
+
     def __init__(self):
         super().__init__()
-        self.add_columns(
-            "会话ID", "方法", "主机", "路径", "状态码"
-        )
-        
-    def add_session(self, session_key, session_data):
+        for label, key in self.COLUMNS:
+            self.add_column(label, key=key)
+
+    def update_session(self, session_key, session_data):
+        """添加或更新会话所在的行，返回是否为新行"""
         request = session_data.get('request', {})
         response = session_data.get('response', {})
-        self.add_row(
+        values = (
             session_key,
             request.get('method', 'N/A'),
             request.get('host', 'N/A'),
             request.get('path', 'N/A'),
             response.get('status', 'N/A'),
-            key=session_key  # 添加key以便后续更新
         )
+        if session_key in self.rows:
+            for (_, column), value in zip(self.COLUMNS[1:], values[1:]):
+                self.update_cell(session_key, column, value)
+            return False
+        self.add_row(*values, key=session_key)
         # 自动滚动到最新的行
         self.scroll_to_row(len(self.rows) - 1)
+        return True
+
+    def remove_sessions(self, session_keys):
+        """移除已被淘汰的会话所在的行"""
+        for session_key in session_keys:
+            if session_key in self.rows:
+                self.remove_row(session_key)
 
     def on_data_table_row_selected(self, event):
         """处理行选择事件"""
@@ -364,10 +427,31 @@ class HttpSnifferApp(App):
         Binding("c", "clear", "清除"),
     ]
     
+    # 界面每隔多久批量处理一次抓包线程产生的事件 (秒)
+    EVENT_INTERVAL = 0.05
+    # 每批最多写入的日志条数，其余合并为一条提示
+    MAX_LOGS_PER_BATCH = 200
+    # 每个报文最多保留的报文体字节数
+    MAX_BODY = 64 * 1024
+    
     def __init__(self):
         super().__init__()
         self.http_session = HttpSession(self)
         self.sniffer_thread = None
+        # 抓包线程 -> 界面的事件环: ('log', 消息, 级别)、('session', 会话键)
+        # 或 ('remove', 会话键)
+        self.events = SpscRing(65536)
+        self.events_published = 0
+        self.events_dropped = 0
+        # 抓包线程累计的数据包数，界面按差值输出汇总日志
+        self.packets_seen = 0
+        self._packets_logged = 0
+        # TCP 段在抓包线程中重组，每个连接的字节流交给 HttpConnection 解析
+        self.reassembler = TcpReassembler(self._on_stream_data, self._on_stream_gap,
+                                          self._on_stream_close)
+        self._parsers = {}  # 连接 -> HttpConnection，不是 HTTP 的连接为 None
+        # 连接 -> 连接的文本形式，在连接仍在重组器中时确定，关闭回调中也能使用
+        self._names = {}
         
     def compose(self) -> ComposeResult:
         """重新组织布局结构"""
@@ -388,6 +472,7 @@ class HttpSnifferApp(App):
     def on_mount(self) -> None:
         """应用启动时的处理"""
         self.log_message("应用启动", "information")
+        self.set_interval(self.EVENT_INTERVAL, self.apply_events)
         self.start_sniffing()
         
     def on_unmount(self) -> None:
@@ -401,114 +486,162 @@ class HttpSnifferApp(App):
         log_panel = self.query_one(LogPanel)
         log_panel.log(message, severity)
 
+    def _publish(self, event):
+        """抓包线程发布一个事件，界面在下一次刷新时批量处理"""
+        self.events_published += 1
+        if not self.events.put(event):
+            self.events_dropped += 1
+
+    def queue_log(self, message: str, severity: str = "information"):
+        """在抓包线程中写日志"""
+        self._publish(('log', message, severity))
+
+    def remove_session(self, session_key):
+        """会话被淘汰 (在抓包线程中调用)，界面刷新时移除对应的行"""
+        self._publish(('remove', session_key))
+
+    def apply_events(self):
+        """界面定时器: 取出本周期的全部事件，在一次刷新中应用"""
+        events = self.events.drain()
+        new_packets = self.packets_seen - self._packets_logged
+        if not events and not new_packets:
+            return
+        self._packets_logged += new_packets
+        
+        logs = []
+        sessions = {}  # 按出现顺序去重
+        removed = []
+        for event in events:
+            if event[0] == 'log':
+                logs.append(event[1:])
+            elif event[0] == 'remove':
+                removed.append(event[1])
+            else:
+                sessions[event[1]] = None
+        
+        with self.batch_update():
+            if new_packets:
+                self.log_message(f"捕获到 {new_packets} 个数据包", "information")
+            skipped = len(logs) - self.MAX_LOGS_PER_BATCH
+            if skipped > 0:
+                self.log_message(f"省略 {skipped} 条日志", "warning")
+                logs = logs[skipped:]
+            for message, severity in logs:
+                self.log_message(message, severity)
+            if self.events_dropped:
+                self.log_message(f"事件环已满，累计丢弃 {self.events_dropped} 个事件", "warning")
+            for session_key in sessions:
+                self.update_session_table(session_key)
+            if removed:
+                self.query_one(SessionTable).remove_sessions(removed)
+
     @work(thread=True)
     def start_sniffing(self):
         """启动抓包线程"""
-        self.log_message("开始抓包...", "information")
+        self.queue_log("开始抓包...", "information")
         
-        def packet_handler(packet):
-            # 添加基础包捕获日志
-            self.call_from_thread(self.log_message, "捕获到数据包", "information")
-            
-            if HTTP not in packet:
-                return
-                
-            try:
-                if HTTPRequest in packet:
-                    self.call_from_thread(self.log_message, "捕获到HTTP请求")
-                    request = self.parse_http_request(packet)
-                    if request:
-                        session_key = f"{request['host']}:{request['path']}"
-                        self.call_from_thread(self.log_message, f"处理请求: {session_key}")
-                        match_result = self.http_session.add_request(session_key, request)
-                        self.call_from_thread(
-                            self.log_message, 
-                            f"请求匹配结果: {match_result} (会话: {session_key})"
-                        )
-                        if match_result:
-                            self.call_from_thread(self.update_session_table, session_key)
-                        
-                elif HTTPResponse in packet:
-                    self.call_from_thread(self.log_message, "捕获到HTTP响应")
-                    response = self.parse_http_response(packet)
-                    if response:
-                        session_key = self.find_session_key(packet)
-                        if session_key:
-                            self.call_from_thread(self.log_message, f"处理响应: {session_key}")
-                            session = self.http_session.add_response(session_key, response)
-                            self.call_from_thread(
-                                self.log_message,
-                                f"响应匹配结果: {bool(session)} (会话: {session_key})"
-                            )
-                            if session:
-                                self.call_from_thread(self.update_session_table, session_key)
-            except Exception as e:
-                self.call_from_thread(
-                    self.log_message, 
-                    f"错误: {str(e)}", 
-                    "error"
-                )
-
         try:
             # 添加具体的抓包参数
-            self.log_message("启动抓包监听...", "information")
-            sniff(prn=packet_handler, store=0, filter="tcp port 80")
+            self.queue_log("启动抓包监听...", "information")
+            sniff(prn=self.handle_packet, store=0, filter="tcp port 80")
         except Exception as e:
-            self.log_message(f"抓包错误: {str(e)}", "error")
+            self.queue_log(f"抓包错误: {str(e)}", "error")
 
-    def parse_http_request(self, packet):
-        """解析HTTP请求"""
-        try:
-            http_layer = packet[HTTPRequest]
-            return {
-                'method': http_layer.Method.decode(),
-                'host': http_layer.Host.decode() if hasattr(http_layer, 'Host') else '',
-                'path': http_layer.Path.decode(),
-                'headers': self.parse_headers(http_layer),
-                'body': bytes(packet[Raw]) if Raw in packet else b''
-            }
-        except Exception as e:
-            print(f"解析HTTP请求失败: {e}")
-            return None
+    def handle_packet(self, packet):
+        """处理单个捕获的数据包 (在抓包线程中调用)
 
-    def parse_http_response(self, packet):
-        """解析HTTP响应包"""
+        数据包经 TCP 重组后由 HTTP 解析器切分为报文，不直接触碰界面，
+        产生的日志和会话更新都放入事件环，由 apply_events 批量应用。
+        """
+        self.packets_seen += 1
         try:
-            http_layer = packet[HTTPResponse]
-            return {
-                'status': str(http_layer.Status_Code),
-                'headers': self.parse_headers(http_layer),
-                'body': bytes(packet[Raw]) if Raw in packet else b''
-            }
+            self.reassembler.add_packet(packet)
         except Exception as e:
-            print(f"解析HTTP响应失败: {e}")
-            return None
-
-    def parse_headers(self, http_layer):
-        """解析HTTP头部"""
-        headers = {}
-        for field in http_layer.fields_desc:
-            if field.name.startswith('Unknown_'):
-                continue
-            value = getattr(http_layer, field.name)
-            if value:
-                try:
-                    headers[field.name] = value.decode()
-                except:
-                    headers[field.name] = str(value)
-        return headers
-
-    def find_session_key(self, packet):
-        """根据IP和端口找到对应的会话"""
-        try:
-            if packet.haslayer('IP'):
-                dst_ip = packet['IP'].dst
-                for session_key, session in self.http_session.sessions.items():
-                    if 'request' in session and session['request'].get('host') in dst_ip:
-                        return session_key
-        except Exception as e:
-            self.log.error(f"查找会话键错误: {str(e)}")
-        return None
+            self.queue_log(f"错误: {str(e)}", "error")
+
+    def _on_stream_data(self, key, direction, data):
+        parser = self._parsers.get(key, False)
+        if parser is False:
+            parser = None
+            if data.startswith(HTTP_STARTS):
+                parser = HttpConnection(
+                    lambda _, message, key=key: self.handle_message(key, message),
+                    keep_body=self.MAX_BODY)
+                self._names[key] = self._connection_name(key)
+            self._parsers[key] = parser
+        if parser is not None:
+            parser.feed(direction, data)
+
+    def _on_stream_gap(self, key, direction, missing):
+        parser = self._parsers.get(key)
+        if parser is not None:
+            self.queue_log(f"TCP 流缺失 {missing} 字节", "warning")
+            parser.gap(direction, missing)
+
+    def _on_stream_close(self, key):
+        parser = self._parsers.pop(key, None)
+        if parser is not None:
+            # 读到连接关闭为止的响应在这里结束，此时重组器已移除该连接
+            parser.close()
+            self.http_session.close(key)
+        self._names.pop(key, None)
+
+    def _connection_name(self, key):
+        """连接的文本形式: 客户端 -> 服务器
+
+        优先使用解析器创建时记录的名称；重组器中已没有该连接时按键的顺序输出。
+        """
+        name = self._names.get(key)
+        if name is not None:
+            return name
+        version, address, port, peer, peer_port = key
+        connection = self.reassembler.connections.get(key)
+        if connection is not None and connection.client != (address, port):
+            address, port, peer, peer_port = peer, peer_port, address, port
+        return f"{format_address(address, version)}:{port} -> {format_address(peer, version)}:{peer_port}"
+
+    def handle_message(self, key, message):
+        """处理一个完整的 HTTP 报文，key 为重组器的连接键"""
+        if message.is_request:
+            self.queue_log("捕获到HTTP请求")
+            request = self.parse_http_request(message)
+            session_key, match_result = self.http_session.add_request(
+                key, self._connection_name(key), request)
+            self.queue_log(f"请求匹配结果: {match_result} (会话: {session_key})")
+            if match_result:
+                self._publish(('session', session_key))
+        elif message.status >= 200:  # 1xx 为中间响应
+            self.queue_log("捕获到HTTP响应")
+            response = self.parse_http_response(message)
+            session_key, session = self.http_session.add_response(key, response)
+            if session_key is None:
+                self.queue_log(f"响应没有对应的请求: {self._connection_name(key)}", "warning")
+                return
+            self.queue_log(f"响应匹配结果: {bool(session)} (会话: {session_key})")
+            if session:
+                self._publish(('session', session_key))
+
+    def parse_http_request(self, message):
+        """HTTP 请求报文转换为会话中的请求信息"""
+        return {
+            'method': message.method,
+            'host': message.header('host'),
+            'path': message.target,
+            'headers': self.parse_headers(message),
+            'body': bytes(message.body or b'')
+        }
+
+    def parse_http_response(self, message):
+        """HTTP 响应报文转换为会话中的响应信息"""
+        return {
+            'status': str(message.status),
+            'headers': self.parse_headers(message),
+            'body': bytes(message.body or b'')
+        }
+
+    def parse_headers(self, message):
+        """HTTP头部，名称统一为小写，与过滤表达式中的字段名一致"""
+        return {name.lower(): value for name, value in message.headers.items()}
 
     def update_session_table(self, session_key):
         """更新会话表格"""
@@ -516,32 +649,104 @@ class HttpSnifferApp(App):
             session_data = self.http_session.sessions.get(session_key)
             if session_data:
                 table = self.query_one(SessionTable)
-                existing_row = None
-                
-                # 查找现有行
-                for row_key, row in enumerate(table.rows):
-                    if row[0] == session_key:
-                        existing_row = row_key
-                        break
-                
-                # 如果行存在则更新，否则添加新行
-                if existing_row is not None:
-                    request = session_data.get('request', {})
-                    response = session_data.get('response', {})
-                    table.update_cell(existing_row, "方法", request.get('method', 'N/A'))
-                    table.update_cell(existing_row, "主机", request.get('host', 'N/A'))
-                    table.update_cell(existing_row, "路径", request.get('path', 'N/A'))
-                    table.update_cell(existing_row, "状态码", response.get('status', 'N/A'))
-                    self.log_message(f"更新会话: {session_key}")
-                else:
-                    table.add_session(session_key, session_data)
+                if table.update_session(session_key, session_data):
                     self.log_message(f"添加新会话: {session_key}")
+                else:
+                    self.log_message(f"更新会话: {session_key}")
                 
                 detail = self.query_one(SessionDetail)
                 detail.session_data = session_data
         except Exception as e:
             self.log_message(f"更新会话表格错误: {str(e)}", "error")
 
+def benchmark_pairing(connections=5000, requests=8, seed=1):
+    """请求/响应配对测试
+
+    合成大量并发的长连接，一半流水线发送全部请求后再收响应，一半逐个请求-响应，
+    各连接的 TCP 段随机交错后经重组、HTTP 解析和会话配对的完整路径处理。
+    响应头 X-Request 带有对应请求的路径，据此校验配对结果，并统计每次配对的耗时。
+    """
+    rng = random.Random(seed)
+    app = HttpSnifferApp()
+    session = app.http_session
+    add_response = session.add_response
+    latencies = []
+
+    def timed_add_response(connection, response):
+        start = time.perf_counter_ns()
+        result = add_response(connection, response)
+        latencies.append(time.perf_counter_ns() - start)
+        return result
+
+    session.add_response = timed_add_response
+
+    streams = []  # 每个连接待发送的段 [(是否为服务器, 数据)]
+    for index in range(connections):
+        exchanges = []
+        for number in range(requests):
+            path = f"/c{index}/r{number}"
+            body = b'x' * rng.randrange(0, 3000)
+            request = (f"GET {path} HTTP/1.1\r\nHost: example.com\r\n\r\n").encode()
+            response = (f"HTTP/1.1 200 OK\r\nX-Request: {path}\r\n"
+                        f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+            exchanges.append((request, response))
+        if index % 2:
+            order = [(False, request) for request, _ in exchanges] + \
+                    [(True, response) for _, response in exchanges]
+        else:
+            order = [item for request, response in exchanges
+                     for item in ((False, request), (True, response))]
+        segments = []
+        for from_server, data in order:
+            for offset in range(0, len(data), 1460):
+                segments.append((from_server, data[offset:offset + 1460]))
+        streams.append(segments)
+
+    client_base, server_base = 0x0A000000, 0x0A800000
+    sequences = [[1000, 5000] for _ in range(connections)]
+    positions = [0] * connections
+    active = list(range(connections))
+    total_segments = sum(len(segments) for segments in streams)
+    start = time.perf_counter()
+    while active:
+        slot = rng.randrange(len(active))
+        index = active[slot]
+        from_server, payload = streams[index][positions[index]]
+        client, sport = client_base + index, 10000 + index % 50000
+        sequence = sequences[index]
+        if from_server:
+            app.reassembler.add_segment(4, server_base, 80, client, sport, sequence[1], 0x18, payload)
+            sequence[1] += len(payload)
+        else:
+            app.reassembler.add_segment(4, client, sport, server_base, 80, sequence[0], 0x18, payload)
+            sequence[0] += len(payload)
+        positions[index] += 1
+        if positions[index] == len(streams[index]):
+            active[slot] = active[-1]
+            active.pop()
+    elapsed = time.perf_counter() - start
+
+    wrong = sum(1 for data in session.sessions.values()
+                if data.get('response', {}).get('headers', {}).get('x-request') != data['request']['path'])
+    latencies.sort()
+    count = len(latencies)
+    print(f"{connections} 个连接 x {requests} 个请求: {total_segments} 段, {elapsed:.2f}s, "
+          f"{total_segments / elapsed:,.0f} 段/秒")
+    print(f"配对 {session.paired}/{connections * requests}, 错误 {wrong}, 无请求的响应 {session.unmatched}, "
+          f"保留 {len(session.sessions)} 个会话, 淘汰 {session.evicted}")
+    if count:
+        print(f"配对耗时: 平均 {sum(latencies) / count / 1000:.2f}µs, "
+              f"p50 {latencies[count // 2] / 1000:.2f}µs, p99 {latencies[count * 99 // 100] / 1000:.2f}µs, "
+              f"最大 {latencies[-1] / 1000:.2f}µs")
+    return wrong == 0 and session.paired == connections * requests
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HTTP 抓包分析工具')
+    parser.add_argument('--benchmark', action='store_true', help='运行请求/响应配对测试后退出')
+    parser.add_argument('--connections', type=int, default=5000, help='配对测试的并发连接数')
+    args = parser.parse_args()
+    if args.benchmark:
+        raise SystemExit(0 if benchmark_pairing(args.connections) else 1)
     app = HttpSnifferApp()
     app.run() 
\ No newline at end of file
@@ -0,0 +1,349 @@
+"""textual_wireshark.Packet 基准测试
+
+与修改前的实现 (LegacyPacket，构造时立即解析并把字段存进实例字典) 对比:
+
+- 每个数据包的内存占用 (tracemalloc，不含帧数据本身)
+- 构造耗时 (抓包线程的开销)
+- 构造并渲染列表行的耗时 (界面线程的开销)
+- 构造并执行显示过滤的耗时
+- 过滤条件变化时重新过滤整个历史的耗时: 逐个调用 packet_matches_filter 与
+  PacketColumns 的 NumPy 掩码对比，并核对两者结果一致
+
+LegacyPacket 从 IP 头开始解析，输入去掉以太网头的帧；Packet 输入完整的以太网帧。
+与 scapy 在 VLAN/IPv6 混合语料上的解析对比见 fast_dissect.py。
+
+用法:
+    python packet_benchmark.py [--count 20000] [--history 200000]
+"""
+import argparse
+import gc
+import logging
+import re
+import socket
+import struct
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+sys.path.insert(0, __import__('os').path.dirname(__file__))
+
+from traffic_replay import SyntheticTraffic, parse_mix
+from textual_wireshark import Packet, PacketColumns, packet_matches_filter
+
+logger = logging.getLogger(__name__)
+
+ETH_HLEN = 14
+
+
+class LegacyPacket:
+    """修改前的 textual_wireshark.Packet (构造时立即完整解析)，仅用于基准对比"""
+    def __init__(self, data: bytes, ts_ns: int):
+        self.data = data
+        self.ts_ns = ts_ns  # 内核接收时间戳 (纳秒)
+        self.src_ip = ""
+        self.dst_ip = ""
+        self.protocol = ""
+        self.src_port = 0
+        self.dst_port = 0
+        self.length = len(data)
+        self.info = ""
+        self.http_info = {}  # 存储HTTP相关信息
+        self.parse()
+        
+    @property
+    def timestamp(self) -> float:
+        """以秒为单位的时间戳，仅用于显示"""
+        return self.ts_ns / 1e9
+
+    def parse(self):
+        """解析数据包"""
+        try:
+            # 直接解析 IP 头
+            ip_header = self.data[:20]
+            iph = struct.unpack('!BBHHHBBH4s4s', ip_header)
+            
+            version_ihl = iph[0]
+            self.protocol = iph[6]
+            self.src_ip = socket.inet_ntoa(iph[8])
+            self.dst_ip = socket.inet_ntoa(iph[9])
+            
+            # 获取 IP 头长度
+            ihl = version_ihl & 0xF
+            iph_length = ihl * 4
+            
+            # TCP
+            if self.protocol == 6:
+                self.protocol = "TCP"
+                tcp_header = self.data[iph_length:iph_length+20]
+                tcph = struct.unpack('!HHLLBBHHH', tcp_header)
+                self.src_port = tcph[0]
+                self.dst_port = tcph[1]
+                
+                # 计算TCP数据偏移
+                tcp_offset = (tcph[4] >> 4) * 4
+                payload_offset = iph_length + tcp_offset
+                payload = self.data[payload_offset:]
+                
+                # 检查是否是HTTP流量
+                if self.src_port == 80 or self.dst_port == 80 or \
+                   self.src_port == 8080 or self.dst_port == 8080:
+                    self._parse_http(payload)
+                else:
+                    self.info = f"Seq={tcph[2]} Ack={tcph[3]}"
+                
+            # UDP
+            elif self.protocol == 17:
+                self.protocol = "UDP"
+                udp_header = self.data[iph_length:iph_length+8]
+                udph = struct.unpack('!HHHH', udp_header)
+                self.src_port = udph[0]
+                self.dst_port = udph[1]
+                self.info = f"Len={udph[2]}"
+                
+            # ICMP
+            elif self.protocol == 1:
+                self.protocol = "ICMP"
+                icmp_header = self.data[iph_length:iph_length+4]
+                icmph = struct.unpack('!BBH', icmp_header)
+                self.info = f"Type={icmph[0]} Code={icmph[1]}"
+                
+        except Exception as e:
+            logger.error(f"数据包解析错误: {e}")
+
+    def retain(self):
+        """将数据从共享缓冲区拷贝为独立的 bytes，保留数据包前调用"""
+        if not isinstance(self.data, bytes):
+            self.data = bytes(self.data)
+
+    def _parse_http(self, payload: bytes):
+        """解析HTTP协议"""
+        try:
+            # 尝试解码HTTP内容
+            http_data = bytes(payload).decode('utf-8', errors='ignore')
+            
+            # 检查是否为HTTP请求或响应
+            if http_data.startswith(('GET ', 'POST ', 'PUT ', 'DELETE ', 'HEAD ', 'OPTIONS ')):
+                # HTTP请求
+                self.protocol = "HTTP"
+                request_line = http_data.split('\r\n')[0]
+                method, path, version = request_line.split(' ')
+                self.http_info = {
+                    'type': 'Request',
+                    'method': method,
+                    'path': path,
+                    'version': version
+                }
+                self.info = f"{method} {path}"
+                
+            elif http_data.startswith('HTTP/'):
+                # HTTP响应
+                self.protocol = "HTTP"
+                status_line = http_data.split('\r\n')[0]
+                version, status_code, *status_text = status_line.split(' ')
+                self.http_info = {
+                    'type': 'Response',
+                    'version': version,
+                    'status_code': status_code,
+                    'status_text': ' '.join(status_text)
+                }
+                self.info = f"{status_code} {' '.join(status_text)}"
+                
+                # 提取Content-Type (如果存在)
+                content_type_match = re.search(r'Content-Type: (.+?)\r\n', http_data)
+                if content_type_match:
+                    self.http_info['content_type'] = content_type_match.group(1)
+                
+                # 提取Content-Length (如果存在)
+                content_length_match = re.search(r'Content-Length: (\d+)\r\n', http_data)
+                if content_length_match:
+                    self.http_info['content_length'] = content_length_match.group(1)
+                    
+        except Exception as e:
+            logger.debug(f"HTTP解析错误: {e}")
+
+    def __str__(self) -> str:
+        if self.protocol in ("TCP", "UDP"):
+            return (f"{datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S.%f')} "
+                   f"{self.src_ip}:{self.src_port} -> {self.dst_ip}:{self.dst_port} "
+                   f"[{self.protocol}] {self.length}字节 {self.info}")
+        else:
+            return (f"{datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S.%f')} "
+                   f"{self.src_ip} -> {self.dst_ip} "
+                   f"[{self.protocol}] {self.length}字节 {self.info}")
+
+    def get_details(self) -> str:
+        """获取详细信息"""
+        details = [
+            "=== 数据包详情 ===",
+            f"时间: {datetime.fromtimestamp(self.timestamp)}",
+            f"长度: {self.length} 字节",
+            "",
+            "=== IP层 ===",
+            f"源IP: {self.src_ip}",
+            f"目标IP: {self.dst_ip}",
+            f"协议: {self.protocol}",
+        ]
+        
+        if self.protocol in ("TCP", "UDP"):
+            details.extend([
+                "",
+                f"=== {self.protocol}层 ===",
+                f"源端口: {self.src_port}",
+                f"目标端口: {self.dst_port}",
+                f"信息: {self.info}"
+            ])
+            
+        # 添加HTTP信息
+        if self.protocol == "HTTP" and self.http_info:
+            details.extend([
+                "",
+                "=== HTTP层 ===",
+                f"类型: {self.http_info.get('type', 'Unknown')}"
+            ])
+            
+            if self.http_info.get('type') == 'Request':
+                details.extend([
+                    f"方法: {self.http_info.get('method', '')}",
+                    f"路径: {self.http_info.get('path', '')}",
+                    f"版本: {self.http_info.get('version', '')}"
+                ])
+            else:
+                details.extend([
+                    f"状态码: {self.http_info.get('status_code', '')}",
+                    f"状态信息: {self.http_info.get('status_text', '')}",
+                    f"内容类型: {self.http_info.get('content_type', 'N/A')}",
+                    f"内容长度: {self.http_info.get('content_length', 'N/A')}"
+                ])
+            
+        # 添加十六进制显示
+        details.extend([
+            "",
+            "=== 原始数据(十六进制) ===",
+            self._hex_dump(self.data)
+        ])
+            
+        return "\n".join(details)
+        
+    def _hex_dump(self, data: bytes, bytes_per_line: int = 16) -> str:
+        """生成十六进制显示"""
+        hex_lines = []
+        for i in range(0, len(data), bytes_per_line):
+            chunk = data[i:i+bytes_per_line]
+            # 十六进制部分
+            hex_part = " ".join(f"{b:02x}" for b in chunk)
+            # ASCII部分
+            ascii_part = "".join(chr(b) if 32 <= b <= 126 else "." for b in chunk)
+            # 补齐空格
+            hex_part = f"{hex_part:<{bytes_per_line*3}}"
+            # 组合行
+            hex_lines.append(f"{i:04x}  {hex_part}  |{ascii_part}|")
+        return "\n".join(hex_lines)
+
+
+def build_corpus(count: int) -> List[bytes]:
+    """混合协议的以太网帧语料"""
+    traffic = SyntheticTraffic(parse_mix('tcp=60,udp=30,icmp=10'), http_share=0.3,
+                               pool_size=count)
+    return traffic.frames
+
+
+def measure_memory(cls, corpus: List[bytes], render: bool) -> float:
+    """保留全部数据包时每个数据包占用的字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    packets = [cls(frame, 0) for frame in corpus]
+    if render:
+        for packet in packets:
+            str(packet)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del packets
+    return total / len(corpus)
+
+
+def measure_ns(work: Callable[[bytes], object], corpus: List[bytes]) -> float:
+    """每个数据包的耗时 (纳秒)"""
+    start = time.perf_counter_ns()
+    for frame in corpus:
+        work(frame)
+    return (time.perf_counter_ns() - start) / len(corpus)
+
+
+def run(count: int, rounds: int = 5) -> Dict[str, Dict[str, float]]:
+    """两种实现在每一轮中交替测量，取各自的最好成绩，减少机器负载波动造成的偏差"""
+    frames = build_corpus(count)
+    implementations = (('LegacyPacket', LegacyPacket, [frame[ETH_HLEN:] for frame in frames]),
+                       ('Packet', Packet, frames))
+    results = {}
+    for name, cls, corpus in implementations:
+        results[name] = {
+            'mem': measure_memory(cls, corpus, render=False),
+            'mem_rendered': measure_memory(cls, corpus, render=True),
+            'construct': float('inf'), 'render': float('inf'), 'filter': float('inf'),
+        }
+    for _ in range(rounds):
+        for name, cls, corpus in implementations:
+            timings = results[name]
+            for key, work in (
+                    ('construct', lambda frame: cls(frame, 0)),
+                    ('render', lambda frame: str(cls(frame, 0))),
+                    ('filter', lambda frame: packet_matches_filter(cls(frame, 0), 'tcp/port=443'))):
+                timings[key] = min(timings[key], measure_ns(work, corpus))
+    return results
+
+
+REFILTER_CONDITIONS = ('tcp', 'udp/port=53', 'http', 'tcp/port=443', 'port=')
+
+
+def measure_refilter(frames: List[bytes], history: int):
+    """重新过滤 history 个已渲染数据包的耗时 (毫秒)，返回 (条件, 逐个, 掩码, 匹配数) 列表"""
+    packets = [Packet(frames[i % len(frames)], i) for i in range(history)]
+    for packet in packets:
+        # 界面中的数据包在显示时已经解析过
+        packet.protocol
+    columns = PacketColumns()
+    start = time.perf_counter()
+    columns.extend(packets)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    results = []
+    for condition in REFILTER_CONDITIONS + (f"ip={packets[0].src_ip}",):
+        start = time.perf_counter()
+        walked = [i for i, packet in enumerate(packets) if packet_matches_filter(packet, condition)]
+        walk_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        masked = columns.matches(condition)
+        mask_ms = (time.perf_counter() - start) * 1000
+        if masked.tolist() != walked:
+            raise AssertionError(f"掩码结果与逐个过滤不一致: {condition!r}")
+        results.append((condition, walk_ms, mask_ms, len(walked)))
+    return build_ms, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Packet 基准测试')
+    parser.add_argument('--count', type=int, default=20000, help='语料中的数据包数')
+    parser.add_argument('--history', type=int, default=200000, help='重新过滤测试的历史数据包数')
+    args = parser.parse_args()
+
+    # 基准测试期间不记录解析日志
+    logging.getLogger('textual_wireshark').disabled = True
+    results = run(args.count)
+    print(f"{'实现':<14}{'内存B/包':>10}{'渲染后B/包':>12}{'构造ns':>10}{'渲染ns':>10}{'过滤ns':>10}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['mem']:>10.0f}{r['mem_rendered']:>12.0f}{r['construct']:>10.0f}"
+              f"{r['render']:>10.0f}{r['filter']:>10.0f}")
+
+    build_ms, refilter = measure_refilter(build_corpus(args.count), args.history)
+    print(f"\n重新过滤 {args.history} 个数据包 (建立列式副本 {build_ms:.0f} ms，界面中按批增量完成)")
+    print(f"{'条件':<16}{'逐个ms':>10}{'掩码ms':>10}{'匹配数':>10}")
+    for condition, walk_ms, mask_ms, matched in refilter:
+        print(f"{condition:<16}{walk_ms:>10.1f}{mask_ms:>10.2f}{matched:>10}")
+
+
+if __name__ == "__main__":
+    main()
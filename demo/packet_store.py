@@ -0,0 +1,645 @@
+"""列式数据包存储
+
+界面的数据包历史按列保存在预先分配的 NumPy 数组中 (时间、地址、端口、协议、
+长度、TCP 标志、链路类型、标志)，原始帧字节首尾相接地写入一块环形字节区 (arena)，每行只记录
+其位置和长度。追加是 O(1) 的，每个数据包的内存开销固定，总内存在创建时确定。
+
+每个数据包有一个单调递增的序号，行号为序号对容量取模。超过容量或字节区
+被新数据覆盖时，最旧的数据包被淘汰；序号不会复用，界面可以用它作为稳定的标识。
+
+可选的二级索引 (倒排表) 按源地址、目标地址、端口和流把键映射到序号数组，
+随追加增量维护，等值查询不必扫描整个历史；每个索引单独开启。
+
+直接运行本文件会先自检记录的往返，再与原来的字典列表 (insert(0, ...) 加切片裁剪) 对比追加耗时和内存，
+并对比索引查询与全量扫描。
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from fast_dissect import LINKTYPE_ETHERNET, format_address, parse_address
+
+# 标志位
+FLAG_PORTS = 0x01  # 有传输层端口
+FLAG_MATCHED = 0x02  # 匹配当前过滤器
+
+PROTOCOL_NUMBERS = {'TCP': 6, 'UDP': 17}
+PROTOCOL_NAMES = {6: 'TCP', 17: 'UDP'}
+
+_LOW_64 = 0xFFFFFFFFFFFFFFFF
+
+INDEX_FIELDS = ('src', 'dst', 'port', 'flow')
+
+
+def _raw_bytes(packet_info: Dict[str, Any]) -> bytes:
+    """记录中的原始帧: 原生引擎带 raw，scapy 引擎从 raw_packet 取"""
+    raw = packet_info.get('raw')
+    if raw is None:
+        packet = packet_info.get('raw_packet')
+        raw = (packet.original or bytes(packet)) if packet is not None else b''
+    return raw
+
+
+def address_key(version: int, address: int) -> int:
+    """地址索引的键，带上版本以区分 IPv4 地址和同值的 IPv6 地址"""
+    return version << 128 | address
+
+
+def port_key(proto: int, port: int) -> int:
+    return proto << 16 | port
+
+
+def flow_key(proto: int, src: int, sport: int, dst: int, dport: int) -> Tuple[int, ...]:
+    """双向的流标识: 两个端点按大小排序，请求和响应属于同一个流"""
+    if (src, sport) <= (dst, dport):
+        return proto, src, sport, dst, dport
+    return proto, dst, dport, src, sport
+
+
+class PostingIndex:
+    """键到序号列表的倒排表
+
+    序号按追加顺序递增，每个列表天然有序；被淘汰的序号在查询时跳过，
+    压缩时从列表头部删除。列表用 array('q') 保存，每项 8 字节。
+    """
+    def __init__(self):
+        self.postings: Dict[Any, array] = {}
+        self.entries = 0
+
+    def add(self, key, seq: int):
+        postings = self.postings.get(key)
+        if postings is None:
+            postings = self.postings[key] = array('q')
+        postings.append(seq)
+        self.entries += 1
+
+    def add_many(self, keys: Iterable, seqs: Iterable[int]):
+        postings_map = self.postings
+        added = 0
+        for key, seq in zip(keys, seqs):
+            postings = postings_map.get(key)
+            if postings is None:
+                postings = postings_map[key] = array('q')
+            postings.append(seq)
+            added += 1
+        self.entries += added
+
+    def lookup(self, key, first: int) -> np.ndarray:
+        """键对应的不小于 first 的序号"""
+        postings = self.postings.get(key)
+        if postings is None:
+            return np.empty(0, dtype=np.int64)
+        start = bisect_left(postings, first)
+        return np.array(postings[start:], dtype=np.int64)
+
+    def compact(self, first: int):
+        """删除小于 first 的序号以及已经为空的键"""
+        entries = 0
+        for key, postings in list(self.postings.items()):
+            if postings[-1] < first:
+                del self.postings[key]
+                continue
+            if postings[0] < first:
+                del postings[:bisect_left(postings, first)]
+            entries += len(postings)
+        self.entries = entries
+
+    def memory_bytes(self) -> int:
+        """字典、键和序号列表占用的字节数"""
+        return (sys.getsizeof(self.postings)
+                + sum(sys.getsizeof(key) + sys.getsizeof(postings)
+                      for key, postings in self.postings.items()))
+
+
+class PacketStore:
+    """固定容量的列式数据包存储
+
+    indexes 为要维护的二级索引 (INDEX_FIELDS 的子集)，默认不开启。
+    只在界面线程使用，不需要加锁。
+    """
+    def __init__(self, capacity: int = 100000, arena_bytes: int = 64 * 1024 * 1024,
+                 indexes: Iterable[str] = ()):
+        self.capacity = capacity
+        self.arena_bytes = arena_bytes
+        self.time_ns = np.zeros(capacity, dtype=np.int64)
+        self.ip_version = np.zeros(capacity, dtype=np.uint8)
+        self.src_hi = np.zeros(capacity, dtype=np.uint64)
+        self.src_lo = np.zeros(capacity, dtype=np.uint64)
+        self.dst_hi = np.zeros(capacity, dtype=np.uint64)
+        self.dst_lo = np.zeros(capacity, dtype=np.uint64)
+        self.sport = np.zeros(capacity, dtype=np.uint16)
+        self.dport = np.zeros(capacity, dtype=np.uint16)
+        self.proto = np.zeros(capacity, dtype=np.uint8)
+        self.length = np.zeros(capacity, dtype=np.uint32)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.tcp_flags = np.zeros(capacity, dtype=np.uint8)
+        # 原始字节按链路类型解释，详情视图据此选择 scapy 的第一层
+        self.linktype = np.zeros(capacity, dtype=np.uint16)
+        # 原始帧在字节区中的绝对位置 (单调递增) 和长度
+        self.raw_pos = np.zeros(capacity, dtype=np.int64)
+        self.raw_len = np.zeros(capacity, dtype=np.uint32)
+        self.arena = np.zeros(arena_bytes, dtype=np.uint8)
+        self._arena_view = memoryview(self.arena)
+        self._write_pos = 0
+        self.first = 0  # 最旧的有效序号
+        self.next_seq = 0  # 下一个追加的序号
+        # 文本地址到整数的缓存，界面刷新时同一批地址会反复出现
+        self._address_cache: Dict[str, Any] = {}
+        # 统计信息
+        self.evicted = 0  # 因容量或字节区被覆盖而淘汰的数据包数
+        unknown = set(indexes) - set(INDEX_FIELDS)
+        if unknown:
+            raise ValueError(f"不支持的索引: {', '.join(sorted(unknown))}")
+        self.indexes: Dict[str, PostingIndex] = {field: PostingIndex() for field in indexes}
+        self._compacted_at = 0  # 上次压缩索引时的淘汰数
+
+    def __len__(self) -> int:
+        return self.next_seq - self.first
+
+    def __contains__(self, seq: int) -> bool:
+        return self.first <= seq < self.next_seq
+
+    def memory_bytes(self) -> int:
+        """列和字节区占用的总字节数 (固定)"""
+        columns = (self.time_ns, self.ip_version, self.src_hi, self.src_lo, self.dst_hi,
+                   self.dst_lo, self.sport, self.dport, self.proto, self.length, self.flags,
+                   self.tcp_flags, self.linktype, self.raw_pos, self.raw_len)
+        return sum(column.nbytes for column in columns) + self.arena.nbytes
+
+    def _address(self, text: str):
+        cache = self._address_cache
+        key = cache.get(text)
+        if key is None:
+            if len(cache) >= 65536:
+                cache.clear()
+            key = cache[text] = parse_address(text)
+        return key
+
+    def _store_raw(self, raw: bytes) -> int:
+        """把原始帧写入字节区，返回其绝对位置；放不下时写入空字节"""
+        size = len(raw)
+        if size > self.arena_bytes:
+            raw = b''
+            size = 0
+        position = self._write_pos
+        start = position % self.arena_bytes
+        if start + size > self.arena_bytes:
+            # 不跨越字节区末尾，从头开始写
+            position += self.arena_bytes - start
+            start = 0
+        self._arena_view[start:start + size] = raw
+        self._write_pos = position + size
+        return position
+
+    def append(self, time_ns: int, src: str, dst: str, length: int, raw: bytes,
+               protocol: Optional[str] = None, sport: int = 0, dport: int = 0,
+               flags: int = 0, tcp_flags: int = 0, linktype: int = LINKTYPE_ETHERNET) -> int:
+        """追加一个数据包，返回其序号"""
+        seq = self.next_seq
+        row = seq % self.capacity
+        # 先写字节区，再淘汰被覆盖的行，最后写入本行
+        position = self._store_raw(raw)
+        self.next_seq = seq + 1
+        if self.next_seq - self.first > self.capacity:
+            self.first += 1
+            self.evicted += 1
+        self._evict_overwritten(seq)
+        version, source = self._address(src)
+        _, destination = self._address(dst)
+        self.time_ns[row] = time_ns
+        self.ip_version[row] = version
+        self.src_hi[row] = source >> 64
+        self.src_lo[row] = source & _LOW_64
+        self.dst_hi[row] = destination >> 64
+        self.dst_lo[row] = destination & _LOW_64
+        proto = PROTOCOL_NUMBERS.get(protocol, 0)
+        self.proto[row] = proto
+        self.sport[row] = sport
+        self.dport[row] = dport
+        self.length[row] = length
+        if protocol in PROTOCOL_NUMBERS:
+            flags |= FLAG_PORTS
+        self.flags[row] = flags
+        self.tcp_flags[row] = tcp_flags
+        self.linktype[row] = linktype
+        self.raw_pos[row] = position
+        self.raw_len[row] = len(raw) if len(raw) <= self.arena_bytes else 0
+        if self.indexes:
+            self._index(seq, version, source, destination, proto, sport, dport)
+            self._maybe_compact()
+        return seq
+
+    def _index(self, seq: int, version: int, source: int, destination: int,
+               proto: int, sport: int, dport: int):
+        """把一个数据包加入已开启的索引"""
+        indexes = self.indexes
+        if not version:
+            return
+        index = indexes.get('src')
+        if index is not None:
+            index.add(address_key(version, source), seq)
+        index = indexes.get('dst')
+        if index is not None:
+            index.add(address_key(version, destination), seq)
+        if not proto:
+            return
+        index = indexes.get('port')
+        if index is not None:
+            index.add(port_key(proto, sport), seq)
+            if dport != sport:
+                index.add(port_key(proto, dport), seq)
+        index = indexes.get('flow')
+        if index is not None:
+            index.add(flow_key(proto, address_key(version, source), sport,
+                               address_key(version, destination), dport), seq)
+
+    def _maybe_compact(self):
+        """每淘汰半个容量的数据包压缩一次索引，均摊到每次追加是 O(1)"""
+        if self.evicted - self._compacted_at < self.capacity // 2:
+            return
+        for index in self.indexes.values():
+            index.compact(self.first)
+        self._compacted_at = self.evicted
+
+    def _evict_overwritten(self, seq: int):
+        """淘汰原始字节已被新写入覆盖的最旧数据包 (不含刚追加的 seq)"""
+        floor = self._write_pos - self.arena_bytes
+        while self.first < seq and self.raw_pos[self.first % self.capacity] < floor:
+            self.first += 1
+            self.evicted += 1
+
+    def append_info(self, packet_info: Dict[str, Any], flags: int = 0) -> int:
+        """追加抓包线程产生的数据包记录"""
+        raw = _raw_bytes(packet_info)
+        return self.append(packet_info['time_ns'], packet_info.get('src', ''),
+                           packet_info.get('dst', ''), packet_info.get('length', len(raw)), raw,
+                           packet_info.get('protocol'), packet_info.get('sport', 0),
+                           packet_info.get('dport', 0), flags, packet_info.get('tcp_flags', 0),
+                           packet_info.get('linktype', LINKTYPE_ETHERNET))
+
+    def extend_info(self, records: List[Dict[str, Any]], flags: int = 0) -> List[int]:
+        """批量追加一次刷新取出的数据包记录，按列整体写入，返回各记录的序号"""
+        seqs: List[int] = []
+        for start in range(0, len(records), self.capacity):
+            seqs.extend(self._extend_chunk(records[start:start + self.capacity], flags))
+        return seqs
+
+    def _extend_chunk(self, records: List[Dict[str, Any]], flags: int) -> range:
+        count = len(records)
+        if not count:
+            return range(0)
+        address = self._address
+        store_raw = self._store_raw
+        time_ns, versions, src_hi, src_lo, dst_hi, dst_lo = [], [], [], [], [], []
+        sources, destinations = [], []
+        protos, sports, dports, lengths, row_flags, positions, raw_lens = [], [], [], [], [], [], []
+        tcp_flags, linktypes = [], []
+        for packet_info in records:
+            raw = _raw_bytes(packet_info)
+            if len(raw) > self.arena_bytes:
+                raw = b''
+            positions.append(store_raw(raw))
+            raw_lens.append(len(raw))
+            version, source = address(packet_info.get('src', ''))
+            destination = address(packet_info.get('dst', ''))[1]
+            time_ns.append(packet_info['time_ns'])
+            versions.append(version)
+            sources.append(source)
+            destinations.append(destination)
+            src_hi.append(source >> 64)
+            src_lo.append(source & _LOW_64)
+            dst_hi.append(destination >> 64)
+            dst_lo.append(destination & _LOW_64)
+            proto = PROTOCOL_NUMBERS.get(packet_info.get('protocol'), 0)
+            protos.append(proto)
+            sports.append(packet_info.get('sport', 0))
+            dports.append(packet_info.get('dport', 0))
+            lengths.append(packet_info.get('length', len(raw)))
+            row_flags.append(flags | FLAG_PORTS if proto else flags)
+            tcp_flags.append(packet_info.get('tcp_flags', 0))
+            linktypes.append(packet_info.get('linktype', LINKTYPE_ETHERNET))
+
+        first_seq = self.next_seq
+        rows = np.arange(first_seq, first_seq + count, dtype=np.int64) % self.capacity
+        self.time_ns[rows] = time_ns
+        self.ip_version[rows] = versions
+        self.src_hi[rows] = src_hi
+        self.src_lo[rows] = src_lo
+        self.dst_hi[rows] = dst_hi
+        self.dst_lo[rows] = dst_lo
+        self.proto[rows] = protos
+        self.sport[rows] = sports
+        self.dport[rows] = dports
+        self.length[rows] = lengths
+        self.flags[rows] = row_flags
+        self.tcp_flags[rows] = tcp_flags
+        self.linktype[rows] = linktypes
+        self.raw_pos[rows] = positions
+        self.raw_len[rows] = raw_lens
+
+        self.next_seq = first_seq + count
+        overflow = self.next_seq - self.first - self.capacity
+        if overflow > 0:
+            self.first += overflow
+            self.evicted += overflow
+        self._evict_overwritten(self.next_seq - 1)
+        if self.indexes:
+            self._index_chunk(first_seq, versions, sources, destinations, protos, sports, dports)
+            self._maybe_compact()
+        return range(first_seq, self.next_seq)
+
+    def _index_chunk(self, first_seq: int, versions: List[int], sources: List[int],
+                     destinations: List[int], protos: List[int], sports: List[int],
+                     dports: List[int]):
+        """按索引分别批量加入一批数据包，与逐个调用 _index 的结果相同"""
+        ip_rows = [offset for offset, version in enumerate(versions) if version]
+        seqs = [first_seq + offset for offset in ip_rows]
+        for field, addresses in (('src', sources), ('dst', destinations)):
+            index = self.indexes.get(field)
+            if index is not None:
+                index.add_many([versions[offset] << 128 | addresses[offset] for offset in ip_rows],
+                               seqs)
+        l4_rows = [offset for offset in ip_rows if protos[offset]]
+        l4_seqs = [first_seq + offset for offset in l4_rows]
+        index = self.indexes.get('port')
+        if index is not None:
+            # 与 _index 相同，按序号顺序先源端口后目标端口，端口相同时只记录一次
+            keys, port_seqs = [], []
+            for offset, seq in zip(l4_rows, l4_seqs):
+                proto = protos[offset] << 16
+                keys.append(proto | sports[offset])
+                port_seqs.append(seq)
+                if dports[offset] != sports[offset]:
+                    keys.append(proto | dports[offset])
+                    port_seqs.append(seq)
+            index.add_many(keys, port_seqs)
+        index = self.indexes.get('flow')
+        if index is not None:
+            index.add_many([flow_key(protos[offset], versions[offset] << 128 | sources[offset],
+                                     sports[offset], versions[offset] << 128 | destinations[offset],
+                                     dports[offset]) for offset in l4_rows], l4_seqs)
+
+    def raw(self, seq: int) -> Optional[bytes]:
+        """原始帧字节，数据包已淘汰时返回 None"""
+        if seq not in self:
+            return None
+        row = seq % self.capacity
+        start = int(self.raw_pos[row]) % self.arena_bytes
+        return self.arena[start:start + int(self.raw_len[row])].tobytes()
+
+    def get(self, seq: int) -> Optional[Dict[str, Any]]:
+        """重建与抓包记录相同格式的字典，供详情视图使用"""
+        if seq not in self:
+            return None
+        row = seq % self.capacity
+        time_ns = int(self.time_ns[row])
+        packet_info = {
+            'time_ns': time_ns,
+            'time': time_ns / 1e9,
+            'src': self.src_text(seq),
+            'dst': self.dst_text(seq),
+            'length': int(self.length[row]),
+            'raw': self.raw(seq),
+            'linktype': int(self.linktype[row]),
+        }
+        if self.flags[row] & FLAG_PORTS:
+            proto = int(self.proto[row])
+            packet_info['protocol'] = PROTOCOL_NAMES[proto]
+            packet_info['sport'] = int(self.sport[row])
+            packet_info['dport'] = int(self.dport[row])
+            if proto == 6:
+                packet_info['tcp_flags'] = int(self.tcp_flags[row])
+        return packet_info
+
+    def src_text(self, seq: int) -> str:
+        row = seq % self.capacity
+        version = int(self.ip_version[row])
+        if not version:
+            return ''
+        return format_address((int(self.src_hi[row]) << 64) | int(self.src_lo[row]), version)
+
+    def dst_text(self, seq: int) -> str:
+        row = seq % self.capacity
+        version = int(self.ip_version[row])
+        if not version:
+            return ''
+        return format_address((int(self.dst_hi[row]) << 64) | int(self.dst_lo[row]), version)
+
+    def summary(self, seq: int) -> str:
+        """列表中的一行: 源地址:端口 -> 目标地址:端口"""
+        row = seq % self.capacity
+        if self.flags[row] & FLAG_PORTS:
+            return (f"{self.src_text(seq)}:{self.sport[row]} -> "
+                    f"{self.dst_text(seq)}:{self.dport[row]}")
+        return f"{self.src_text(seq)}: -> {self.dst_text(seq)}:"
+
+    # 索引查询
+
+    def lookup(self, field: str, key) -> Optional[np.ndarray]:
+        """从索引中取出键对应的有效序号 (升序)，该索引未开启时返回 None"""
+        index = self.indexes.get(field)
+        if index is None:
+            return None
+        return index.lookup(key, self.first)
+
+    def lookup_address(self, field: str, version: int, address: int) -> Optional[np.ndarray]:
+        return self.lookup(field, address_key(version, address))
+
+    def lookup_port(self, proto: int, port: int) -> Optional[np.ndarray]:
+        """源端口或目标端口等于 port 的数据包"""
+        return self.lookup('port', port_key(proto, port))
+
+    def flow_packets(self, seq: int) -> Optional[np.ndarray]:
+        """与 seq 属于同一个流的数据包，没有端口或未开启流索引时返回 None"""
+        if seq not in self or 'flow' not in self.indexes:
+            return None
+        row = seq % self.capacity
+        if not self.flags[row] & FLAG_PORTS:
+            return None
+        version = int(self.ip_version[row])
+        source = address_key(version, int(self.src_hi[row]) << 64 | int(self.src_lo[row]))
+        destination = address_key(version, int(self.dst_hi[row]) << 64 | int(self.dst_lo[row]))
+        return self.lookup('flow', flow_key(int(self.proto[row]), source, int(self.sport[row]),
+                                            destination, int(self.dport[row])))
+
+    def index_memory(self) -> Dict[str, int]:
+        """各索引占用的字节数"""
+        return {field: index.memory_bytes() for field, index in self.indexes.items()}
+
+    def seqs(self) -> np.ndarray:
+        """全部有效序号 (升序)"""
+        return np.arange(self.first, self.next_seq, dtype=np.int64)
+
+    # 按标志的向量化操作
+
+    def _valid_rows(self) -> np.ndarray:
+        """有效行号，按序号从旧到新排列"""
+        return np.arange(self.first, self.next_seq, dtype=np.int64) % self.capacity
+
+    def set_flag(self, seq: int, flag: int):
+        if seq in self:
+            self.flags[seq % self.capacity] |= flag
+
+    def set_flags(self, seqs, flag: int):
+        """给一组有效序号打标志"""
+        rows = np.asarray(seqs, dtype=np.int64) % self.capacity
+        self.flags[rows] |= np.uint8(flag)
+
+    def clear_flag(self, flag: int):
+        """清除所有数据包的某个标志"""
+        self.flags &= np.uint8(~flag & 0xFF)
+
+    def count(self, flag: Optional[int] = None) -> int:
+        """有效数据包数，指定 flag 时只计带该标志的"""
+        if flag is None:
+            return len(self)
+        return int(np.count_nonzero(self.flags[self._valid_rows()] & flag))
+
+    def latest(self, limit: int, flag: Optional[int] = None) -> List[int]:
+        """最新的 limit 个数据包的序号，从新到旧，可按标志筛选"""
+        if flag is None:
+            start = max(self.first, self.next_seq - limit)
+            return list(range(self.next_seq - 1, start - 1, -1))
+        seqs = np.arange(self.first, self.next_seq, dtype=np.int64)
+        matched = seqs[(self.flags[seqs % self.capacity] & flag) != 0]
+        return matched[::-1][:limit].tolist()
+
+
+def selfcheck() -> bool:
+    """校验记录经存储往返后不变，包括原始 IP (LINKTYPE_RAW) 帧的链路类型和 TCP 标志"""
+    from traffic_replay import build_frame
+    from fast_dissect import LINKTYPE_RAW
+    from asciimatics_wireshark import dissect_packet, parse_raw_frame
+
+    tcp = build_frame(6, '10.0.0.1', '10.0.0.2', 40000, 80, b'GET / HTTP/1.1\r\n\r\n')
+    udp = build_frame(17, '10.0.0.2', '10.0.0.1', 53, 5353, b'x' * 20)
+    records = [parse_raw_frame(tcp, 1000, LINKTYPE_ETHERNET),
+               parse_raw_frame(tcp[14:], 2000, LINKTYPE_RAW),
+               parse_raw_frame(udp[14:], 3000, LINKTYPE_RAW)]
+    single = PacketStore(16, arena_bytes=4096)
+    batched = PacketStore(16, arena_bytes=4096)
+    seqs = [single.append_info(record) for record in records]
+    batched_seqs = batched.extend_info(records)
+    checks = [
+        ('逐个追加往返', [single.get(seq) for seq in seqs] == records),
+        ('批量追加往返', [batched.get(seq) for seq in batched_seqs] == records),
+        ('RAW 链路类型', batched.get(batched_seqs[1])['linktype'] == LINKTYPE_RAW),
+        ('TCP 标志', batched.get(batched_seqs[1])['tcp_flags'] == 0x18),
+        ('RAW 帧详情', type(dissect_packet(batched.get(batched_seqs[1]))).__name__ == 'IP'),
+    ]
+    failed = [name for name, ok in checks if not ok]
+    print(f"数据包存储自检: {len(checks) - len(failed)}/{len(checks)} 通过" +
+          (f", 失败: {', '.join(failed)}" if failed else ""))
+    return not failed
+
+
+def _record_batches(count: int, batch_size: int = 100):
+    """按界面刷新的粒度产生原生引擎的数据包记录"""
+    from traffic_replay import SyntheticTraffic, parse_mix
+    from asciimatics_wireshark import parse_raw_frame
+
+    frames = SyntheticTraffic(parse_mix('tcp=60,udp=30,icmp=10'), pool_size=4096).frames
+    for base in range(0, count, batch_size):
+        yield [parse_raw_frame(frames[i % len(frames)], i)
+               for i in range(base, min(base + batch_size, count))]
+
+
+def _fill_list(count: int, capacity: int) -> float:
+    """原来的做法: 新数据包插到最前面，超过容量时切片裁剪"""
+    import time
+    history: List[Dict[str, Any]] = []
+    elapsed = 0.0
+    for batch in _record_batches(count):
+        start = time.perf_counter()
+        history[:0] = reversed(batch)
+        if len(history) > capacity:
+            history = history[:capacity]
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def _fill_store(count: int, capacity: int, indexes: Iterable[str] = ()):
+    import time
+    store = PacketStore(capacity, indexes=indexes)
+    elapsed = 0.0
+    for batch in _record_batches(count):
+        start = time.perf_counter()
+        store.extend_info(batch)
+        elapsed += time.perf_counter() - start
+    return store, elapsed
+
+
+def benchmark(count: int = 300000, capacity: int = 100000):
+    """与字典列表对比追加耗时和保留的内存 (含原始字节)"""
+    import tracemalloc
+
+    list_time = _fill_list(count, capacity)
+    store_time = _fill_store(count, capacity)[1]
+
+    # 内存单独测量，tracemalloc 会拖慢执行
+    tracemalloc.start()
+    history: List[Dict[str, Any]] = []
+    for batch in _record_batches(count):
+        history[:0] = reversed(batch)
+        if len(history) > capacity:
+            history = history[:capacity]
+    del batch
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    del history
+    tracemalloc.stop()
+
+    store = PacketStore(capacity)
+    print(f"{count} 个数据包，保留最新 {capacity} 个")
+    print(f"字典列表: 追加 {list_time / count * 1e9:.0f} ns/包, 保留 {list_bytes / 1e6:.1f} MB "
+          f"({list_bytes / capacity:.0f} 字节/包)")
+    print(f"列式存储: 追加 {store_time / count * 1e9:.0f} ns/包, 固定 {store.memory_bytes() / 1e6:.1f} MB "
+          f"(列 {(store.memory_bytes() - store.arena_bytes) / capacity:.0f} 字节/包 + 字节区)")
+
+
+def benchmark_indexes(count: int = 300000, capacity: int = 100000):
+    """索引的维护开销、内存，以及索引查询与全量扫描的对比"""
+    import time
+    from display_filter import compile_node, index_candidates, parse
+
+    store, plain_time = _fill_store(count, capacity)
+    store, indexed_time = _fill_store(count, capacity, INDEX_FIELDS)
+    print(f"\n索引维护: 追加 {plain_time / count * 1e9:.0f} -> {indexed_time / count * 1e9:.0f} ns/包")
+    for field, size in store.index_memory().items():
+        index = store.indexes[field]
+        print(f"  {field:<5} {len(index.postings):>7} 个键 {index.entries:>7} 项 "
+              f"{size / 1e6:6.1f} MB ({size / len(store):.0f} 字节/包)")
+
+    sample = next(packet for packet in map(store.get, store.latest(100)) if 'dport' in packet)
+    other = store.get(store.first)
+    filters = [f"ip.src == {sample['src']}",
+               f"tcp.port == 443",
+               f"ip.src == {sample['src']} and {sample['protocol'].lower()}.port == {sample['dport']}",
+               f"ip.addr == {sample['src']} or ip.addr == {other['dst']}",
+               f"tcp.dstport == 443 and frame.len > 100"]
+    print(f"{'过滤器':<60}{'扫描ms':>9}{'索引ms':>9}{'匹配':>8}")
+    for text in filters:
+        node = parse(text)
+        matcher = compile_node(node)
+        start = time.perf_counter()
+        scanned = [seq for seq in store.seqs().tolist() if matcher(store.get(seq))]
+        scan_ms = (time.perf_counter() - start) * 1000
+        index_ms = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            seqs, exact = index_candidates(node, store)
+            if not exact:
+                seqs = [seq for seq in seqs.tolist() if matcher(store.get(seq))]
+            index_ms = min(index_ms, (time.perf_counter() - start) * 1000)
+        if list(seqs) != scanned:
+            raise AssertionError(f"索引结果与扫描不一致: {text}")
+        print(f"{text:<60}{scan_ms:>9.1f}{index_ms:>9.2f}{len(scanned):>8}")
+
+
+if __name__ == "__main__":
+    ok = selfcheck()
+    benchmark()
+    benchmark_indexes()
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,414 @@
+"""pcap / pcapng 文件读写
+
+通过内存映射按记录流式读取捕获文件，不会把整个文件载入内存，
+帧以 memoryview 形式指向映射区域，适合分析数 GB 的离线捕获。
+
+写入方向提供按大小/时间轮转的 pcap 写入器，磁盘写入在独立线程中完成。
+"""
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Deque, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LINKTYPE_ETHERNET = 1
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_OPT_TSRESOL = 9
+
+
+class PcapReader:
+    """mmap 方式的 pcap / pcapng 读取器
+
+    迭代产出 (纳秒时间戳, 帧, 链路类型)，帧为指向映射区域的 memoryview，
+    需要保留的帧由调用方自行拷贝；index() 只产出帧在文件中的位置，
+    供按批解析时直接使用映射区域。
+
+    pcapng 的每个接口可以有不同的链路类型，链路类型随每条记录给出；
+    linktype 属性只是第一个接口的链路类型，用于显示。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mmap, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._view = memoryview(self._mmap)
+        self.linktype = LINKTYPE_ETHERNET
+        # 统计信息
+        self.records = 0
+        self.bytes = 0
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+        magic = self._view[:4].tobytes()
+        if struct.unpack('<I', magic)[0] == PCAPNG_SHB:
+            self.format = 'pcapng'
+        elif struct.unpack('<I', magic)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) or \
+                struct.unpack('>I', magic)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            self.format = 'pcap'
+        else:
+            self.close()
+            raise ValueError(f"无法识别的捕获文件格式: {path}")
+        self.linktype = self._first_linktype()
+        self._check_linktype()
+
+    def _first_linktype(self) -> int:
+        """打开时即确定链路类型: pcap 取自文件头，pcapng 取第一个接口描述块"""
+        view = self._view
+        if self.format == 'pcap':
+            endian = '<' if struct.unpack('<I', view[:4])[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) else '>'
+            return struct.unpack_from(endian + 'I', view, 20)[0] if len(view) >= 24 else LINKTYPE_ETHERNET
+        offset = 0
+        endian = '<'
+        while offset + 12 <= len(view):
+            if struct.unpack_from('<I', view, offset)[0] == PCAPNG_SHB:
+                bom = struct.unpack_from('<I', view, offset + 8)[0]
+                endian = '<' if bom == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            block_type, block_len = struct.unpack_from(endian + 'II', view, offset)
+            if block_type == PCAPNG_IDB and offset + 10 <= len(view):
+                return struct.unpack_from(endian + 'H', view, offset + 8)[0]
+            if block_type in (PCAPNG_EPB, PCAPNG_SPB) or block_len < 12:
+                break
+            offset += block_len
+        return LINKTYPE_ETHERNET
+
+    def __iter__(self) -> Iterator[Tuple[int, memoryview, int]]:
+        view = self._view
+        for timestamp_ns, offset, length, linktype in self.index():
+            yield timestamp_ns, view[offset:offset + length], linktype
+
+    @property
+    def buffer(self) -> memoryview:
+        """整个文件的映射区域，index() 产出的偏移相对于它"""
+        return self._view
+
+    def index(self) -> Iterator[Tuple[int, int, int, int]]:
+        """产出 (纳秒时间戳, 帧在文件中的偏移, 帧长度, 链路类型)，不创建帧视图"""
+        self.start_time = time.time()
+        try:
+            if self.format == 'pcap':
+                yield from self._read_pcap()
+            else:
+                yield from self._read_pcapng()
+        finally:
+            self.end_time = time.time()
+
+    def _read_pcap(self) -> Iterator[Tuple[int, int, int, int]]:
+        view = self._view
+        linktype = self.linktype
+        magic = struct.unpack('<I', view[:4])[0]
+        endian = '<' if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) else '>'
+        magic = struct.unpack(endian + 'I', view[:4])[0]
+        frac_ns = 1 if magic == PCAP_MAGIC_NSEC else 1000
+
+        record_header = struct.Struct(endian + 'IIII')
+        offset = 24
+        size = len(view)
+        while offset + record_header.size <= size:
+            ts_sec, ts_frac, incl_len, _ = record_header.unpack_from(view, offset)
+            offset += record_header.size
+            if offset + incl_len > size:
+                logger.warning(f"捕获文件在偏移 {offset} 处被截断")
+                break
+            self.records += 1
+            self.bytes += incl_len
+            yield ts_sec * 1_000_000_000 + ts_frac * frac_ns, offset, incl_len, linktype
+            offset += incl_len
+
+    def _read_pcapng(self) -> Iterator[Tuple[int, int, int, int]]:
+        view = self._view
+        size = len(view)
+        offset = 0
+        endian = '<'
+        # 每个接口的 (链路类型, 时间戳单位换算为纳秒的 (乘数, 除数))
+        interfaces = []
+        block_header = struct.Struct(endian + 'II')
+
+        while offset + 12 <= size:
+            block_type = struct.unpack_from('<I', view, offset)[0]
+            if block_type == PCAPNG_SHB:
+                # 每个 Section 可以有不同的字节序，接口表也随之重置
+                bom = struct.unpack_from('<I', view, offset + 8)[0]
+                endian = '<' if bom == PCAPNG_BYTE_ORDER_MAGIC else '>'
+                block_header = struct.Struct(endian + 'II')
+                interfaces = []
+            block_type, block_len = block_header.unpack_from(view, offset)
+            if block_len < 12 or offset + block_len > size:
+                logger.warning(f"捕获文件在偏移 {offset} 处被截断")
+                break
+            body = offset + 8
+
+            if block_type == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + 'H', view, body)[0]
+                unit = self._parse_tsresol(view, body + 8, offset + block_len - 4, endian)
+                interfaces.append((linktype, unit))
+                if len(interfaces) == 1 and linktype != self.linktype:
+                    # 后续 Section 换了链路类型
+                    self.linktype = linktype
+                    self._check_linktype()
+                elif linktype != interfaces[0][0]:
+                    logger.info(f"接口 {len(interfaces) - 1} 的链路类型为 {linktype}，"
+                                f"与第一个接口 ({interfaces[0][0]}) 不同，按记录分别解析")
+            elif block_type == PCAPNG_EPB:
+                iface, ts_high, ts_low, cap_len, _ = struct.unpack_from(endian + 'IIIII', view, body)
+                linktype, (multiplier, divisor) = (interfaces[iface] if iface < len(interfaces)
+                                                   else (self.linktype, (1000, 1)))
+                self.records += 1
+                self.bytes += cap_len
+                yield ((ts_high << 32) | ts_low) * multiplier // divisor, body + 20, cap_len, linktype
+            elif block_type == PCAPNG_SPB:
+                # 简单报文块没有时间戳和截取长度，属于第一个接口
+                orig_len = struct.unpack_from(endian + 'I', view, body)[0]
+                cap_len = min(orig_len, block_len - 16)
+                linktype = interfaces[0][0] if interfaces else self.linktype
+                self.records += 1
+                self.bytes += cap_len
+                yield 0, body + 4, cap_len, linktype
+
+            offset += block_len
+
+    @staticmethod
+    def _parse_tsresol(view: memoryview, offset: int, end: int, endian: str) -> Tuple[int, int]:
+        """从接口描述块的选项中解析时间戳精度，默认微秒
+
+        返回整数 (乘数, 除数)，时间戳 * 乘数 // 除数 为纳秒，避免浮点在纳秒量级的误差。
+        """
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + 'HH', view, offset)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_TSRESOL and length >= 1:
+                value = view[offset + 4]
+                if value & 0x80:
+                    return 1_000_000_000, 2 ** (value & 0x7f)
+                if value <= 9:
+                    return 10 ** (9 - value), 1
+                return 1, 10 ** (value - 9)
+            offset += 4 + ((length + 3) & ~3)
+        return 1000, 1
+
+    def _check_linktype(self):
+        if self.linktype != LINKTYPE_ETHERNET:
+            logger.warning(f"链路类型 {self.linktype} 不是以太网，解析结果可能不正确")
+
+    def rate(self) -> float:
+        """读取速率 (记录/秒)"""
+        if self.start_time is None:
+            return 0.0
+        elapsed = (self.end_time or time.time()) - self.start_time
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        """解除映射并关闭文件"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 仍有帧视图未释放，交由垃圾回收处理
+            logger.debug("捕获文件映射仍被引用，延迟释放")
+        self._file.close()
+
+
+def replay(reader: PcapReader, fast: bool = False) -> Iterator[Tuple[int, memoryview, int]]:
+    """按原始时间间隔回放 (纳秒时间戳, 帧, 链路类型) 记录，fast 为 True 时不等待尽快读取"""
+    if fast:
+        yield from reader
+        return
+
+    first_ts = None
+    start = time.monotonic()
+    for timestamp, frame, linktype in reader:
+        if first_ts is None:
+            first_ts = timestamp
+        delay = (timestamp - first_ts) / 1e9 - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+        yield timestamp, frame, linktype
+
+
+class RotatingPcapWriter:
+    """轮转 pcap 写入器
+
+    捕获线程调用 write() 只做一次入队，由专用写线程批量写入带大缓冲的文件。
+    写线程跟不上时新帧被丢弃并计数 (dropped，只在捕获线程中修改)，
+    写盘失败的帧由写线程单独计数 (failed)，捕获线程永远不会因磁盘而阻塞。
+    文件头写入帧的链路类型，链路类型变化时换一个文件。
+    文件按大小或时间轮转，总大小 (含正在写入的文件) 超过上限时删除最旧的文件。
+    """
+    RECORD_HEADER = struct.Struct('<IIII')
+
+    def __init__(self, prefix: str, max_file_bytes: int = 100 * 1024 * 1024,
+                 rotate_seconds: float = 0, max_total_bytes: int = 0,
+                 queue_size: int = 65536, buffer_size: int = 4 * 1024 * 1024,
+                 snaplen: int = 65535):
+        self.prefix = prefix
+        self.max_file_bytes = max_file_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_total_bytes = max_total_bytes
+        self.buffer_size = buffer_size
+        self.snaplen = snaplen
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._file_path: Optional[str] = None
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        self._file_linktype = LINKTYPE_ETHERNET
+        self._sequence = 0
+        # 已完成的文件 (路径, 大小)，按创建顺序排列
+        self._closed_files: Deque[Tuple[str, int]] = deque()
+        self._closed_bytes = 0
+        # 统计信息
+        self.written = 0
+        self.dropped = 0  # 队列满而丢弃，由捕获线程计数
+        self.failed = 0  # 写盘失败，由写线程计数
+        self.bytes_written = 0
+        self.files_deleted = 0
+
+    def start(self):
+        """启动写线程"""
+        directory = os.path.dirname(self.prefix)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._running = True
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, frame, timestamp_ns: int, linktype: int = LINKTYPE_ETHERNET):
+        """提交一个帧，队列满时丢弃并计数"""
+        try:
+            self._queue.put_nowait((timestamp_ns, bytes(frame), linktype))
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer_loop(self):
+        while self._running or not self._queue.empty():
+            try:
+                record = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._file and self._should_rotate():
+                    self._rotate(self._file_linktype)
+                continue
+            # 批量取出积压的记录，减少唤醒次数
+            batch = [record]
+            try:
+                while len(batch) < 4096:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            for i, (timestamp_ns, data, linktype) in enumerate(batch):
+                try:
+                    self._write_record(timestamp_ns, data, linktype)
+                except OSError as e:
+                    # 之前的记录已计入 written，只把失败的这条和剩余记录计入 failed
+                    logger.error(f"写入捕获文件失败: {e}")
+                    self.failed += len(batch) - i
+                    # 当前文件可能只写了半条记录，丢弃它，下一条记录重新打开文件
+                    try:
+                        self._close_file()
+                    except OSError as e:
+                        logger.warning(f"关闭捕获文件失败: {e}")
+                    break
+        self._close_file()
+
+    def _write_record(self, timestamp_ns: int, data: bytes, linktype: int):
+        if self._file is None or linktype != self._file_linktype or self._should_rotate():
+            self._rotate(linktype)
+        data = data[:self.snaplen]
+        sec, nsec = divmod(timestamp_ns, 1_000_000_000)
+        self._file.write(self.RECORD_HEADER.pack(sec, nsec, len(data), len(data)))
+        self._file.write(data)
+        size = self.RECORD_HEADER.size + len(data)
+        self._file_bytes += size
+        self.bytes_written += size
+        self.written += 1
+        if self.max_total_bytes and self._closed_bytes + self._file_bytes > self.max_total_bytes:
+            self._enforce_total_size()
+
+    def _should_rotate(self) -> bool:
+        if self.max_file_bytes and self._file_bytes >= self.max_file_bytes:
+            return True
+        if self.rotate_seconds and time.time() - self._file_opened >= self.rotate_seconds:
+            return True
+        return False
+
+    def _rotate(self, linktype: int):
+        """关闭当前文件并打开新文件"""
+        self._close_file()
+        self._sequence += 1
+        path = f"{self.prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._sequence:05d}.pcap"
+        self._file = open(path, 'wb', buffering=self.buffer_size)
+        self._file_path = path
+        # 纳秒精度的 pcap 文件头，链路类型与写入的帧一致
+        self._file.write(struct.pack('<IHHiIII', PCAP_MAGIC_NSEC, 2, 4, 0, 0,
+                                     self.snaplen, linktype))
+        self._file_bytes = 24
+        self._file_linktype = linktype
+        self._file_opened = time.time()
+        self._enforce_total_size()
+        logger.debug(f"开始写入捕获文件: {path}")
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        finally:
+            # 关闭失败时文件也不再使用，仍计入已完成文件以便按总大小清理
+            self._closed_files.append((self._file_path, self._file_bytes))
+            self._closed_bytes += self._file_bytes
+            self._file = None
+            self._file_bytes = 0
+
+    def _enforce_total_size(self):
+        """已完成的文件加上正在写入的文件超过总大小上限时删除最旧的已完成文件
+
+        正在写入的文件按轮转大小预留空间，写满时总大小也不会超过上限。
+        """
+        if not self.max_total_bytes:
+            return
+        current = max(self._file_bytes, self.max_file_bytes) if self._file is not None else 0
+        while self._closed_files and self._closed_bytes + current > self.max_total_bytes:
+            path, size = self._closed_files.popleft()
+            self._closed_bytes -= size
+            try:
+                os.remove(path)
+                self.files_deleted += 1
+            except OSError as e:
+                logger.warning(f"删除旧捕获文件失败: {e}")
+
+    def get_stats(self) -> dict:
+        """写入统计"""
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'bytes': self.bytes_written,
+            'backlog': self._queue.qsize(),
+            'files': self._sequence,
+            'deleted': self.files_deleted,
+        }
+
+    def stop(self):
+        """写完积压数据后停止"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
@@ -1,5 +1,4 @@
 from scapy.all import sniff
-from scapy.layers.http import HTTP, HTTPRequest, HTTPResponse
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -11,8 +10,14 @@ import netifaces  # 需要安装: pip install netifaces
 import platform
 import sys
 
+from tcp_reassembly import TcpReassembler
+from http_parser import HttpConnection, HTTP_STARTS
+from fast_dissect import format_address
+
 console = Console()
 sessions = defaultdict(dict)
+parsers = {}  # 连接 -> HttpConnection，不是 HTTP 的连接为 None
+MAX_BODY = 64 * 1024  # 每个报文最多保留的报文体字节数
 
 def parse_url(host, path):
     """解析 URL，返回 pathname 和 query 参数"""
@@ -78,55 +83,63 @@ def print_session(session_key):
     console.print(panel)
     del sessions[session_key]
 
-def packet_handler(packet):
-    if HTTP not in packet:
-        return
-        
-    if HTTPRequest in packet:
-        http_layer = packet[HTTPRequest]
-        src = f"{packet.src}:{packet.sport}"
-        dst = f"{packet.dst}:{packet.dport}"
-        session_key = f"{src} -> {dst}"
-        
-        # 提取请求头
-        headers = {}
-        for field in http_layer.fields:
-            if field != 'Method' and field != 'Path' and field != 'Http-Version':
-                value = http_layer.fields[field]
-                if value:
-                    headers[field] = value.decode() if isinstance(value, bytes) else str(value)
-        
+def connection_name(key):
+    """连接的文本形式: 客户端 -> 服务器"""
+    version, address, port, peer, peer_port = key
+    client = reassembler.connections[key].client
+    if client != (address, port):
+        address, port, peer, peer_port = peer, peer_port, address, port
+    return f"{format_address(address, version)}:{port} -> {format_address(peer, version)}:{peer_port}"
+
+def message_handler(key, message):
+    """一个完整的 HTTP 报文，请求和响应按连接配对"""
+    session_key = connection_name(key)
+    headers = dict(message.headers)
+    body = bytes(message.body) if message.body else None
+    if message.is_request:
         # 存储请求信息
         sessions[session_key]['request'] = {
-            'method': http_layer.Method.decode() if http_layer.Method else "N/A",
-            'host': http_layer.Host.decode() if http_layer.Host else "N/A",
-            'path': http_layer.Path.decode() if http_layer.Path else "N/A",
+            'method': message.method,
+            'host': message.header('host', 'N/A'),
+            'path': message.target,
             'headers': headers,
-            'body': bytes(packet[HTTP].payload) if packet[HTTP].payload else None
+            'body': body
         }
-            
-    elif HTTPResponse in packet:
-        http_layer = packet[HTTPResponse]
-        src = f"{packet.src}:{packet.sport}"
-        dst = f"{packet.dst}:{packet.dport}"
-        session_key = f"{dst} -> {src}"
-        
-        # 提取响应头
-        headers = {}
-        for field in http_layer.fields:
-            if field != 'Status-Line' and field != 'Status-Code' and field != 'Http-Version':
-                value = http_layer.fields[field]
-                if value:
-                    headers[field] = value.decode() if isinstance(value, bytes) else str(value)
-        
+    elif message.status >= 200 and session_key in sessions:
         # 存储响应信息
-        if session_key in sessions:
-            sessions[session_key]['response'] = {
-                'status': http_layer.Status_Code.decode() if http_layer.Status_Code else "N/A",
-                'headers': headers,
-                'body': bytes(packet[HTTP].payload) if packet[HTTP].payload else None
-            }
-            print_session(session_key)
+        sessions[session_key]['response'] = {
+            'status': str(message.status),
+            'headers': headers,
+            'body': body
+        }
+        print_session(session_key)
+
+def stream_handler(key, direction, data):
+    """重组后的 TCP 字节流交给 HTTP 解析器"""
+    parser = parsers.get(key, False)
+    if parser is False:
+        parser = None
+        if data.startswith(HTTP_STARTS):
+            parser = HttpConnection(lambda _, message, key=key: message_handler(key, message),
+                                    keep_body=MAX_BODY)
+        parsers[key] = parser
+    if parser is not None:
+        parser.feed(direction, data)
+
+def gap_handler(key, direction, missing):
+    parser = parsers.get(key)
+    if parser is not None:
+        parser.gap(direction, missing)
+
+def close_handler(key):
+    parser = parsers.pop(key, None)
+    if parser is not None:
+        parser.close()
+
+reassembler = TcpReassembler(stream_handler, gap_handler, close_handler)
+
+def packet_handler(packet):
+    reassembler.add_packet(packet)
 
 def get_available_interfaces():
     """获取系统可用的网卡列表"""
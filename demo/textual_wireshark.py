@@ -1,7 +1,7 @@
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Container, Horizontal, Vertical
-from textual.widgets import Header, Footer, Input, ListView, ListItem, Static, Label
+from textual.widgets import Header, Footer, Input, ListView, ListItem, Static, Label, DataTable
 from textual.reactive import reactive
 from textual.widget import Widget
 from rich.text import Text
@@ -12,12 +12,25 @@ import time
 from datetime import datetime
 import logging
 import threading
-import queue
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import os
-import re
 import sys
 import select
+import argparse
+
+import numpy as np
+
+from capture_backend import (TPacketV3Ring, RecvBatchPool, FanoutCapture,
+                             LossAccounting, ring_supported, read_packet_stats,
+                             enable_timestamps, recv_timestamped)
+from bpf_filter import compile_filter, attach_filter, detach_filter
+from pcap_file import PcapReader, RotatingPcapWriter, replay
+from handoff import SpscRing
+from fast_dissect import (UNKNOWN, LINKTYPE_ETHERNET, LINKTYPE_RAW, PROTOCOL_NAMES,
+                          dissect, ethertype_name, format_address, parse_address)
+from batch_dissect import FrameBatch, dissect_batch
+from flow_table import FlowTable, SORT_KEYS
+from http_parser import HTTP_STARTS, MAX_HEAD, parse_head
 
 # 创建logs目录（如果不存在）
 if not os.path.exists('logs'):
@@ -43,131 +56,219 @@ logger.propagate = False
 # 确保捕获所有级别的日志
 logger.setLevel(logging.DEBUG)
 
+HTTP_PORTS = (80, 8080)
+
+# 头部尚未解析的标记
+_UNPARSED = None
+
+
 class Packet:
-    """数据包对象"""
-    def __init__(self, data: bytes, timestamp: float):
+    """数据包对象
+
+    只保存帧数据、时间戳和链路类型，头部字段在第一次访问时由 fast_dissect
+    从链路层开始逐层解码，IP 地址以整数保存，显示时才转换为字符串；
+    HTTP 载荷只在访问协议或信息时才检查。
+    """
+    __slots__ = ('data', 'ts_ns', 'length', 'linktype', '_ip_version', '_ip_proto',
+                 '_src', '_dst', '_sport', '_dport', '_l4_fields', '_payload_offset',
+                 '_vlans', '_protocol', '_http')
+
+    def __init__(self, data: bytes, ts_ns: int, linktype: int = LINKTYPE_ETHERNET):
         self.data = data
-        self.timestamp = timestamp
-        self.src_ip = ""
-        self.dst_ip = ""
-        self.protocol = ""
-        self.src_port = 0
-        self.dst_port = 0
+        self.ts_ns = ts_ns  # 内核接收时间戳 (纳秒)
         self.length = len(data)
-        self.info = ""
-        self.http_info = {}  # 存储HTTP相关信息
-        self.parse()
+        self.linktype = linktype
+        self._ip_version = _UNPARSED
+        self._protocol = _UNPARSED
         
-    def parse(self):
-        """解析数据包"""
+    @property
+    def timestamp(self) -> float:
+        """以秒为单位的时间戳，仅用于显示"""
+        return self.ts_ns / 1e9
+
+    def _parse_headers(self):
+        """解码链路层、IP 与传输层头部
+
+        非 IP 帧的 _ip_version 为 0，_ip_proto 保存 ethertype。
+        """
         try:
-            # 直接解析 IP 头
-            ip_header = self.data[:20]
-            iph = struct.unpack('!BBHHHBBH4s4s', ip_header)
-            
-            version_ihl = iph[0]
-            self.protocol = iph[6]
-            self.src_ip = socket.inet_ntoa(iph[8])
-            self.dst_ip = socket.inet_ntoa(iph[9])
-            
-            # 获取 IP 头长度
-            ihl = version_ihl & 0xF
-            iph_length = ihl * 4
-            
-            # TCP
-            if self.protocol == 6:
-                self.protocol = "TCP"
-                tcp_header = self.data[iph_length:iph_length+20]
-                tcph = struct.unpack('!HHLLBBHHH', tcp_header)
-                self.src_port = tcph[0]
-                self.dst_port = tcph[1]
-                
-                # 计算TCP数据偏移
-                tcp_offset = (tcph[4] >> 4) * 4
-                payload_offset = iph_length + tcp_offset
-                payload = self.data[payload_offset:]
-                
-                # 检查是否是HTTP流量
-                if self.src_port == 80 or self.dst_port == 80 or \
-                   self.src_port == 8080 or self.dst_port == 8080:
-                    self._parse_http(payload)
-                else:
-                    self.info = f"Seq={tcph[2]} Ack={tcph[3]}"
-                
-            # UDP
-            elif self.protocol == 17:
-                self.protocol = "UDP"
-                udp_header = self.data[iph_length:iph_length+8]
-                udph = struct.unpack('!HHHH', udp_header)
-                self.src_port = udph[0]
-                self.dst_port = udph[1]
-                self.info = f"Len={udph[2]}"
-                
-            # ICMP
-            elif self.protocol == 1:
-                self.protocol = "ICMP"
-                icmp_header = self.data[iph_length:iph_length+4]
-                icmph = struct.unpack('!BBH', icmp_header)
-                self.info = f"Type={icmph[0]} Code={icmph[1]}"
-                
-        except Exception as e:
+            dissection = dissect(self.data, self.linktype)
+        except (struct.error, IndexError, ValueError) as e:
             logger.error(f"数据包解析错误: {e}")
+            dissection = UNKNOWN
+        (ethertype, self._vlans, version, self._src, self._dst, proto, self._sport,
+         self._dport, self._l4_fields, self._payload_offset, _, _) = dissection
+        self._ip_proto = proto if version else ethertype
+        self._ip_version = version
 
-    def _parse_http(self, payload: bytes):
-        """解析HTTP协议"""
-        try:
-            # 尝试解码HTTP内容
-            http_data = payload.decode('utf-8', errors='ignore')
-            
-            # 检查是否为HTTP请求或响应
-            if http_data.startswith(('GET ', 'POST ', 'PUT ', 'DELETE ', 'HEAD ', 'OPTIONS ')):
-                # HTTP请求
-                self.protocol = "HTTP"
-                request_line = http_data.split('\r\n')[0]
-                method, path, version = request_line.split(' ')
-                self.http_info = {
-                    'type': 'Request',
-                    'method': method,
-                    'path': path,
-                    'version': version
-                }
-                self.info = f"{method} {path}"
-                
-            elif http_data.startswith('HTTP/'):
-                # HTTP响应
-                self.protocol = "HTTP"
-                status_line = http_data.split('\r\n')[0]
-                version, status_code, *status_text = status_line.split(' ')
-                self.http_info = {
-                    'type': 'Response',
-                    'version': version,
-                    'status_code': status_code,
-                    'status_text': ' '.join(status_text)
-                }
-                self.info = f"{status_code} {' '.join(status_text)}"
-                
-                # 提取Content-Type (如果存在)
-                content_type_match = re.search(r'Content-Type: (.+?)\r\n', http_data)
-                if content_type_match:
-                    self.http_info['content_type'] = content_type_match.group(1)
-                
-                # 提取Content-Length (如果存在)
-                content_length_match = re.search(r'Content-Length: (\d+)\r\n', http_data)
-                if content_length_match:
-                    self.http_info['content_length'] = content_length_match.group(1)
-                    
-        except Exception as e:
-            logger.debug(f"HTTP解析错误: {e}")
+    def _parse_protocol(self):
+        """确定协议名，HTTP 端口上的 TCP 载荷在这里检查"""
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        proto = self._ip_proto
+        if self._ip_version:
+            self._protocol = PROTOCOL_NAMES.get(proto, proto)
+        else:
+            self._protocol = ethertype_name(proto)
+        # HTTP 起始行 (HttpMessage)，不是 HTTP 时为 None
+        self._http = None
+        if self._ip_version and proto == 6 and self._l4_fields and self._is_http_port():
+            self._parse_http()
+
+    def _is_http_port(self) -> bool:
+        return self._sport in HTTP_PORTS or self._dport in HTTP_PORTS
+
+    @property
+    def ip_version(self) -> int:
+        """4 或 6，非 IP 帧为 0"""
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return self._ip_version
+
+    @property
+    def vlans(self) -> Tuple[int, ...]:
+        """由外到内的 VLAN ID"""
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return self._vlans
+
+    @property
+    def src_ip(self) -> str:
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return "" if self._src is None else format_address(self._src, self._ip_version)
+
+    @property
+    def dst_ip(self) -> str:
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return "" if self._dst is None else format_address(self._dst, self._ip_version)
+
+    @property
+    def src_addr(self) -> Optional[int]:
+        """整数形式的源地址"""
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return self._src
+
+    @property
+    def dst_addr(self) -> Optional[int]:
+        """整数形式的目标地址"""
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return self._dst
+
+    @property
+    def src_port(self) -> int:
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return self._sport
+
+    @property
+    def dst_port(self) -> int:
+        if self._ip_version is _UNPARSED:
+            self._parse_headers()
+        return self._dport
+
+    @property
+    def protocol(self):
+        if self._protocol is _UNPARSED:
+            self._parse_protocol()
+        return self._protocol
+
+    @property
+    def info(self) -> str:
+        """信息列，每次访问时由已解码的字段生成"""
+        if self._protocol is _UNPARSED:
+            self._parse_protocol()
+        proto = self._ip_proto
+        fields = self._l4_fields
+        if not fields:
+            return ""
+        if proto == 6:
+            if not self._is_http_port():
+                return "Seq={} Ack={}".format(*fields)
+            message = self._http
+            if message is None:
+                return ""
+            if message.is_request:
+                return f"{message.method} {message.target}"
+            return f"{message.status} {message.reason}"
+        if proto == 17:
+            return f"Len={fields[0]}"
+        if proto in (1, 58):
+            return "Type={} Code={}".format(*fields)
+        return ""
+
+    @property
+    def http_info(self) -> Dict[str, str]:
+        """HTTP 相关信息，每次访问时生成，响应的头部字段在这里才解析"""
+        if self._protocol is _UNPARSED:
+            self._parse_protocol()
+        message = self._http
+        if message is None:
+            return {}
+        if message.is_request:
+            return {
+                'type': 'Request',
+                'method': message.method,
+                'path': message.target,
+                'version': message.version
+            }
+        http_info = {
+            'type': 'Response',
+            'version': message.version,
+            'status_code': str(message.status),
+            'status_text': message.reason
+        }
+        # 提取Content-Type和Content-Length (如果存在)
+        head = self._http_head()
+        end = head.find(b'\r\n\r\n')
+        message = parse_head(head if end < 0 else head[:end])
+        content_type = message.field(b'content-type')
+        if content_type is not None:
+            http_info['content_type'] = content_type.decode('utf-8', errors='replace')
+        content_length = message.field(b'content-length')
+        if content_length is not None and content_length.isdigit():
+            http_info['content_length'] = content_length.decode('ascii')
+        return http_info
+
+    def retain(self):
+        """将数据从共享缓冲区拷贝为独立的 bytes，保留数据包前调用"""
+        if not isinstance(self.data, bytes):
+            self.data = bytes(self.data)
+
+    def _http_head(self) -> bytes:
+        """载荷开头最多 MAX_HEAD 字节，单个数据包中的报文头可能不完整"""
+        return bytes(self.data[self._payload_offset:self._payload_offset + MAX_HEAD])
+
+    def _parse_http(self):
+        """只解析 HTTP 起始行，协议列和信息列不需要头部字段"""
+        if not bytes(self.data[self._payload_offset:self._payload_offset + 8]).startswith(HTTP_STARTS):
+            return
+        head = self._http_head()
+        line_end = head.find(b'\r\n')
+        message = parse_head(head if line_end < 0 else head[:line_end])
+        if message is None:
+            return
+        self._protocol = "HTTP"
+        self._http = message
 
     def __str__(self) -> str:
-        if self.protocol in ("TCP", "UDP"):
-            return (f"{datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S.%f')} "
-                   f"{self.src_ip}:{self.src_port} -> {self.dst_ip}:{self.dst_port} "
-                   f"[{self.protocol}] {self.length}字节 {self.info}")
-        else:
-            return (f"{datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S.%f')} "
-                   f"{self.src_ip} -> {self.dst_ip} "
-                   f"[{self.protocol}] {self.length}字节 {self.info}")
+        # 解析一次后直接读取槽，不经过逐个属性
+        protocol = self.protocol
+        version = self._ip_version
+        src = "" if self._src is None else format_address(self._src, version)
+        dst = "" if self._dst is None else format_address(self._dst, version)
+        seconds, nanoseconds = divmod(self.ts_ns, 1_000_000_000)
+        clock = f"{time.strftime('%H:%M:%S', time.localtime(seconds))}.{nanoseconds // 1000:06d}"
+        if protocol in ("TCP", "UDP"):
+            # IPv6 地址加方括号，与端口区分
+            if version == 6:
+                src, dst = f"[{src}]", f"[{dst}]"
+            return (f"{clock} {src}:{self._sport} -> {dst}:{self._dport} "
+                    f"[{protocol}] {self.length}字节 {self.info}")
+        return f"{clock} {src} -> {dst} [{protocol}] {self.length}字节 {self.info}"
 
     def get_details(self) -> str:
         """获取详细信息"""
@@ -175,8 +276,10 @@ class Packet:
             "=== 数据包详情 ===",
             f"时间: {datetime.fromtimestamp(self.timestamp)}",
             f"长度: {self.length} 字节",
+            f"VLAN: {', '.join(map(str, self.vlans)) or '无'}",
             "",
             "=== IP层 ===",
+            f"版本: IPv{self.ip_version}" if self.ip_version else "版本: 非 IP",
             f"源IP: {self.src_ip}",
             f"目标IP: {self.dst_ip}",
             f"协议: {self.protocol}",
@@ -192,25 +295,26 @@ class Packet:
             ])
             
         # 添加HTTP信息
-        if self.protocol == "HTTP" and self.http_info:
+        http_info = self.http_info
+        if self.protocol == "HTTP" and http_info:
             details.extend([
                 "",
                 "=== HTTP层 ===",
-                f"类型: {self.http_info.get('type', 'Unknown')}"
+                f"类型: {http_info.get('type', 'Unknown')}"
             ])
             
-            if self.http_info.get('type') == 'Request':
+            if http_info.get('type') == 'Request':
                 details.extend([
-                    f"方法: {self.http_info.get('method', '')}",
-                    f"路径: {self.http_info.get('path', '')}",
-                    f"版本: {self.http_info.get('version', '')}"
+                    f"方法: {http_info.get('method', '')}",
+                    f"路径: {http_info.get('path', '')}",
+                    f"版本: {http_info.get('version', '')}"
                 ])
             else:
                 details.extend([
-                    f"状态码: {self.http_info.get('status_code', '')}",
-                    f"状态信息: {self.http_info.get('status_text', '')}",
-                    f"内容类型: {self.http_info.get('content_type', 'N/A')}",
-                    f"内容长度: {self.http_info.get('content_length', 'N/A')}"
+                    f"状态码: {http_info.get('status_code', '')}",
+                    f"状态信息: {http_info.get('status_text', '')}",
+                    f"内容类型: {http_info.get('content_type', 'N/A')}",
+                    f"内容长度: {http_info.get('content_length', 'N/A')}"
                 ])
             
         # 添加十六进制显示
@@ -239,12 +343,36 @@ class Packet:
 
 class PacketCapture:
     """数据包捕获类"""
-    def __init__(self):
+    BACKENDS = ('recv', 'batch', 'ring')
+
+    def __init__(self, backend: str = 'recv', batch_size: int = 64, kernel_filter: bool = False,
+                 workers: int = 1, writer: Optional[RotatingPcapWriter] = None):
         self.sock = None
         self.running = False
-        self.packets: queue.Queue = queue.Queue(maxsize=10000)  # 增大队列容量
+        # 抓包线程到界面的单生产者/单消费者环，界面每次刷新批量取出
+        self.packets = SpscRing(10000)
         self.capture_thread: Optional[threading.Thread] = None
-        self.packet_list: List[Packet] = []
+        self.backend = backend
+        self.ring: Optional[TPacketV3Ring] = None
+        self.batch_size = batch_size
+        self.batch_pool: Optional[RecvBatchPool] = None
+        self.frame_count = 0
+        # AF_PACKET 收到完整的以太网帧，macOS 的原始 IP 套接字从 IP 头开始
+        self.linktype = LINKTYPE_ETHERNET
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+        # 显示队列的入队尝试数和因队列满而丢弃的数量
+        self.queue_offered = 0
+        self.queue_drops = 0
+        self.loss = LossAccounting()
+        self.kernel_filter = kernel_filter
+        self.filter_text = ""
+        self.workers = workers
+        self.fanout: Optional[FanoutCapture] = None
+        self.reader: Optional[PcapReader] = None
+        self.writer = writer
+        if self.writer:
+            self.writer.start()
         
     def start(self, interface: str):
         """启动捕获"""
@@ -253,6 +381,10 @@ class PacketCapture:
             if sys.platform == 'darwin':
                 return self._start_bpf(interface)
             
+            # 多进程 fanout 模式
+            if self.workers > 1:
+                return self._start_fanout(interface)
+            
             # Linux 系统使用 AF_PACKET
             self.sock = socket.socket(
                 socket.AF_PACKET,
@@ -262,13 +394,25 @@ class PacketCapture:
             
             # 设置更大的接收缓冲区
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**25)  # 32MB
-            self.sock.settimeout(0.001)  # 降低超时时间，提高捕获频率
+            # 降低超时时间，提高捕获频率；batch 后端由 RecvBatchPool 改为非阻塞
+            self.sock.settimeout(0.001)
             
             # 绑定到指定接口
             self.sock.bind((interface, 0))
+            self.interface = interface
+            self._attach_kernel_filter()
+            enable_timestamps(self.sock)
+            
+            # 可选的 TPACKET_V3 内存映射环，不可用时回退到 recv 方式
+            capture_loop = self._capture_loop
+            if self.backend == 'ring':
+                capture_loop = self._setup_ring() or self._capture_loop
+            elif self.backend == 'batch':
+                self.batch_pool = RecvBatchPool(self.sock, self.batch_size)
+                capture_loop = self._batch_capture_loop
             
             self.running = True
-            self.capture_thread = threading.Thread(target=self._capture_loop)
+            self.capture_thread = threading.Thread(target=capture_loop)
             self.capture_thread.daemon = True
             self.capture_thread.start()
             
@@ -276,6 +420,109 @@ class PacketCapture:
             logger.error(f"启动捕获失败: {e}")
             raise
     
+    def start_file(self, path: str, fast: bool = False):
+        """从 pcap/pcapng 文件读取，fast 为 True 时不按原始时间间隔回放"""
+        try:
+            self.reader = PcapReader(path)
+            self.backend = f'file ({self.reader.format})'
+            self.linktype = self.reader.linktype
+            self.running = True
+            self.capture_thread = threading.Thread(target=self._file_capture_loop, args=(fast,))
+            self.capture_thread.daemon = True
+            self.capture_thread.start()
+        except Exception as e:
+            logger.error(f"打开捕获文件失败: {e}")
+            raise
+
+    def _file_capture_loop(self, fast: bool):
+        """文件读取循环，队列满时等待而不是丢弃"""
+        logger.debug(f"开始读取捕获文件: {self.reader.path}")
+        try:
+            for timestamp_ns, frame, linktype in replay(self.reader, fast):
+                if not self.running:
+                    break
+                if self.writer:
+                    self.writer.write(frame, timestamp_ns, linktype)
+                packet = Packet(frame, timestamp_ns, linktype)
+                packet.retain()
+                while self.running:
+                    if self.packets.put(packet):
+                        self.queue_offered += 1
+                        break
+                    time.sleep(0.01)
+        except Exception as e:
+            logger.error(f"读取捕获文件错误: {e}")
+        logger.info(f"捕获文件读取结束: {self.reader.records} 条记录, "
+                    f"{self.reader.rate():.0f} 记录/秒")
+
+    def _start_fanout(self, interface: str):
+        """启动 PACKET_FANOUT 多进程捕获，各进程按流哈希分担流量"""
+        if self.kernel_filter:
+            logger.warning("fanout 模式暂不支持内核过滤，使用用户态过滤")
+        self.interface = interface
+        self.backend = f'fanout x{self.workers}'
+        self.fanout = FanoutCapture(interface, self.workers)
+        self.fanout.start()
+        
+        self.running = True
+        self.capture_thread = threading.Thread(target=self._fanout_capture_loop)
+        self.capture_thread.daemon = True
+        self.capture_thread.start()
+
+    def _setup_ring(self):
+        """配置 TPACKET_V3 接收环，成功时返回对应的捕获循环"""
+        if not ring_supported():
+            logger.warning("当前平台不支持 PACKET_RX_RING，回退到 recv 方式")
+            self.backend = 'recv'
+            return None
+        try:
+            # 环形缓冲区使用阻塞 poll，不需要套接字超时
+            self.sock.settimeout(None)
+            self.ring = TPacketV3Ring(self.sock)
+            self.ring.setup()
+            logger.info("使用 TPACKET_V3 环形缓冲区捕获")
+            return self._ring_capture_loop
+        except OSError as e:
+            logger.warning(f"配置 PACKET_RX_RING 失败，回退到 recv 方式: {e}")
+            if self.ring:
+                self.ring.close()
+            self.ring = None
+            self.backend = 'recv'
+            # 环配置失败后套接字状态不确定，重新创建
+            self.sock.close()
+            self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**25)
+            self.sock.settimeout(0.001)
+            self.sock.bind((self.interface, 0))
+            self._attach_kernel_filter()
+            enable_timestamps(self.sock)
+            return None
+
+    def set_filter(self, filter_text: str):
+        """更新显示过滤器，启用内核过滤时同步替换 BPF 程序"""
+        self.filter_text = filter_text
+        if self.sock:
+            self._attach_kernel_filter()
+
+    def _attach_kernel_filter(self):
+        """把显示过滤器编译为 BPF 挂到套接字上，无法编译时卸载"""
+        if not self.kernel_filter or self.sock is None:
+            return
+        if not hasattr(socket, 'AF_PACKET') or self.sock.family != socket.AF_PACKET:
+            return
+        try:
+            program = compile_filter(self.filter_text)
+            if program is None:
+                detach_filter(self.sock)
+                logger.debug(f"过滤器无法在内核中执行，使用用户态过滤: {self.filter_text!r}")
+            else:
+                attach_filter(self.sock, program)
+                logger.debug(f"已挂载内核过滤器: {self.filter_text!r}, "
+                             f"{len(program.instructions)} 条指令, exact={program.exact}")
+        except OSError as e:
+            logger.warning(f"挂载内核过滤器失败，使用用户态过滤: {e}")
+            detach_filter(self.sock)
+
     def _start_bpf(self, interface: str):
         """macOS 上使用 BPF 捕获"""
         try:
@@ -287,6 +534,7 @@ class PacketCapture:
                 socket.SOCK_RAW,
                 socket.IPPROTO_IP
             )
+            self.linktype = LINKTYPE_RAW
             logger.debug("套接字创建成功")
             
             # 绑定到指定接口和 IP
@@ -341,46 +589,33 @@ class PacketCapture:
         """捕获循环"""
         buffer_size = 65535
         packet_count = 0
-        last_print = time.time()
+        last_print = 0
         
         logger.debug("进入捕获循环")
         while self.running:
             try:
                 ready = select.select([self.sock], [], [], 0.001)
                 if ready[0]:
-                    logger.debug("select 检测到数据可读")
-                    data = self.sock.recv(buffer_size)
-                    logger.debug(f"接收到数据: {len(data)} 字节")
+                    # 这里逐包执行，只记录按时间节流的汇总日志，
+                    # 格式化数据包会强制完整解析，抵消延迟解析的效果
+                    data, timestamp_ns = recv_timestamped(self.sock, buffer_size)
                     if data:
-                        # 打印原始数据的前100个字节的十六进制
-                        logger.debug(f"数据内容(前100字节): {data[:100].hex()}")
                         packet_count += 1
-                        current_time = time.time()
+                        self.frame_count += 1
+                        if self.writer:
+                            self.writer.write(data, timestamp_ns, self.linktype)
                         
-                        if current_time - last_print >= 1.0:
+                        # 用帧自带的时间戳节流日志，避免逐包读取时钟
+                        if timestamp_ns - last_print >= 1_000_000_000:
                             logger.debug(f"已捕获 {packet_count} 个数据包")
-                            last_print = current_time
+                            last_print = timestamp_ns
                         
                         try:
-                            packet = Packet(data, time.time())
-                            logger.debug(f"解析后的数据包: {packet}")
-                            
-                            try:
-                                self.packets.put_nowait(packet)
-                                self.packet_list.append(packet)
-                                logger.debug("数据包已添加到队列和列表")
-                            except queue.Full:
-                                logger.debug("数据包队列已满")
-                                continue
-                                
+                            self._keep_packet(Packet(data, timestamp_ns, self.linktype))
                         except Exception as e:
                             logger.debug(f"数据包处理错误: {e}")
-                            continue
-                else:
-                    logger.debug("select 未检测到数据")
                         
             except socket.timeout:
-                logger.debug("套接字超时")
                 continue
             except socket.error as e:
                 if not self.running:
@@ -396,17 +631,158 @@ class PacketCapture:
         
         logger.debug("退出捕获循环")
 
+    def _ring_capture_loop(self):
+        """TPACKET_V3 捕获循环，每次唤醒处理整块数据帧"""
+        logger.debug("进入环形缓冲区捕获循环")
+        last_report = time.time()
+        while self.running:
+            try:
+                for timestamp_ns, frame in self.ring.read_frames(timeout_ms=100):
+                    self._handle_frame(frame, timestamp_ns)
+                    
+                current_time = time.time()
+                if current_time - last_report >= 1.0:
+                    # 只读环自己的计数: get_stats 会读取并清零内核统计、更新丢包汇总，
+                    # 只能由界面线程调用
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"环形缓冲区统计: 块 {self.ring.blocks}, 帧 {self.ring.frames}")
+                    last_report = current_time
+            except Exception as e:
+                logger.error(f"环形缓冲区捕获错误: {e}")
+                if not self.running:
+                    break
+                time.sleep(0.1)
+        logger.debug("退出环形缓冲区捕获循环")
+
+    def _batch_capture_loop(self):
+        """批量接收捕获循环，帧复用预分配的缓冲槽位"""
+        logger.debug("进入批量接收捕获循环")
+        while self.running:
+            try:
+                for timestamp_ns, frame in self.batch_pool.read_batch(timeout=0.1):
+                    self._handle_frame(frame, timestamp_ns)
+            except socket.error as e:
+                if not self.running:
+                    break
+                logger.error(f"批量接收错误: {e}")
+                time.sleep(0.1)
+            except Exception as e:
+                logger.error(f"批量捕获循环错误: {e}")
+                if not self.running:
+                    break
+                time.sleep(0.1)
+        logger.debug("退出批量接收捕获循环")
+
+    def _fanout_capture_loop(self):
+        """合并各 fanout 工作进程回传的数据包"""
+        logger.debug("进入 fanout 合并循环")
+        while self.running:
+            try:
+                for batch, _ in self.fanout.poll(timeout=0.1):
+                    for row in range(len(batch)):
+                        frame = batch.frame(row)
+                        ts_ns = int(batch.timestamps[row])
+                        if self.writer:
+                            self.writer.write(frame, ts_ns, batch.linktype)
+                        packet = Packet(frame, ts_ns, batch.linktype)
+                        packet.retain()
+                        self._keep_packet(packet)
+            except Exception as e:
+                logger.error(f"fanout 合并错误: {e}")
+                if not self.running:
+                    break
+                time.sleep(0.1)
+        logger.debug("退出 fanout 合并循环")
+
+    def _handle_frame(self, frame, ts_ns: int):
+        """解析单个数据帧，仅在入队时拷贝数据"""
+        if self.writer:
+            self.writer.write(frame, ts_ns, self.linktype)
+        if self.packets.full():
+            # 队列已满时不必解析
+            self.queue_offered += 1
+            self.queue_drops += 1
+            return
+        try:
+            packet = Packet(frame, ts_ns, self.linktype)
+            packet.retain()
+            self._keep_packet(packet)
+        except Exception as e:
+            logger.debug(f"数据包处理错误: {e}")
+
+    def _keep_packet(self, packet: Packet) -> bool:
+        """将数据包放入显示队列，队列满时丢弃并计数"""
+        self.queue_offered += 1
+        if self.packets.put(packet):
+            return True
+        self.queue_drops += 1
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取捕获统计，用于比较不同后端"""
+        if self.fanout:
+            stats = self.fanout.get_stats()
+            stats['blocks'] = 0
+        elif self.reader:
+            stats = {'blocks': 0, 'frames': self.reader.records, 'drops': 0,
+                     'rate': self.reader.rate()}
+        elif self.ring:
+            stats = self.ring.get_stats()
+        else:
+            frames = self.batch_pool.frames if self.batch_pool else self.frame_count
+            blocks = self.batch_pool.batches if self.batch_pool else 0
+            if self.sock and hasattr(socket, 'AF_PACKET') and self.sock.family == socket.AF_PACKET:
+                try:
+                    packets, drops = read_packet_stats(self.sock)
+                    self.kernel_packets += packets
+                    self.kernel_drops += drops
+                    self.loss.update('kernel', self.kernel_packets, self.kernel_drops)
+                except OSError:
+                    pass
+            stats = {'blocks': blocks, 'frames': frames, 'drops': self.kernel_drops}
+        stats['backend'] = self.backend
+        
+        # 各阶段丢包
+        if self.fanout:
+            self.loss.update('kernel', stats['frames'] + stats['kernel_drops'], stats['kernel_drops'])
+            self.loss.update('workers', stats['frames'], stats['queue_drops'])
+        elif self.ring:
+            self.loss.update('kernel', stats['packets'], stats['drops'])
+        self.loss.update('queue', self.queue_offered, self.queue_drops)
+        if self.writer:
+            writer = self.writer.get_stats()
+            stats['writer'] = writer
+            lost = writer['dropped'] + writer['failed']
+            self.loss.update('writer', writer['written'] + writer['backlog'] + lost, lost)
+        stats['loss'] = self.loss.format()
+        return stats
+
     def stop(self):
         """停止捕获"""
         try:
             self.running = False
             if self.capture_thread and self.capture_thread.is_alive():
                 self.capture_thread.join(timeout=1.0)
+            if self.fanout:
+                self.fanout.stop()
+                self.fanout = None
+            if self.writer:
+                self.writer.stop()
+            if self.reader:
+                if self.capture_thread and self.capture_thread.is_alive():
+                    self.capture_thread.join(timeout=1.0)
+                self.reader.close()
+                self.reader = None
+            if self.ring:
+                self.ring.close()
+                self.ring = None
             if self.sock:
                 self.sock.close()
                 self.sock = None
                 
             # 清理系统设置
+            if not hasattr(self, 'interface'):
+                return
             try:
                 # 关闭混杂模式
                 os.system(f'sudo ifconfig {self.interface} -promisc')
@@ -420,26 +796,241 @@ class PacketCapture:
         except Exception as e:
             logger.error(f"停止捕获时出错: {e}")
 
+def packet_matches_filter(packet: Packet, filter_condition: str) -> bool:
+    """检查数据包是否匹配过滤条件"""
+    if not filter_condition:
+        return True
+        
+    filter_parts = filter_condition.split('/')
+    for part in filter_parts:
+        if not part:
+            continue
+            
+        if '=' in part:
+            key, value = part.split('=', 1)
+            if key == 'ip':
+                if value not in (packet.src_ip, packet.dst_ip):
+                    return False
+            elif key == 'port':
+                # 输入到一半的端口 (port=) 不匹配任何数据包
+                try:
+                    port = int(value)
+                except ValueError:
+                    return False
+                if port not in (packet.src_port, packet.dst_port):
+                    return False
+        else:
+            if part == 'tcp' and packet.protocol != 'TCP':
+                return False
+            elif part == 'udp' and packet.protocol != 'UDP':
+                return False
+            elif part == 'http' and packet.protocol != 'HTTP':
+                return False
+                
+    return True
+
+class PacketColumns:
+    """界面已取出的数据包及其头部字段的列式副本，界面中唯一保存历史数据包的地方
+
+    行号是从捕获开始的绝对序号，第 row 行对应 packets[row - base]。最多保留
+    max_packets 行，超出时一次丢弃最早的四分之一，丢弃的行不再能查看详情。
+    过滤条件变化时用 NumPy 布尔掩码一次算出全部匹配，结果与 packet_matches_filter
+    逐个判断相同。设置了 flows 时，批量解析的结果同时用于更新流表。只在界面线程中使用。
+    """
+    _COLUMNS = (('ip_version', np.uint8), ('proto', np.uint8),
+                ('src_hi', np.uint64), ('src_lo', np.uint64),
+                ('dst_hi', np.uint64), ('dst_lo', np.uint64),
+                ('sport', np.uint16), ('dport', np.uint16), ('http', np.bool_))
+    _HTTP_PORTS = np.array(HTTP_PORTS, dtype=np.uint16)
+
+    def __init__(self, capacity: int = 65536, flows: Optional[FlowTable] = None,
+                 max_packets: int = 200_000):
+        self.packets: List[Packet] = []
+        self.flows = flows
+        self.max_packets = max_packets
+        self.base = 0  # 第一行的绝对行号
+        self._size = 0
+        for name, dtype in self._COLUMNS:
+            setattr(self, name, np.zeros(min(capacity, max_packets), dtype=dtype))
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def end(self) -> int:
+        """下一行的绝对行号"""
+        return self.base + self._size
+
+    def packet(self, row: int) -> Optional[Packet]:
+        """第 row 行的数据包，已丢弃或不存在时返回 None"""
+        if self.base <= row < self.end:
+            return self.packets[row - self.base]
+        return None
+
+    def clear(self):
+        self.packets.clear()
+        self.base = 0
+        self._size = 0
+
+    def _grow(self, needed: int):
+        capacity = min(max(needed, 2 * len(self.ip_version)), self.max_packets)
+        for name, dtype in self._COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, column)
+
+    def _discard(self, count: int):
+        """丢弃最早的 count 行"""
+        count = min(count, self._size)
+        kept = self._size - count
+        for name, _ in self._COLUMNS:
+            column = getattr(self, name)
+            column[:kept] = column[count:self._size]
+        del self.packets[:count]
+        self.base += count
+        self._size = kept
+
+    def extend(self, packets: List[Packet]):
+        """追加一批数据包，按链路类型分段批量解析头部"""
+        if not packets:
+            return
+        if len(packets) > self.max_packets:
+            self._discard(self._size)
+            self.base += len(packets) - self.max_packets
+            packets = packets[-self.max_packets:]
+        elif self._size + len(packets) > self.max_packets:
+            self._discard(max(self._size + len(packets) - self.max_packets, self.max_packets // 4))
+        start = self._size
+        if start + len(packets) > len(self.ip_version):
+            self._grow(start + len(packets))
+        position = 0
+        while position < len(packets):
+            linktype = packets[position].linktype
+            end = position + 1
+            while end < len(packets) and packets[end].linktype == linktype:
+                end += 1
+            self._fill(packets[position:end], start + position, linktype)
+            position = end
+        self.packets.extend(packets)
+        self._size = start + len(packets)
+
+    def _fill(self, packets: List[Packet], row: int, linktype: int):
+        batch = FrameBatch.from_records(((packet.ts_ns, packet.data) for packet in packets),
+                                        linktype)
+        columns = dissect_batch(batch)
+        if self.flows is not None:
+            self.flows.update_columns(columns)
+        rows = slice(row, row + len(packets))
+        for name, _ in self._COLUMNS[:-1]:
+            getattr(self, name)[rows] = getattr(columns, name)
+        # 只有 HTTP 端口上的 TCP 数据包需要检查载荷，交给 Packet 判断
+        candidates = np.flatnonzero(
+            (columns.ip_version > 0) & (columns.proto == 6) & columns.l4
+            & (np.isin(columns.sport, self._HTTP_PORTS) | np.isin(columns.dport, self._HTTP_PORTS)))
+        http = self.http[rows]
+        http[:] = False
+        http[candidates] = [packets[i].protocol == "HTTP" for i in candidates.tolist()]
+
+    def _address_mask(self, value: str, start: int) -> np.ndarray:
+        version = self.ip_version[start:self._size]
+        if not value:
+            # 非 IP 帧的地址为空字符串
+            return version == 0
+        try:
+            ip_version, address = parse_address(value)
+        except OSError:
+            return np.zeros(len(version), dtype=bool)
+        if format_address(address, ip_version) != value:
+            # 与逐个判断一致，按文本比较，非规范写法不匹配
+            return np.zeros(len(version), dtype=bool)
+        hi, lo = address >> 64, address & 0xFFFFFFFFFFFFFFFF
+        end = self._size
+        return (version == ip_version) & (
+            ((self.src_hi[start:end] == hi) & (self.src_lo[start:end] == lo))
+            | ((self.dst_hi[start:end] == hi) & (self.dst_lo[start:end] == lo)))
+
+    def mask(self, filter_condition: str, start: int = 0) -> np.ndarray:
+        """绝对行号 start 之后每个仍保留的数据包是否匹配过滤条件"""
+        start = max(start - self.base, 0)
+        end = self._size
+        mask = np.ones(end - start, dtype=bool)
+        if not filter_condition:
+            return mask
+        is_ip = self.ip_version[start:end] > 0
+        proto = self.proto[start:end]
+        for part in filter_condition.split('/'):
+            if not part:
+                continue
+            if '=' in part:
+                key, value = part.split('=', 1)
+                if key == 'ip':
+                    mask &= self._address_mask(value, start)
+                elif key == 'port':
+                    try:
+                        port = int(value)
+                    except ValueError:
+                        mask[:] = False
+                        continue
+                    if not 0 <= port <= 0xFFFF:
+                        mask[:] = False
+                        continue
+                    mask &= (self.sport[start:end] == port) | (self.dport[start:end] == port)
+            elif part == 'tcp':
+                # HTTP 数据包的协议显示为 HTTP，不算 TCP
+                mask &= is_ip & (proto == 6) & ~self.http[start:end]
+            elif part == 'udp':
+                mask &= is_ip & (proto == 17)
+            elif part == 'http':
+                mask &= self.http[start:end]
+        return mask
+
+    def matches(self, filter_condition: str, start: int = 0) -> np.ndarray:
+        """匹配的绝对行号"""
+        return np.flatnonzero(self.mask(filter_condition, start)) + max(start, self.base)
+
 class FilterInput(Input):
     """过滤输入框"""
     def __init__(self):
         super().__init__(placeholder="输入过滤条件 (例如: tcp/udp/http/ip=192.168.1.1/port=80)")
         
-    def on_change(self, event):
+    def on_input_changed(self, event):
         """当输入变化时触发过滤"""
-        self.parent.apply_filter(self.value)
+        self.app.main_content.apply_filter(self.value)
 
 class FilteredPacketList(ListView):
     """过滤后的数据包列表"""
     def compose(self) -> ComposeResult:
         yield ListItem(Label("等待数据包..."))
         
-    def add_packet(self, packet: Packet):
-        """添加数据包到列表"""
-        self.mount(ListItem(Label(str(packet))))
+    MAX_ITEMS = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows: List[int] = []  # 当前显示的行号
+
+    def reset(self):
+        self.clear()
+        self.rows = []
+
+    def show_packets(self, packets: List[Packet], rows: List[int]):
+        """替换列表内容，显示的行没有变化时不重建控件"""
+        if rows == self.rows:
+            return
+        self.reset()
+        self.add_packets(packets, rows)
+
+    def add_packets(self, packets: List[Packet], rows: List[int]):
+        """一次挂载一批数据包，列表项的 name 为其在 PacketColumns 中的行号"""
         # 保持最新的1000个数据包
-        if len(self.children) > 1000:
-            self.children[0].remove()
+        packets, rows = packets[-self.MAX_ITEMS:], rows[-self.MAX_ITEMS:]
+        if not packets:
+            return
+        self.rows = (self.rows + rows)[-self.MAX_ITEMS:]
+        self.mount(*(ListItem(Label(str(packet)), name=str(row))
+                     for packet, row in zip(packets, rows)))
+        excess = len(self.children) - self.MAX_ITEMS
+        for child in list(self.children[:max(excess, 0)]):
+            child.remove()
 
 class TrafficMonitor(Static):
     """流量监控组件"""
@@ -451,8 +1042,10 @@ class TrafficMonitor(Static):
         self.total_bytes = 0
         self.start_time = time.time()
         self.packet_count = 0
+        self.capture_stats: Dict[str, Any] = {}
         
-    def update_traffic(self, total_bytes: int, packet_count: int):
+    def update_traffic(self, total_bytes: int, packet_count: int,
+                       capture_stats: Optional[Dict[str, Any]] = None):
         """更新流量数据"""
         current_time = time.time()
         time_diff = current_time - self.last_time
@@ -464,6 +1057,8 @@ class TrafficMonitor(Static):
             self.last_time = current_time
             self.total_bytes = total_bytes
             self.packet_count = packet_count
+            if capture_stats is not None:
+                self.capture_stats = capture_stats
             
             # 计算平均速度
             avg_speed = self.total_bytes / (current_time - self.start_time)
@@ -481,8 +1076,32 @@ class TrafficMonitor(Static):
                 f"平均流量: {avg_speed_text}\n"
                 f"总流量: {total_bytes_text}\n"
                 f"数据包数: {self.packet_count}"
+                f"{self._format_capture_stats()}"
             )
             
+    def _format_capture_stats(self) -> str:
+        """格式化捕获后端统计"""
+        if not self.capture_stats:
+            return ""
+        text = (f"\n后端: {self.capture_stats.get('backend', '')} "
+                f"块: {self.capture_stats.get('blocks', 0)} "
+                f"帧: {self.capture_stats.get('frames', 0)} "
+                f"内核丢包: {self.capture_stats.get('drops', 0)}")
+        writer = self.capture_stats.get('writer')
+        if writer:
+            text += (f"\n写入: {writer['written']} 帧 {self._format_bytes(writer['bytes'])} "
+                     f"文件: {writer['files']} 积压: {writer['backlog']} 丢弃: {writer['dropped']} "
+                     f"失败: {writer['failed']}")
+        if self.capture_stats.get('loss'):
+            text += f"\n丢包: {self.capture_stats['loss']}"
+        if 'rate' in self.capture_stats:
+            text += f"\n读取速率: {self.capture_stats['rate']:.0f} 记录/秒"
+        for worker in self.capture_stats.get('workers', []):
+            text += (f"\n  进程 {worker['worker']}: {worker.get('pps', 0):.0f} 包/秒 "
+                     f"帧: {worker['frames']} 内核丢包: {worker['drops']} "
+                     f"回传丢弃: {worker['queue_drops']}")
+        return text
+            
     def _format_speed(self, speed: float) -> str:
         """格式化速度显示"""
         if speed < 1024:
@@ -503,14 +1122,60 @@ class TrafficMonitor(Static):
         else:
             return f"{bytes/(1024*1024*1024):.1f} GB"
 
+class FlowView(DataTable):
+    """连接列表，按所选方式排序显示最活跃的流，点击列标题切换排序"""
+    MAX_ROWS = 200
+    # 列标题及点击后的排序方式
+    COLUMNS = (("协议", None), ("发起方", None), ("响应方", None), ("状态", None),
+               ("包 (出/入)", 'packets'), ("字节 (出/入)", 'bytes'),
+               ("持续 (秒)", 'duration'), ("最后", 'last'))
+
+    def __init__(self, flows: FlowTable):
+        super().__init__(cursor_type='row', zebra_stripes=True)
+        self.flows = flows
+        self.sort = 'bytes'
+
+    def on_mount(self) -> None:
+        self.add_columns(*(label for label, _ in self.COLUMNS))
+        self.refresh_flows()
+
+    def refresh_flows(self):
+        """按当前排序方式重建表格"""
+        self.clear()
+        self.add_rows(
+            (flow.protocol, flow.endpoint(flow.src, flow.sport), flow.endpoint(flow.dst, flow.dport),
+             flow.state, f"{flow.packets_out}/{flow.packets_in}", f"{flow.bytes_out}/{flow.bytes_in}",
+             f"{flow.duration:.1f}", datetime.fromtimestamp(flow.last_ns / 1e9).strftime('%H:%M:%S'))
+            for flow in self.flows.top(self.MAX_ROWS, self.sort))
+        self.border_title = f"连接 (按 {self.sort} 排序) {self.flows.summary()}"
+
+    def cycle_sort(self):
+        names = list(SORT_KEYS)
+        self.sort = names[(names.index(self.sort) + 1) % len(names)]
+        self.refresh_flows()
+
+    def on_data_table_header_selected(self, event: DataTable.HeaderSelected) -> None:
+        sort = self.COLUMNS[event.column_index][1]
+        if sort:
+            self.sort = sort
+            self.refresh_flows()
+
 class MainContent(Container):
     """主内容区域"""
-    def __init__(self):
+    def __init__(self, max_flows: int = 1_000_000, max_packets: int = 200_000):
         super().__init__()
         self.filter_input = FilterInput()
         self.filtered_list = FilteredPacketList()
         self.traffic_monitor = TrafficMonitor()
         self.filter_condition = ""
+        self.flows = FlowTable(max_flows)
+        self.flow_view = FlowView(self.flows)
+        self.columns = PacketColumns(flows=self.flows, max_packets=max_packets)
+        # 界面已取出的数据包数和字节数，每次刷新按新取出的一批累加
+        self.packet_count = 0
+        self.total_bytes = 0
+        # 过滤条件变化后等到下一次刷新再重建列表，连续输入只重建一次
+        self.filter_dirty = False
         
     def compose(self) -> ComposeResult:
         """构建界面"""
@@ -523,49 +1188,40 @@ class MainContent(Container):
             # 右侧部分
             with Vertical():
                 yield self.traffic_monitor
+                yield self.flow_view
                 
     def apply_filter(self, filter_text: str):
         """应用过滤条件"""
         self.filter_condition = filter_text.lower()
-        self.refresh_filtered_list()
+        if hasattr(self, 'capture'):
+            self.capture.set_filter(self.filter_condition)
+        self.filter_dirty = True
         
     def refresh_filtered_list(self):
-        """刷新过滤后的列表"""
-        self.filtered_list.clear()
-        
-        if hasattr(self, 'capture'):
-            for packet in self.capture.packet_list:
-                if self._packet_matches_filter(packet):
-                    self.filtered_list.add_packet(packet)
-                    
-    def _packet_matches_filter(self, packet: Packet) -> bool:
-        """检查数据包是否匹配过滤条件"""
-        if not self.filter_condition:
-            return True
-            
-        filter_parts = self.filter_condition.split('/')
-        for part in filter_parts:
-            if not part:
-                continue
-                
-            if '=' in part:
-                key, value = part.split('=', 1)
-                if key == 'ip':
-                    if value not in (packet.src_ip, packet.dst_ip):
-                        return False
-                elif key == 'port':
-                    port = int(value)
-                    if port not in (packet.src_port, packet.dst_port):
-                        return False
-            else:
-                if part == 'tcp' and packet.protocol != 'TCP':
-                    return False
-                elif part == 'udp' and packet.protocol != 'UDP':
-                    return False
-                elif part == 'http' and packet.protocol != 'HTTP':
-                    return False
-                    
-        return True
+        """刷新过滤后的列表: 对全部历史计算掩码，只挂载最新的匹配"""
+        self.filter_dirty = False
+        rows = self.columns.matches(self.filter_condition)[-FilteredPacketList.MAX_ITEMS:].tolist()
+        self.filtered_list.show_packets([self.columns.packet(row) for row in rows], rows)
+
+    def add_packets(self, packets: List[Packet]):
+        """追加新取出的数据包，累加计数，只对新增的行计算掩码"""
+        self.packet_count += len(packets)
+        self.total_bytes += sum(packet.length for packet in packets)
+        start = self.columns.end
+        self.columns.extend(packets)
+        rows = self.columns.matches(self.filter_condition, start).tolist()
+        self.filtered_list.add_packets([packets[row - start] for row in rows], rows)
+
+    def clear(self):
+        """清除全部数据包、计数和流表"""
+        self.filtered_list.reset()
+        self.columns.clear()
+        self.flows.clear()
+        self.packet_count = 0
+        self.total_bytes = 0
+
+    def packet_at(self, row: int) -> Optional[Packet]:
+        return self.columns.packet(row)
 
 class PacketDetails(Static):
     """数据包详情组件"""
@@ -608,11 +1264,17 @@ class WiresharkApp(App):
     
     TrafficMonitor {
         width: 100%;
-        height: 100%;
+        height: 12;
         border: solid yellow;
         content-align: center middle;
     }
     
+    FlowView {
+        width: 100%;
+        height: 1fr;
+        border: solid magenta;
+    }
+    
     PacketDetails {
         height: 30%;
         border: solid blue;
@@ -622,13 +1284,23 @@ class WiresharkApp(App):
     BINDINGS = [
         Binding("q", "quit", "退出"),
         Binding("c", "clear", "清除"),
+        Binding("s", "sort_flows", "连接排序"),
     ]
     
-    def __init__(self, interface: str):
+    def __init__(self, interface: Optional[str], backend: str = 'recv', batch_size: int = 64,
+                 kernel_filter: bool = False, workers: int = 1,
+                 read_file: Optional[str] = None, fast: bool = False,
+                 writer: Optional[RotatingPcapWriter] = None, max_flows: int = 1_000_000,
+                 max_packets: int = 200_000):
         super().__init__()
         self.interface = interface
-        self.capture = PacketCapture()
-        self.main_content = MainContent()
+        self.read_file = read_file
+        self.fast = fast
+        self.capture = PacketCapture(backend=backend, batch_size=batch_size,
+                                     kernel_filter=kernel_filter, workers=workers,
+                                     writer=writer)
+        self.main_content = MainContent(max_flows, max_packets)
+        self.main_content.capture = self.capture
         self.packet_details = PacketDetails()
         
     def compose(self) -> ComposeResult:
@@ -640,33 +1312,32 @@ class WiresharkApp(App):
         
     def on_mount(self) -> None:
         """挂载启动捕获"""
-        self.capture.start(self.interface)
+        if self.read_file:
+            self.capture.start_file(self.read_file, self.fast)
+        else:
+            self.capture.start(self.interface)
         self.set_interval(0.1, self.update_display)
+        # 连接列表只在上次的前 N 个和此后更新过的流中排序，仍比数据包列表刷新得慢一些
+        self.set_interval(1.0, self.main_content.flow_view.refresh_flows)
         
     def update_display(self):
         """更新显示"""
         try:
-            packets_count = len(self.capture.packet_list)
-            total_bytes = sum(packet.length for packet in self.capture.packet_list)
-            
-            logger.debug(f"更新显示 - 数据包数: {packets_count}, 总字节数: {total_bytes}")
-            
-            # 更新流量监控
-            self.main_content.traffic_monitor.update_traffic(total_bytes, packets_count)
-            
             # 批量处理数据包
-            processed_count = 0
-            while not self.capture.packets.empty():
-                try:
-                    packet = self.capture.packets.get_nowait()
-                    if self.main_content._packet_matches_filter(packet):
-                        self.main_content.filtered_list.add_packet(packet)
-                    processed_count += 1
-                except queue.Empty:
-                    break
+            if self.main_content.filter_dirty:
+                self.main_content.refresh_filtered_list()
+            packets = self.capture.packets.drain()
+            self.main_content.add_packets(packets)
+            processed_count = len(packets)
                     
             if processed_count > 0:
                 logger.debug(f"本次更新处理了 {processed_count} 个数据包")
+
+            # 更新流量监控，计数随每批累加，不遍历历史
+            self.main_content.traffic_monitor.update_traffic(
+                self.main_content.total_bytes, self.main_content.packet_count,
+                self.capture.get_stats()
+            )
                 
         except Exception as e:
             logger.error(f"更新显示时出错: {e}")
@@ -675,10 +1346,11 @@ class WiresharkApp(App):
         """处理列表选择事件"""
         if isinstance(message.item, ListItem):
             try:
-                # 获取选中的数据包并显示详情
-                selected_index = len(self.main_content.filtered_list.children) - self.main_content.filtered_list.children.index(message.item) - 1
-                if 0 <= selected_index < len(self.capture.packet_list):
-                    packet = self.capture.packet_list[selected_index]
+                # 列表项的 name 为数据包的行号
+                if message.item.name is None:
+                    return
+                packet = self.main_content.packet_at(int(message.item.name))
+                if packet is not None:
                     self.packet_details.show_packet(packet)
             except Exception as e:
                 logger.error(f"显示数据包详情出错: {e}")
@@ -693,18 +1365,18 @@ class WiresharkApp(App):
             logger.error(f"退出时停止捕获出错: {e}")
         finally:
             self.exit()
+
+    def action_sort_flows(self):
+        """切换连接列表的排序方式"""
+        self.main_content.flow_view.cycle_sort()
         
     def action_clear(self):
         """清除动作"""
-        self.main_content.filtered_list.clear()
         self.packet_details.update("选择数据包查看详情")
-        # 同时清除捕获器中的数据包列表
-        self.capture.packet_list.clear()
-        while not self.capture.packets.empty():
-            try:
-                self.capture.packets.get_nowait()
-            except queue.Empty:
-                break
+        # 同时清除捕获器中尚未取出的数据包
+        self.capture.packets.clear()
+        self.main_content.clear()
+        self.main_content.flow_view.refresh_flows()
 
 def get_interfaces() -> List[Dict[str, Any]]:
     """获取网络接口列表
@@ -797,7 +1469,62 @@ def get_interfaces() -> List[Dict[str, Any]]:
             
     return interfaces
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Textual Wireshark')
+    parser.add_argument('-b', '--backend',
+                        choices=PacketCapture.BACKENDS,
+                        help='捕获后端: recv (逐包接收), batch (批量接收) 或 ring (TPACKET_V3 内存映射环)',
+                        default='recv')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='batch 后端每次唤醒最多接收的帧数')
+    parser.add_argument('-k', '--kernel-filter', action='store_true',
+                        help='将过滤条件编译为 BPF 在内核中过滤 (不匹配的数据包不会进入历史记录)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='PACKET_FANOUT 工作进程数，大于 1 时按流哈希分流到多个进程解析')
+    parser.add_argument('-r', '--read', metavar='FILE',
+                        help='读取 pcap/pcapng 文件而不是实时捕获')
+    parser.add_argument('--fast', action='store_true',
+                        help='读取文件时不按原始时间间隔回放，尽快处理')
+    parser.add_argument('--write', metavar='PREFIX',
+                        help='将捕获的原始帧写入轮转的 pcap 文件 (例如 captures/eth0)')
+    parser.add_argument('--rotate-size', type=int, default=100,
+                        help='单个 pcap 文件的大小上限 (MB)')
+    parser.add_argument('--rotate-seconds', type=float, default=0,
+                        help='按时间轮转 pcap 文件的间隔 (秒)，0 表示不按时间轮转')
+    parser.add_argument('--max-total', type=int, default=0,
+                        help='所有 pcap 文件的总大小上限 (MB)，超出时删除最旧的文件，0 表示不限制')
+    parser.add_argument('--max-flows', type=int, default=1_000_000,
+                        help='跟踪的连接数上限，超出时提前淘汰最早到期的连接')
+    parser.add_argument('--max-packets', type=int, default=200_000,
+                        help='界面保留的历史数据包数上限，超出时丢弃最早的')
+    return parser.parse_args()
+
+def create_writer(args) -> Optional[RotatingPcapWriter]:
+    """根据命令行参数创建 pcap 写入器"""
+    if not args.write:
+        return None
+    return RotatingPcapWriter(
+        args.write,
+        max_file_bytes=args.rotate_size * 1024 * 1024,
+        rotate_seconds=args.rotate_seconds,
+        max_total_bytes=args.max_total * 1024 * 1024,
+    )
+
 def main():
+    args = parse_args()
+    
+    # 离线文件模式不需要选择接口和root权限
+    if args.read:
+        try:
+            app = WiresharkApp(None, read_file=args.read, fast=args.fast,
+                               writer=create_writer(args), max_flows=args.max_flows,
+                               max_packets=args.max_packets)
+            app.run()
+        except Exception as e:
+            print(f"程序错误: {e}")
+            logger.exception("程序异常退出")
+        return
+        
     # 检查是否有root权限
     if os.geteuid() != 0:
         print("错误: 需要root权限能捕获数据包")
@@ -834,7 +1561,10 @@ def main():
                 print("请输入有效的数字")
                 
         # 启动应用
-        app = WiresharkApp(interface)
+        app = WiresharkApp(interface, backend=args.backend, batch_size=args.batch_size,
+                           kernel_filter=args.kernel_filter, workers=args.workers,
+                           writer=create_writer(args), max_flows=args.max_flows,
+                           max_packets=args.max_packets)
         app.run()
         
     except KeyboardInterrupt:
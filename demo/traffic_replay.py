@@ -0,0 +1,398 @@
+"""流量回放 / 合成数据包生成器
+
+按可配置的速率 (pps)、突发形态、协议比例和 HTTP 占比生成确定性的以太网帧，
+或者循环回放 pcap 文件，用于在没有真实网络的 Linux 机器上压测抓包程序:
+
+- textual / asciimatics / http: 直接注入对应程序的抓包回调
+- iface: 通过 AF_PACKET 套接字发送到指定接口 (lo 或 veth)，由正在运行的程序捕获，
+  处理量由独立的接收进程在接收端接口上抓包统计
+
+结束时输出目标速率、实际速率以及处理量和丢失量。
+
+示例:
+    python traffic_replay.py textual --pps 50000 --duration 5
+    python traffic_replay.py asciimatics --shape burst --burst 256 --mix tcp=50,udp=50
+    sudo python traffic_replay.py iface -i lo --pcap capture.pcap
+"""
+import argparse
+import logging
+import multiprocessing
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from capture_backend import read_packet_stats
+from fast_dissect import LINKTYPE_ETHERNET
+from pcap_file import PcapReader
+
+logger = logging.getLogger(__name__)
+
+PROTO_NUMBERS = {'tcp': 6, 'udp': 17, 'icmp': 1}
+
+HTTP_REQUEST = b'GET /index.html HTTP/1.1\r\nHost: example.com\r\nUser-Agent: replay\r\n\r\n'
+HTTP_RESPONSE = (b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 12\r\n\r\n'
+                 b'hello world!')
+
+
+def build_frame(proto: int, src: str, dst: str, sport: int = 0, dport: int = 0,
+                payload: bytes = b'', src_mac: bytes = b'\x02\x00\x00\x00\x00\x01',
+                dst_mac: bytes = b'\x02\x00\x00\x00\x00\x02', seq: int = 0) -> bytes:
+    """构造以太网 + IPv4 + TCP/UDP/ICMP 帧"""
+    if proto == 6:
+        l4 = struct.pack('!HHLLBBHHH', sport, dport, seq, 0, 5 << 4, 0x18, 65535, 0, 0)
+    elif proto == 17:
+        l4 = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0)
+    else:
+        l4 = struct.pack('!BBHI', 8, 0, 0, 0)
+    total = 20 + len(l4) + len(payload)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, total, 0, 0, 64, proto, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return dst_mac + src_mac + b'\x08\x00' + ip + l4 + payload
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析协议比例，例如 tcp=60,udp=30,icmp=10"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().lower()
+        if name not in PROTO_NUMBERS:
+            raise ValueError(f"不支持的协议: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class SyntheticTraffic:
+    """确定性的合成流量
+
+    预先按随机种子生成 pool_size 个帧并循环使用，生成开销不计入压测。
+    """
+    linktype = LINKTYPE_ETHERNET
+
+    def __init__(self, mix: Dict[str, float], http_share: float = 0.2,
+                 flows: int = 1000, seed: int = 1, pool_size: int = 4096,
+                 payload_size: int = 64):
+        rng = random.Random(seed)
+        names = list(mix)
+        weights = [mix[name] for name in names]
+
+        flow_table = []
+        for _ in range(flows):
+            proto = PROTO_NUMBERS[rng.choices(names, weights)[0]]
+            is_http = proto == 6 and rng.random() < http_share
+            flow_table.append((
+                proto,
+                f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+                f"192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+                rng.randrange(1024, 65535),
+                80 if is_http else rng.choice((22, 53, 443, 3306, 8443)),
+                is_http,
+            ))
+
+        self.frames: List[bytes] = []
+        for i in range(pool_size):
+            proto, src, dst, sport, dport, is_http = rng.choice(flow_table)
+            if is_http:
+                # 请求和响应交替出现
+                if rng.random() < 0.5:
+                    frame = build_frame(proto, src, dst, sport, dport, HTTP_REQUEST, seq=i)
+                else:
+                    frame = build_frame(proto, dst, src, dport, sport, HTTP_RESPONSE, seq=i)
+            else:
+                frame = build_frame(proto, src, dst, sport, dport, bytes(payload_size), seq=i)
+            self.frames.append(frame)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            yield from self.frames
+
+
+class PcapTraffic:
+    """循环回放 pcap/pcapng 文件中的帧
+
+    注入目标一次只接受一种链路类型，linktype 取第一条记录的链路类型，
+    pcapng 中其他链路类型接口的记录被跳过并给出警告。
+    """
+    def __init__(self, path: str):
+        reader = PcapReader(path)
+        self.linktype = reader.linktype
+        self.frames: List[bytes] = []
+        skipped: Dict[int, int] = {}
+        for index, (_, frame, linktype) in enumerate(reader):
+            if index == 0:
+                self.linktype = linktype
+            if linktype == self.linktype:
+                self.frames.append(bytes(frame))
+            else:
+                skipped[linktype] = skipped.get(linktype, 0) + 1
+        reader.close()
+        for linktype, count in skipped.items():
+            logger.warning(f"跳过 {count} 条链路类型为 {linktype} 的记录 "
+                           f"(回放的链路类型为 {self.linktype})")
+        if not self.frames:
+            raise ValueError(f"捕获文件中没有数据包: {path}")
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            yield from self.frames
+
+
+def paced(frames: Iterator[bytes], pps: float, duration: float, shape: str = 'constant',
+          burst: int = 1, seed: int = 1) -> Iterator[bytes]:
+    """按目标速率和突发形态产出帧，pps 为 0 时尽快产出
+
+    constant: 匀速；burst: 每次连续产出 burst 个帧后等待；
+    poisson: 帧间隔服从指数分布。
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    deadline = start + duration
+    next_due = start
+    sent = 0
+    for frame in frames:
+        now = time.perf_counter()
+        if now >= deadline:
+            return
+        if pps > 0 and now < next_due:
+            time.sleep(next_due - now)
+        yield frame
+        sent += 1
+        if pps > 0:
+            if shape == 'poisson':
+                next_due += rng.expovariate(pps)
+            elif shape == 'burst':
+                if sent % burst == 0:
+                    next_due = start + sent / pps
+            else:
+                next_due = start + sent / pps
+
+
+class QueueDrainer:
+    """模拟界面刷新: 按固定间隔批量取空交接缓冲区并计数"""
+    def __init__(self, packet_queue, interval: float = 0.1):
+        self.packet_queue = packet_queue
+        self.interval = interval
+        self.received = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.interval)
+            self.received += len(self.packet_queue.drain())
+
+    def stop(self) -> int:
+        self._running = False
+        self._thread.join()
+        self.received += len(self.packet_queue.drain())
+        return self.received
+
+
+def inject(frames: Iterator[bytes], handler) -> Dict[str, float]:
+    """把帧逐个交给 handler，只统计注入阶段的耗时 (不含目标初始化)"""
+    sent = 0
+    start = time.perf_counter()
+    for frame in frames:
+        handler(frame)
+        sent += 1
+    return {'sent': sent, 'elapsed': time.perf_counter() - start}
+
+
+def run_textual(frames: Iterator[bytes], linktype: int = LINKTYPE_ETHERNET) -> Dict[str, float]:
+    """注入 textual_wireshark.PacketCapture 的帧处理路径"""
+    from textual_wireshark import PacketCapture
+
+    capture = PacketCapture()
+    capture.running = True
+    capture.linktype = linktype
+    drainer = QueueDrainer(capture.packets)
+    result = inject(frames, lambda frame: capture._handle_frame(frame, time.time_ns()))
+    result['received'] = drainer.stop()
+    return result
+
+
+def run_asciimatics(frames: Iterator[bytes], linktype: int = LINKTYPE_ETHERNET) -> Dict[str, float]:
+    """注入 asciimatics_wireshark.PacketCapture 的原生引擎帧处理路径"""
+    from asciimatics_wireshark import PacketCapture
+
+    capture = PacketCapture(engine='raw')
+    capture._running = True
+    capture.linktype = linktype
+    drainer = QueueDrainer(capture.packets)
+    result = inject(frames, lambda frame: capture._handle_raw_frame(frame, time.time_ns()))
+    result['received'] = drainer.stop()
+    return result
+
+
+def run_http(frames: Iterator[bytes], linktype: int = LINKTYPE_ETHERNET) -> Dict[str, float]:
+    """注入 http_sniffer.HttpSnifferApp.handle_packet
+
+    不启动界面，跨线程的界面调用只计数，用来衡量每个包产生的事件循环唤醒次数。
+    事件环按界面的刷新周期取空，处理量为抓包回调实际看到的数据包数 (packets_seen)，
+    另外统计发布、送达和因事件环已满而丢弃的事件数。
+    """
+    from scapy.all import Raw, conf
+    from http_sniffer import HttpSnifferApp
+
+    layer = conf.l2types.get(linktype, Raw)
+    app = HttpSnifferApp()
+    ui_calls = 0
+
+    def count_ui_call(callback, *args, **kwargs):
+        nonlocal ui_calls
+        ui_calls += 1
+
+    app.call_from_thread = count_ui_call
+    drainer = QueueDrainer(app.events, app.EVENT_INTERVAL)
+    result = inject(frames, lambda frame: app.handle_packet(layer(frame)))
+    result['events_delivered'] = drainer.stop()
+    result['received'] = app.packets_seen
+    result['ui_calls'] = ui_calls
+    result['events'] = app.events_published
+    result['events_dropped'] = app.events_dropped
+    return result
+
+
+# linux/if_packet.h，本机发出的帧
+PACKET_OUTGOING = 4
+
+
+def _iface_receiver(interface: str, frames: List[bytes], ready, stop, results):
+    """接收进程: 在接口上抓包，统计收到的、属于回放帧集合的帧和内核丢包
+
+    在独立进程中运行，不与发送方争抢 GIL；本机发出的副本 (PACKET_OUTGOING) 不计入。
+    """
+    expected = set(frames)
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**25)
+    sock.bind((interface, 0))
+    sock.settimeout(0.1)
+    buffer = bytearray(65535)
+    received = 0
+    ready.set()
+    idle_after_stop = 0
+    # 发送结束后继续接收，直到连续两次超时
+    while idle_after_stop < 2:
+        try:
+            nbytes, address = sock.recvfrom_into(buffer)
+        except socket.timeout:
+            if stop.is_set():
+                idle_after_stop += 1
+            continue
+        if address[2] != PACKET_OUTGOING and bytes(buffer[:nbytes]) in expected:
+            received += 1
+    _, drops = read_packet_stats(sock)
+    sock.close()
+    results.put((received, drops))
+
+
+def run_iface(frames: Iterator[bytes], interface: str, pool: List[bytes],
+              capture_interface: Optional[str] = None,
+              linktype: int = LINKTYPE_ETHERNET) -> Dict[str, float]:
+    """通过 AF_PACKET 套接字把帧发送到接口上，并在 capture_interface 上接收计数
+
+    pool 为回放的帧集合，接收方只统计其中的帧；capture_interface 省略时与发送接口相同
+    (lo)，veth 对应传入对端接口。
+    """
+    if linktype != LINKTYPE_ETHERNET:
+        raise ValueError(f"iface 目标只能发送以太网帧，当前链路类型为 {linktype}")
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    receiver = multiprocessing.Process(
+        target=_iface_receiver,
+        args=(capture_interface or interface, pool, ready, stop, results), daemon=True)
+    receiver.start()
+    if not ready.wait(5):
+        receiver.terminate()
+        raise RuntimeError("接收进程未能启动")
+
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    sock.bind((interface, 0))
+    errors = 0
+
+    def send(frame: bytes):
+        nonlocal errors
+        try:
+            sock.send(frame)
+        except OSError:
+            # ENOBUFS 等发送失败
+            errors += 1
+
+    try:
+        result = inject(frames, send)
+    finally:
+        sock.close()
+        stop.set()
+    result['received'], result['kernel_drops'] = results.get()
+    receiver.join()
+    result['send_errors'] = errors
+    return result
+
+
+def report(target: str, pps: float, result: Dict[str, float]):
+    """输出压测结果"""
+    sent = result['sent']
+    elapsed = result['elapsed']
+    received = result['received']
+    lost = sent - received
+    print(f"目标: {target}")
+    print(f"目标速率: {pps:.0f} 包/秒" if pps else "目标速率: 尽快")
+    print(f"实际速率: {sent / elapsed:.0f} 包/秒 ({sent} 个, {elapsed:.2f} 秒)")
+    print(f"处理: {received} 个, 丢失: {lost} 个 ({lost / sent * 100 if sent else 0:.2f}%)")
+    if 'ui_calls' in result:
+        print(f"界面调用: {result['ui_calls']} 次 ({result['ui_calls'] / sent if sent else 0:.2f} 次/包)")
+    if 'events' in result:
+        print(f"界面事件: {result['events']} 个 ({result['events'] / sent if sent else 0:.2f} 个/包)，"
+              f"界面按固定周期批量处理，送达 {result['events_delivered']} 个，"
+              f"事件环已满丢弃 {result['events_dropped']} 个")
+    if 'send_errors' in result:
+        print(f"发送失败: {result['send_errors']} 个, 接收方内核丢包: {result['kernel_drops']} 个")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='合成流量生成与回放')
+    parser.add_argument('target', choices=('textual', 'asciimatics', 'http', 'iface'),
+                        help='注入目标')
+    parser.add_argument('-i', '--interface', default='lo', help='iface 目标使用的接口')
+    parser.add_argument('--capture-interface',
+                        help='iface 目标接收计数的接口，默认与发送接口相同，veth 时传入对端')
+    parser.add_argument('--pps', type=float, default=10000, help='目标速率 (包/秒)，0 表示尽快')
+    parser.add_argument('--duration', type=float, default=5, help='持续时间 (秒)')
+    parser.add_argument('--shape', choices=('constant', 'burst', 'poisson'), default='constant',
+                        help='突发形态')
+    parser.add_argument('--burst', type=int, default=64, help='burst 形态下每次突发的帧数')
+    parser.add_argument('--mix', default='tcp=60,udp=30,icmp=10', help='协议比例')
+    parser.add_argument('--http-share', type=float, default=0.2, help='TCP 流中 HTTP 流的比例')
+    parser.add_argument('--flows', type=int, default=1000, help='合成流的数量')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--pcap', help='回放 pcap/pcapng 文件而不是生成合成流量')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.pcap:
+        source = PcapTraffic(args.pcap)
+    else:
+        source = SyntheticTraffic(parse_mix(args.mix), args.http_share, args.flows, args.seed)
+    frames = paced(iter(source), args.pps, args.duration, args.shape, args.burst, args.seed)
+
+    if args.target == 'textual':
+        result = run_textual(frames, source.linktype)
+    elif args.target == 'asciimatics':
+        result = run_asciimatics(frames, source.linktype)
+    elif args.target == 'http':
+        result = run_http(frames, source.linktype)
+    else:
+        result = run_iface(frames, args.interface, source.frames, args.capture_interface,
+                           source.linktype)
+    report(args.target, args.pps, result)
+
+
+if __name__ == "__main__":
+    main()